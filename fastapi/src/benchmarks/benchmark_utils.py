@@ -0,0 +1,169 @@
+'''Helpers shared by the offline benchmarks: deterministic embeddings, synthetic documents and timing.'''
+import io
+import json
+import math
+import time
+import random
+import hashlib
+import platform
+import statistics
+import subprocess
+
+TOPICS = {
+    'education': ('school', 'students', 'teachers', 'curriculum', 'classroom', 'learning', 'literacy', 'tutoring'),
+    'health': ('clinic', 'patients', 'nurses', 'screening', 'treatment', 'prevention', 'vaccination', 'care'),
+    'environment': ('river', 'habitat', 'restoration', 'emissions', 'wetland', 'species', 'monitoring', 'soil'),
+    'budget': ('budget', 'costs', 'salaries', 'equipment', 'overhead', 'match', 'expenses', 'audit'),
+}
+COMMON = ('the', 'project', 'will', 'our', 'and', 'with', 'for', 'community', 'program', 'each', 'year')
+
+class FakeEmbeddings:
+    """Deterministic offline embeddings with the langchain Embeddings interface: a normalised, hashed
+    bag of words. Texts that share words are close, so semantic chunking still finds topic changes.
+    Counts every text it embeds"""
+
+    model = 'fake-hashed-bag-of-words'
+
+    def __init__(self, dimensions, latency_per_call=0.0):
+        self.dimensions = dimensions
+        self.latency_per_call = latency_per_call
+        self.texts_embedded = 0
+        self.calls = 0
+
+    def _bucket(self, word):
+        return int.from_bytes(hashlib.md5(word.encode()).digest()[:4], 'little') % self.dimensions
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimensions
+        for word in text.lower().split():
+            vector[self._bucket(word.strip('.,;:!?()'))] += 1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        if self.latency_per_call:
+            time.sleep(self.latency_per_call) # stands in for the network round trip
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def synthetic_sentences(count, seed=0):
+    '''sentences about one topic at a time, switching topic every 5 to 15 sentences'''
+    rng = random.Random(seed)
+    sentences, topic, left = [], None, 0
+    for _ in range(count):
+        if left == 0:
+            topic, left = rng.choice(list(TOPICS)), rng.randint(5, 15)
+        words = [rng.choice(TOPICS[topic] if rng.random() < 0.6 else COMMON) for _ in range(rng.randint(8, 20))]
+        sentences.append(' '.join(words).capitalize() + '.')
+        left -= 1
+    return sentences
+
+def synthetic_text(chars, seed=0):
+    text, sentences = '', synthetic_sentences(max(1, chars // 60), seed)
+    for sentence in sentences:
+        if len(text) >= chars:
+            break
+        text += sentence + ' '
+    return text.strip()
+
+def _pdf_string(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def make_pdf(pages, lines_per_page=45, seed=0):
+    '''minimal valid PDF (Helvetica text, one content stream per page) as a BytesIO'''
+    sentences = synthetic_sentences(pages * lines_per_page, seed)
+    objects = [None, None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for page in range(pages):
+        lines = sentences[page * lines_per_page:(page + 1) * lines_per_page]
+        stream = 'BT /F1 9 Tf 12 TL 40 760 Td ' + ' T* '.join(f'({_pdf_string(line)}) Tj' for line in lines) + ' ET'
+        stream = stream.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_ref)
+        kids.append(b'%d 0 R' % len(objects))
+    objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), pages)
+
+    pdf = io.BytesIO()
+    pdf.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(pdf.tell())
+        pdf.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = pdf.tell()
+    pdf.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        pdf.write(b'%010d 00000 n \n' % offset)
+    pdf.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    pdf.seek(0)
+    return pdf
+
+def measure(name, func, repeat=5, warmup=1, setup=None, teardown=None, **params):
+    '''time func() repeat times after warmup runs; setup/teardown run around every call, untimed.
+    Whatever the last call of func returns under 'extra' (a dict) is added to the result'''
+    samples, extra = [], {}
+    for run in range(warmup + repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        returned = func()
+        seconds = time.perf_counter() - start
+        if teardown:
+            teardown()
+        if run >= warmup:
+            samples.append(seconds)
+            if isinstance(returned, dict):
+                extra = returned
+    samples.sort()
+    result = {
+        'name': name,
+        'params': params,
+        'repeat': repeat,
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, math.ceil(0.95 * len(samples)) - 1)] * 1000, 3),
+        'min_ms': round(samples[0] * 1000, 3),
+        **extra,
+    }
+    print(f"{name:<32} {json.dumps(params):<40} median {result['median_ms']:>10.2f} ms  p95 {result['p95_ms']:>10.2f} ms")
+    return result
+
+def result_key(result):
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except Exception:
+        return None
+
+def write_results(path, results, settings):
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'settings': settings,
+            'results': results,
+        }, f, indent=2)
+
+def compare_results(results, baseline_path, tolerance):
+    '''print the median ratio against a baseline results file, returns the keys slower than 1 + tolerance'''
+    with open(baseline_path) as f:
+        baseline = {result_key(result): result for result in json.load(f)['results']}
+    regressions = []
+    print(f'\ncompared with {baseline_path}')
+    for result in results:
+        if (before := baseline.get(result_key(result))) and before['median_ms']:
+            ratio = result['median_ms'] / before['median_ms']
+            flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+            print(f"{result_key(result):<72} {before['median_ms']:>10.2f} -> {result['median_ms']:>10.2f} ms  x{ratio:.2f} {flag}")
+            if flag:
+                regressions.append(result_key(result))
+    return regressions
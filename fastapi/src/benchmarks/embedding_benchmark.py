@@ -0,0 +1,75 @@
+'''Embedding throughput benchmark: OpenAI API against the local sentence-transformers backend.
+
+Embeds the same synthetic chunks with each provider, bypassing the embedding cache, and reports
+texts per second for a few batch sizes. Run from the fastapi directory:
+
+    python src/benchmarks/embedding_benchmark.py --texts 256 --batch-sizes 16 64 --output embeddings.json
+
+The openai provider is skipped when OPENAI_API_KEY is not set.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from src.utils import config
+from src.utils import langchain_utils
+
+WORDS = ('grant', 'research', 'community', 'budget', 'outcome', 'impact', 'proposal', 'evaluation',
+         'partner', 'timeline', 'objective', 'funding', 'school', 'health', 'data', 'training')
+
+def synthetic_texts(count, words_per_text, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(words_per_text)) + '.' for _ in range(count)]
+
+def benchmark(provider, texts, batch_size, threads):
+    if provider == 'local':
+        client = langchain_utils.LocalEmbeddings(batch_size=batch_size, threads=threads)
+        client.embed_query('warm up') # model load is not part of the measurement
+    else:
+        client = langchain_utils.embedding_provider('openai', openai_api_key=os.environ.get('OPENAI_API_KEY'))
+        client.chunk_size = batch_size # texts per request
+    start = time.perf_counter()
+    vectors = client.embed_documents(texts)
+    seconds = time.perf_counter() - start
+    return {
+        'provider': provider,
+        'model': client.model,
+        'batch_size': batch_size,
+        'texts': len(texts),
+        'dimensions': len(vectors[0]) if vectors else None,
+        'seconds': round(seconds, 4),
+        'texts_per_second': round(len(texts) / seconds, 1) if seconds else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--providers', nargs='+', default=['local', 'openai'], choices=['local', 'openai'])
+    parser.add_argument('--texts', type=int, default=256)
+    parser.add_argument('--words', type=int, default=200, help='words per text, 200 is roughly one chunk')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, config.LOCAL_EMBEDDING_BATCH_SIZE])
+    parser.add_argument('--threads', type=int, default=config.LOCAL_EMBEDDING_THREADS)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.texts, args.words)
+    results = []
+    for provider in args.providers:
+        if provider == 'openai' and not os.environ.get('OPENAI_API_KEY'):
+            print('skipping openai, OPENAI_API_KEY is not set')
+            continue
+        for batch_size in args.batch_sizes:
+            result = benchmark(provider, texts, batch_size, args.threads)
+            results.append(result)
+            print(f"{provider:<8} batch {batch_size:>4}: {result['texts_per_second']:>8} texts/s ({result['seconds']}s)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'threads': args.threads, 'words_per_text': args.words, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+'''Offline benchmarks for ingestion and retrieval: PDF extraction, semantic chunking, chunk inserts,
+rag_context at several corpus sizes, save_questions and the whole ingestion pipeline.
+
+Embeddings come from a deterministic fake provider, so no API key or network access is needed.
+Start the throwaway pgvector container first (port 5433, schema from pgvector/init.sql), then run
+from the fastapi directory:
+
+    docker compose -f src/benchmarks/docker-compose.yaml up -d
+    python src/benchmarks/ingest_retrieval_benchmark.py --output bench.json
+    python src/benchmarks/ingest_retrieval_benchmark.py --compare bench.json   # exits 1 on regressions
+
+Every row written uses a bench_ file name or the benchmark project id, and is deleted afterwards.
+'''
+import io
+import os
+import sys
+import argparse
+from math import ceil
+from types import SimpleNamespace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+os.environ.setdefault('DB_PORT', '5433') # the benchmark container, never the development database
+
+from src.utils import config
+from src.utils import pgvector_utils
+from src.utils import chunking_utils
+from src.utils import ingest_utils
+from src.benchmarks import benchmark_utils
+from src.benchmarks.benchmark_utils import FakeEmbeddings, measure
+
+BENCH_PROJECT_ID = 999999
+BENCHMARKS = ('pdf_extraction', 'semantic_chunking', 'insert_file_chunks', 'rag_context', 'save_questions', 'ingest_pipeline')
+
+def require(result, what):
+    if not result:
+        raise RuntimeError(f'{what} failed, see the ERROR output above')
+
+def cleanup():
+    with pgvector_utils.get_db_connection() as conn:
+        conn.execute("DELETE FROM file_chunks WHERE file_name LIKE 'bench_%'")
+        conn.execute("DELETE FROM files WHERE file_name LIKE 'bench_%'")
+        conn.execute("DELETE FROM questions WHERE project_id = %s", (BENCH_PROJECT_ID,))
+
+def delete_file(file_name):
+    with pgvector_utils.get_db_connection() as conn:
+        conn.execute("DELETE FROM file_chunks WHERE file_name = %s", (file_name,))
+        conn.execute("DELETE FROM files WHERE file_name = %s", (file_name,))
+
+def bench_pdf_extraction(args):
+    import PyPDF2
+    results = []
+    for pages in args.pdf_pages:
+        pdf = benchmark_utils.make_pdf(pages)
+        def extract():
+            reader = PyPDF2.PdfReader(pdf)
+            return {'chars': sum(len(page.extract_text()) for page in reader.pages)}
+        results.append(measure('pdf_extraction', extract, args.repeat, setup=lambda: pdf.seek(0), pages=pages))
+    return results
+
+def bench_semantic_chunking(args):
+    results = []
+    for chars in args.text_chars:
+        text = benchmark_utils.synthetic_text(chars)
+        for chunker in ('semantic', 'single_pass'):
+            def chunk_and_embed():
+                embeddings = FakeEmbeddings(args.dimensions, args.embedding_latency)
+                chunks = chunking_utils.chunk_text(text, embeddings, ceil(len(text) / config.CHUNK_SIZE), chunker)
+                if missing := [chunk_text for chunk_text, embedding in chunks if embedding is None]:
+                    embeddings.embed_documents(missing)
+                return {'chunks': len(chunks), 'texts_embedded': embeddings.texts_embedded, 'embedding_calls': embeddings.calls}
+            results.append(measure('semantic_chunking', chunk_and_embed, args.repeat, chars=chars, chunker=chunker))
+    return results
+
+def bench_insert_file_chunks(args):
+    results = []
+    embeddings = FakeEmbeddings(args.dimensions)
+    for rows in args.insert_rows:
+        texts = benchmark_utils.synthetic_sentences(rows)
+        chunks = [('bench_insert', text, embedding) for text, embedding in zip(texts, embeddings.embed_documents(texts))]
+        for mode, insert in (('insert', pgvector_utils.insert_file_chunks_into_db), ('copy', pgvector_utils.insert_file_chunks_into_db_bulk)):
+            results.append(measure('insert_file_chunks', lambda: require(insert(chunks), mode), args.repeat,
+                                   teardown=lambda: delete_file('bench_insert'), rows=rows, mode=mode))
+    return results
+
+def bench_rag_context(args):
+    results = []
+    embeddings = FakeEmbeddings(args.dimensions)
+    query_texts = benchmark_utils.synthetic_sentences(50, seed=1)
+    queries = [str(vector) for vector in embeddings.embed_documents(query_texts)]
+    stored = 0
+    for corpus_size in sorted(args.corpus_sizes):
+        # grow one corpus instead of rebuilding it, the HNSW index is maintained on insert
+        texts = benchmark_utils.synthetic_sentences(corpus_size - stored, seed=corpus_size)
+        pgvector_utils.insert_file_chunks_into_db_bulk(
+            ('bench_corpus', text, embedding) for text, embedding in zip(texts, embeddings.embed_documents(texts)))
+        stored = corpus_size
+        next_query = iter(queries * (args.repeat + 1))
+        results.append(measure('rag_context', lambda: require(pgvector_utils.rag_context(next(next_query), ['bench_corpus']), 'rag_context'),
+                               args.repeat * 10, corpus_size=corpus_size))
+        next_hybrid_query = iter(list(zip(queries, query_texts)) * (args.repeat + 1))
+        def hybrid_query():
+            query, query_text = next(next_hybrid_query)
+            require(pgvector_utils.rag_context(query, ['bench_corpus'], retrieval_mode='hybrid', question_text=query_text), 'rag_context hybrid')
+        results.append(measure('rag_context_hybrid', hybrid_query, args.repeat * 10, corpus_size=corpus_size))
+        results.append(measure('rag_context_batch', lambda: require(pgvector_utils.rag_context_batch(['bench_corpus'], queries[:10]), 'rag_context_batch'),
+                               args.repeat, corpus_size=corpus_size, queries=10, k=config.RAG_TOP_K))
+    delete_file('bench_corpus')
+    return results
+
+def bench_save_questions(args):
+    results = []
+    embeddings = FakeEmbeddings(args.dimensions)
+    for count in args.question_counts:
+        texts = benchmark_utils.synthetic_sentences(count, seed=2)
+        questions = SimpleNamespace(questions=[
+            SimpleNamespace(question=text, answer=text * 5, project_id=BENCH_PROJECT_ID, embedding=str(embedding), chat_history='[]')
+            for text, embedding in zip(texts, embeddings.embed_documents(texts))
+        ])
+        results.append(measure('save_questions', lambda: require(pgvector_utils.save_questions(BENCH_PROJECT_ID, questions), 'save_questions'),
+                               args.repeat, questions=count))
+    return results
+
+def bench_ingest_pipeline(args):
+    results = []
+    for pages in args.pipeline_pages:
+        file_name = f'bench_pipeline_{pages}.pdf'
+        pdf_bytes = benchmark_utils.make_pdf(pages).getvalue()
+        def ingest():
+            embeddings = FakeEmbeddings(args.dimensions, args.embedding_latency)
+            pipeline = ingest_utils.IngestPipeline(file_name, io.BytesIO(pdf_bytes), embeddings)
+            if not pipeline.run():
+                raise RuntimeError(f'ingestion failed: {pipeline.error}')
+            return {'chunks': pipeline.stats['insert'].items, 'texts_embedded': embeddings.texts_embedded}
+        results.append(measure('ingest_pipeline', ingest, args.repeat, teardown=lambda: delete_file(file_name), pages=pages))
+        ingest() # stored once more, so the next upload of the same bytes is a no-op
+        results.append(measure('ingest_pipeline_unchanged', ingest, args.repeat, pages=pages))
+        delete_file(file_name)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='small sizes only, for a smoke run')
+    parser.add_argument('--dimensions', type=int, default=config.EMBEDDING_DIMENSIONS)
+    parser.add_argument('--embedding-latency', type=float, default=0.0, help='seconds added to every fake embedding call')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare medians with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed median slowdown before --compare fails')
+    args = parser.parse_args()
+
+    sizes = {
+        'pdf_pages': [5, 50],
+        'text_chars': [20_000, 100_000],
+        'insert_rows': [200, 2_000],
+        'corpus_sizes': [1_000, 10_000, 50_000],
+        'question_counts': [20, 200],
+        'pipeline_pages': [20],
+    }
+    if args.quick:
+        sizes = {name: values[:1] for name, values in sizes.items()}
+        sizes['corpus_sizes'] = [1_000]
+    for name, values in sizes.items():
+        setattr(args, name, values)
+
+    cleanup()
+    results = []
+    try:
+        for name in args.only:
+            results += globals()[f'bench_{name}'](args)
+    finally:
+        cleanup()
+        pgvector_utils.close_db_pool()
+
+    settings = {'dimensions': args.dimensions, 'repeat': args.repeat, 'embedding_latency': args.embedding_latency,
+                'chunk_size': config.CHUNK_SIZE, 'quick': args.quick}
+    regressions = benchmark_utils.compare_results(results, args.compare, args.tolerance) if args.compare else []
+    if args.output:
+        benchmark_utils.write_results(args.output, results, settings)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
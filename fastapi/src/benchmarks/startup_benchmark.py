@@ -0,0 +1,99 @@
+'''Cold start benchmark: import time of every service module and of its heavy dependencies.
+
+Each import runs in a fresh interpreter so nothing is already cached in sys.modules.
+Run from the fastapi directory:
+
+    python src/benchmarks/startup_benchmark.py --repeat 3 --output startup.json
+'''
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+FASTAPI_DIR = Path(__file__).resolve().parents[2]
+
+SERVICE_MODULES = [
+    'src.utils.config',
+    'src.utils.pgvector_utils',
+    'src.utils.langchain_utils',
+    'src.utils.auto_gen_utils',
+    'src.utils.ingest_utils',
+    'src.utils.utils',
+    'src.utils.generation_utils',
+    'src.main',
+]
+
+# loaded on first use or by the WARMUP_ON_STARTUP hook
+LAZY_MODULES = [
+    'PyPDF2',
+    'langchain_openai',
+    'langchain_experimental.text_splitter',
+    'sentence_transformers',
+    'chromadb',
+    'autogen',
+    'autogen.agentchat.contrib.retrieve_user_proxy_agent',
+]
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+def import_time(module):
+    '''seconds to import module in a fresh interpreter, plus the slowest top level packages it pulled in'''
+    code = f'import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)'
+    env = {**os.environ, 'PYTHONPATH': str(FASTAPI_DIR)}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=FASTAPI_DIR, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'module': module, 'error': proc.stderr.strip().splitlines()[-1]}
+    packages = {}
+    for line in proc.stderr.splitlines():
+        if match := IMPORT_TIME_LINE.match(line):
+            _, cumulative, indent, name = match.groups()
+            top = name.split('.')[0]
+            if len(indent) == 1 and top != module.split('.')[0]: # imported directly, cumulative time includes its children
+                packages[top] = packages.get(top, 0) + int(cumulative) / 1e6
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        'module': module,
+        'seconds': float(proc.stdout.strip().splitlines()[-1]),
+        'slowest_packages': {name: round(seconds, 4) for name, seconds in slowest},
+    }
+
+def run(modules, repeat):
+    results = []
+    for module in modules:
+        runs = [import_time(module) for _ in range(repeat)]
+        if errors := [run['error'] for run in runs if 'error' in run]:
+            results.append({'module': module, 'error': errors[0]})
+            print(f'{module:<55} ERROR {errors[0]}')
+            continue
+        seconds = [run['seconds'] for run in runs]
+        result = {
+            'module': module,
+            'median_seconds': round(statistics.median(seconds), 4),
+            'min_seconds': round(min(seconds), 4),
+            'slowest_packages': runs[-1]['slowest_packages'],
+        }
+        results.append(result)
+        print(f"{module:<55} {result['median_seconds']:>8.3f}s  {result['slowest_packages']}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    print('service modules')
+    service = run(SERVICE_MODULES, args.repeat)
+    print('\nlazily imported dependencies')
+    lazy = run(LAZY_MODULES, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version, 'service_modules': service, 'lazy_modules': lazy}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
-from fastapi import FastAPI, UploadFile, File, Form, UploadFile, HTTPException, status
-from pydantic import BaseModel
-from typing import List, Annotated, Union, Set
+from fastapi import FastAPI, UploadFile, File, Form, UploadFile, HTTPException, status, Request, Query
+from fastapi.responses import StreamingResponse, Response, ORJSONResponse
+from pydantic import BaseModel, validator, conint
+from typing import List, Annotated, Union, Set, Literal
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 import uvicorn
+import asyncio
+import time
 import os 
+import io
 
 open_api_key = os.environ.get('OPENAI_API_KEY')
 
@@ -12,6 +18,10 @@ try:
     from src.utils import langchain_utils
     from src.utils import auto_gen_utils
     from src.utils import utils
+    from src.utils import async_utils
+    from src.utils import generation_utils
+    from src.utils import metrics_utils
+    from src.utils import vector_utils
     from src.utils import config
 except Exception as e:
     print(f'ERROR: {e}')
@@ -19,13 +29,59 @@ except Exception as e:
     from utils import langchain_utils
     from utils import auto_gen_utils
     from utils import utils
+    from utils import async_utils
+    from utils import generation_utils
+    from utils import metrics_utils
+    from utils import vector_utils
     from utils import config
 
 
 description = '''
 API for AI essay writing.
 '''
-app = FastAPI(description=description)
+def warm_up():
+    '''load the heavy dependencies that are otherwise imported by the first request using them'''
+    try:
+        start = time.perf_counter()
+        import PyPDF2
+        from langchain_experimental.text_splitter import SemanticChunker
+        langchain_utils.get_embeddings()
+        if config.EMBEDDING_PROVIDER == 'local':
+            langchain_utils.load_local_model(config.LOCAL_EMBEDDING_MODEL)
+        auto_gen_utils.warm_up()
+        print(f'INFO warm up done in {time.perf_counter() - start:.2f}s')
+    except Exception as e:
+        print(f'ERROR warm up: {e}')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if config.ASYNC_MODE:
+        await pgvector_utils.open_async_db_pool()
+    if config.WARMUP_ON_STARTUP:
+        # runs in the background so /healthcheck answers straight away
+        app.state.warm_up = asyncio.create_task(run_in_threadpool(warm_up))
+    yield
+    # return pooled DB connections on shutdown
+    utils.ingest_jobs.shutdown()
+    generation_utils.generation_jobs.shutdown()
+    async_utils.shutdown_executors()
+    await pgvector_utils.close_async_db_pool()
+    pgvector_utils.close_db_pool()
+
+app = FastAPI(description=description, lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # label by route template (/ingest_jobs/{job_id}) so job ids do not become separate series
+        route = request.scope.get('route')
+        metrics_utils.observe_request(request.method, getattr(route, 'path', 'unmatched'), status_code, time.perf_counter() - start)
 
 class Text(BaseModel):
     text: str
@@ -34,12 +90,43 @@ class Question(BaseModel):
     question: str
     answer: str
     project_id: int 
-    embedding: str
-    chat_history: str
+    # sent back as None when they were not fetched, save_questions then keeps the stored values
+    id: Union[int, None] = None
+    embedding: Union[str, None] = None # '[...]' text or base64 float32, see vector_utils
+    chat_history: Union[str, None] = None
+
+    @validator('embedding')
+    def decode_embedding(cls, embedding):
+        # decoded once here, pgvector_utils sends the array as a binary vector
+        return vector_utils.parse_vector(embedding)
 
 class Questions(BaseModel):
     questions: List[Question]
 
+class QuestionsUpsert(BaseModel):
+    questions: List[Question] = []
+    deleted_ids: List[int] = []
+
+class ProjectAnswers(BaseModel):
+    project_id: int
+    files: List[str] = []
+    question_ids: List[int] = []
+    concurrency: int = config.GENERATION_CONCURRENCY
+    review_mode: Literal['parallel', 'sequential'] = config.REVIEW_MODE
+
+class RagContextBatch(BaseModel):
+    files: List[str]
+    embeddings: List[str] = [] # '[...]' text or base64 float32
+    question_ids: List[int] = []
+    k: conint(ge=1, le=config.MAX_RAG_TOP_K) = config.RAG_TOP_K
+    ef_search: Union[conint(ge=1, le=config.MAX_HNSW_EF_SEARCH), None] = None
+    probes: Union[conint(ge=1, le=config.MAX_IVFFLAT_PROBES), None] = None
+
+@app.get("/metrics")
+def metrics():
+    '''Prometheus metrics: request, DB, embedding, LLM turn and pipeline stage latencies'''
+    return Response(content=metrics_utils.render(), media_type=metrics_utils.CONTENT_TYPE_LATEST)
+
 @app.get("/healthcheck")
 async def root():
     '''healthcheck endpoint'''
@@ -51,19 +138,43 @@ async def check_credentials():
     if open_api_key!='PLACE_YOUR_KEY_HERE':
         return 'OK' 
 
+BOOTSTRAP_TABLES = ('projects', 'files')
+
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+@app.get("/bootstrap", response_class=ORJSONResponse)
+async def bootstrap(request: Request):
+    '''projects, files and the credentials check in one response. The ETag changes with every write of
+    projects or files, a request with a matching If-None-Match gets 304 Not Modified without reading them'''
+    credentials = 'OK' if open_api_key != 'PLACE_YOUR_KEY_HERE' else None
+    versions = await async_utils.run_db(pgvector_utils.get_table_versions, pgvector_utils.get_table_versions_async, BOOTSTRAP_TABLES)
+    headers = {'Cache-Control': 'no-cache'}
+    # without the version counters (migration 005 not applied) the response is not cacheable
+    if versions and all(table in versions for table in BOOTSTRAP_TABLES):
+        headers['ETag'] = '"' + '-'.join(str(versions[table]) for table in BOOTSTRAP_TABLES) + f'-{int(credentials is not None)}"'
+        if etag_matches(request.headers.get('if-none-match', ''), headers['ETag']):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    projects, files = await asyncio.gather(*(
+        async_utils.run_db(pgvector_utils.query_data, pgvector_utils.query_data_async, table) for table in BOOTSTRAP_TABLES))
+    if projects is False or files is False:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+    return ORJSONResponse({'projects': projects, 'files': files, 'credentials': credentials}, headers=headers)
+
 @app.post("/create_project")
-async def create_project(project_name: str, project_description:str):
+def create_project(project_name: str, project_description:str):
     '''create project in DB'''
     if pgvector_utils.insert_project(project_name, project_description):
         return {"projectName": project_name}
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
 @app.post("/file_upload")
-async def file_upload(file_name: Annotated[str, Form()], file: List[UploadFile]):
+def file_upload(file_name: Annotated[str, Form()], file: List[UploadFile]):
     '''upload file to the DB'''
     file_bytes=file[0].file.read()
     if file_path := utils.save_file_locally(file_name,file_bytes):
-        if pgvector_utils.insert_file(file_name,file_path):
+        if pgvector_utils.insert_file(file_name):
             return {"filename": file_name}
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
@@ -71,24 +182,96 @@ async def file_upload(file_name: Annotated[str, Form()], file: List[UploadFile])
 async def file_upload_chunks(file_name: Annotated[str, Form()], file: List[UploadFile]):
     '''upload file to the DB split into chunks'''
     file=file[0].file 
-    if file_name := utils.save_file_chunks(file_name, file, open_api_key):
-        if pgvector_utils.insert_file(file_name):
+    # extraction and chunking are CPU bound, keep them off the event loop
+    try:
+        file_name = await async_utils.run_cpu_bound(utils.save_file_chunks, file_name, file, open_api_key)
+    except pgvector_utils.FileIngestInProgress as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if file_name:
+        if await run_in_threadpool(pgvector_utils.insert_file, file_name):
             return {"filename": file_name}
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
-@app.post("/get_data")
-def get_data_from_db(text: Text):
-    '''return all records from a given table'''
-    result = pgvector_utils.query_data(text.text)
+@app.post("/ingest_jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_ingest_job(file_name: Annotated[str, Form()], file: List[UploadFile]):
+    '''queue a file for background extract/chunk/embed/insert and return its job id at once'''
+    # the upload is closed when the response is sent, so the job gets its own copy of the bytes
+    file_bytes = io.BytesIO(await file[0].read())
+    job = utils.submit_ingest_job(file_name, file_bytes, open_api_key)
+    return job.as_dict()
+
+@app.get("/ingest_jobs")
+def list_ingest_jobs():
+    '''return the status of recent ingestion jobs'''
+    return [job.as_dict() for job in utils.ingest_jobs.list()]
+
+@app.get("/ingest_jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    '''return status and progress (pages, chunks done/left, errors) of an ingestion job'''
+    if job := utils.ingest_jobs.get(job_id):
+        return job.as_dict()
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown job {job_id}')
+
+def page_params(table_name, fields, limit):
+    if limit is not None and not 0 < limit <= config.MAX_PAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'limit must be between 1 and {config.MAX_PAGE_SIZE}')
+    try:
+        pgvector_utils.validate_fields(table_name, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+def decode_vectors(*values):
+    try:
+        return [vector_utils.parse_vector(value) for value in values]
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'invalid embedding: {e}')
+
+def format_embeddings(rows, table_name, embedding_format):
+    '''rows with their embedding column (array('f') or NULL) in the requested format'''
+    if 'embedding' not in pgvector_utils.TABLE_COLUMNS[table_name]:
+        return rows
+    ix = pgvector_utils.TABLE_COLUMNS[table_name].index('embedding')
+    return [(*row[:ix], vector_utils.format_vector(row[ix], embedding_format), *row[ix + 1:]) for row in rows]
+
+def set_next_page(response, rows, limit):
+    # a full page may have more rows after it, pass its last id back as after_id
+    if limit and len(rows) == limit:
+        response.headers['X-Next-After-Id'] = str(rows[-1][0])
+
+@app.post("/get_data", response_class=ORJSONResponse)
+async def get_data_from_db(text: Text, response: Response, fields: Annotated[Union[List[str], None], Query()] = None,
+                           after_id: int = 0, limit: Union[int, None] = None, embedding_format: Literal['json', 'base64'] = 'json'):
+    '''return the records of a given table ordered by id. Heavy columns (embedding, chat_history) are NULL
+    unless listed in fields; pass after_id and limit to page through them'''
+    page_params(text.text, fields, limit)
+    result = await async_utils.run_db(pgvector_utils.query_data, pgvector_utils.query_data_async, text.text, fields, after_id, limit)
     if result != False:
-        return result
+        set_next_page(response, result, limit)
+        return format_embeddings(result, text.text, embedding_format)
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
-@app.get("/get_questions")
-def get_questions_from_db(project_id: str):
-    '''return all questions for a given project_id'''
-    result = pgvector_utils.query_questions(project_id)
+@app.get("/get_questions", response_class=ORJSONResponse)
+async def get_questions_from_db(project_id: str, response: Response, fields: Annotated[Union[List[str], None], Query()] = None,
+                                after_id: int = 0, limit: Union[int, None] = None, embedding_format: Literal['json', 'base64'] = 'json'):
+    '''return the questions of a given project_id ordered by id, without embedding and chat_history
+    unless listed in fields; pass after_id and limit to page through them'''
+    page_params('questions', fields, limit)
+    result = await async_utils.run_db(pgvector_utils.query_questions, pgvector_utils.query_questions_async, project_id, fields, after_id, limit)
     if result != False:
+        set_next_page(response, result, limit)
+        return format_embeddings(result, 'questions', embedding_format)
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+
+@app.get("/get_question_fields", response_class=ORJSONResponse)
+async def get_question_fields(question_id: int, fields: Annotated[List[str], Query()], embedding_format: Literal['json', 'base64'] = 'json'):
+    '''return the given fields of one question, e.g. its chat_history when it is displayed'''
+    page_params('questions', fields, None)
+    result = await async_utils.run_db(pgvector_utils.query_question_fields, pgvector_utils.query_question_fields_async, question_id, fields)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown question {question_id}')
+    if result != False:
+        if 'embedding' in result:
+            result['embedding'] = vector_utils.format_vector(result['embedding'], embedding_format)
         return result
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
@@ -99,13 +282,61 @@ def save_questions_to_db(project_id: str, questions: Questions):
         return {'result':result}
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
-@app.post("/get_embeddings")
-def open_ai_embeddings(text: Text):
-    '''return embeddings from text'''
-    if result := langchain_utils.get_open_ai_embeddings(text.text):
-        return result 
+@app.post("/upsert_questions")
+def upsert_questions(project_id: int, upsert: QuestionsUpsert):
+    '''update the questions that have an id and changed, insert the others and delete deleted_ids, in one transaction'''
+    if (result := pgvector_utils.upsert_questions(project_id, upsert.questions, upsert.deleted_ids)) != False:
+        return result
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+
+@app.post("/questions", status_code=status.HTTP_201_CREATED)
+def create_question(question: Question):
+    '''insert one question, returns its id'''
+    if question_id := pgvector_utils.insert_question(question):
+        return {'id': question_id}
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
+@app.put("/questions/{question_id}")
+def update_question(question_id: int, question: Question):
+    '''update one question, the stored embedding and chat history are kept when they are not sent'''
+    result = pgvector_utils.update_question(question_id, question)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown question {question_id}')
+    if result:
+        return {'id': question_id}
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+
+@app.delete("/questions/{question_id}")
+def delete_question(question_id: int):
+    '''delete one question'''
+    result = pgvector_utils.delete_question(question_id)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown question {question_id}')
+    if result:
+        return {'result': True}
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+
+@app.post("/get_embeddings", response_class=ORJSONResponse)
+async def open_ai_embeddings(text: Text, embedding_format: Literal['json', 'base64'] = 'json'):
+    '''return embeddings from text, as a float list or base64 little endian float32'''
+    if config.ASYNC_MODE:
+        result = await langchain_utils.aget_open_ai_embeddings(text.text)
+    else:
+        result = await run_in_threadpool(langchain_utils.get_open_ai_embeddings, text.text)
+    if result:
+        return vector_utils.format_vector(result, embedding_format)
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+
+@app.get("/embedding_cache_stats")
+def embedding_cache_stats():
+    '''return embedding cache hit/miss counters'''
+    return langchain_utils.get_embedding_cache_stats()
+
+@app.get("/answer_cache_stats")
+def answer_cache_stats():
+    '''return semantic answer cache hit/miss counters'''
+    return generation_utils.get_answer_cache_stats()
+
 # @app.post("/get_embeddings")
 # def read_item():
 #     result = pgvector_utils.get_embeddings()
@@ -116,9 +347,9 @@ def open_ai_embeddings(text: Text):
 #     return auto_gen_utils.manage_file_dir(files) 
 
 @app.post("/ask_auto_gen_question")
-def ask_rag_question(question: Annotated[str, Form()]):
+async def ask_rag_question(question: Annotated[str, Form()]):
     '''ask question via rag agent'''
-    res, context = auto_gen_utils.ask_rag_question_pgvector(question)
+    res, context = await async_utils.run_generation(auto_gen_utils.ask_rag_question_pgvector, question)
     if res and context:
         return res, context
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
@@ -131,18 +362,54 @@ def construct_agent(file_paths: Annotated[List[str], Form()], project_name: Anno
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
 @app.post("/construct_agent_group_chat")
-def construct_agent(qa_problem: Annotated[str, Form()], context: Annotated[str, Form()]):
-    '''construct multi agent autogen answer for question and context'''   
-    summary, chat_history = auto_gen_utils.ask_rag_question_maximum_feedback(qa_problem, context)
-    if summary and chat_history:
-        return {"summary":summary, "chat_history":chat_history} 
+async def construct_agent(qa_problem: Annotated[str, Form()], context: Annotated[str, Form()], review_mode: Annotated[Literal['parallel', 'sequential'], Form()] = config.REVIEW_MODE):
+    '''construct multi agent autogen answer for question and context, review_mode 'parallel' runs the reviewers concurrently'''   
+    result = await async_utils.run_generation(generation_utils.generate_answer, qa_problem, context, review_mode)
+    if result['summary'] and result['chat_history']:
+        return result
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
+@app.post("/construct_agent_group_chat_stream")
+async def construct_agent_stream(qa_problem: Annotated[str, Form()], context: Annotated[str, Form()], review_mode: Annotated[Literal['parallel', 'sequential'], Form()] = config.REVIEW_MODE):
+    '''same as /construct_agent_group_chat but streams each agent message (and token deltas if enabled) as Server-Sent Events'''
+    events = async_utils.stream_generation(generation_utils.generate_answer_stream, qa_problem, context, review_mode)
+    return StreamingResponse(events, media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.post("/generate_project_answers", status_code=status.HTTP_202_ACCEPTED)
+def generate_project_answers(request: ProjectAnswers):
+    '''answer all (or question_ids) questions of a project in the background, each answer is saved as soon as it is ready'''
+    job = generation_utils.submit_project_answers_job(request.project_id, request.files, request.question_ids, request.concurrency, request.review_mode)
+    return job.as_dict()
+
+@app.get("/generation_jobs/{job_id}")
+def get_generation_job(job_id: str):
+    '''return status and progress (total, done, failed, running) of a batch generation job'''
+    if job := generation_utils.generation_jobs.get(job_id):
+        return job.as_dict()
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown job {job_id}')
+
 @app.post("/get_rag_context")
-def get_rag_context(question: Annotated[str, Form()], files: Annotated[List[str], Form()]):
-    '''get rag context from question given file list '''
-    if result := pgvector_utils.rag_context(question, files):
-        return result 
+async def get_rag_context(question: Annotated[str, Form()], files: Annotated[List[str], Form()], ef_search: Annotated[Union[int, None], Form(ge=1, le=config.MAX_HNSW_EF_SEARCH)] = None,
+                          probes: Annotated[Union[int, None], Form(ge=1, le=config.MAX_IVFFLAT_PROBES)] = None,
+                          retrieval_mode: Annotated[Literal['vector', 'hybrid'], Form()] = config.RETRIEVAL_MODE, question_text: Annotated[Union[str, None], Form()] = None):
+    '''get rag context from question (embedding as '[...]' text or base64) given file list, ef_search/probes tune the HNSW/IVFFlat index scan.
+    retrieval_mode 'hybrid' also matches question_text against the chunks with full text search and fuses both
+    rankings, without question_text it is a vector search'''
+    question, = decode_vectors(question)
+    result = await async_utils.run_db(pgvector_utils.rag_context, pgvector_utils.rag_context_async, question, files, ef_search, probes, retrieval_mode, question_text)
+    if result is False:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
+    if not result:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No chunks found for the selected files')
+    return result
+
+@app.post("/get_rag_context_batch")
+async def get_rag_context_batch(batch: RagContextBatch):
+    '''get the top k chunks with similarity scores for many question embeddings and/or stored question ids in one query'''
+    embeddings = decode_vectors(*batch.embeddings)
+    result = await async_utils.run_db(pgvector_utils.rag_context_batch, pgvector_utils.rag_context_batch_async, batch.files, embeddings, batch.question_ids, batch.k, batch.ef_search, batch.probes)
+    if result != False:
+        return result
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=config.ERROR_MESSAGE)
 
 @app.delete("/delete_project")
@@ -1,3 +1,7 @@
+import copy
+from types import SimpleNamespace
+from contextlib import contextmanager
+
 try:
     import src.utils.auto_gen_utils as auto_gen_utils
 except Exception as e:
@@ -8,4 +12,49 @@ def test_example():
     example = 'Project A'
     result = auto_gen_utils.format_project_name_helper(example)
     expected = 'project_a'
-    assert result == expected 
\ No newline at end of file
+    assert result == expected 
+
+class FakeAgent:
+    '''the autogen agent calls the parallel review uses; like autogen 0.2.27 it keeps a shallow copy of a reply's config'''
+
+    def __init__(self, name):
+        self.name = name
+        self.replies = []
+
+    def register_reply(self, trigger, reply_func, position=0, config=None):
+        self.replies.insert(position, (reply_func, copy.copy(config)))
+
+    def initiate_chat(self, recipient, message, **kwargs):
+        if self.replies:
+            reply_func, config = self.replies[0]
+            _, summary = reply_func(self, [{'content': message}], recipient, config)
+            return SimpleNamespace(summary=summary, chat_history=[])
+        return SimpleNamespace(summary=f'review by {recipient.name}', chat_history=[])
+
+    def reset(self):
+        pass
+
+def fake_graph():
+    graph = auto_gen_utils.AgentGraph.__new__(auto_gen_utils.AgentGraph)
+    for attribute in ('writer', 'critic', 'parallel_critic', 'grant_reviewer', 'legal_reviewer', 'ethics_reviewer', 'meta_reviewer', 'meta_sender'):
+        setattr(graph, attribute, FakeAgent(attribute))
+    graph.review_senders = {name: FakeAgent(f'sender for {name}') for name in ('grant_reviewer', 'legal_reviewer', 'ethics_reviewer')}
+    graph.timings = {'reviewers': {}}
+    graph.register_parallel_review()
+    return graph
+
+def test_parallel_review_reports_every_timing(monkeypatch):
+    graph = fake_graph()
+
+    @contextmanager
+    def acquire():
+        yield graph
+        graph.reset()
+
+    monkeypatch.setattr(auto_gen_utils.agent_pool, 'acquire', acquire)
+    # the second run checks a reused graph does not write to a stale timings dict
+    for _ in range(2):
+        summary, _, timings = auto_gen_utils.ask_rag_question_parallel_review('question', 'None')
+        assert summary == 'review by meta_reviewer'
+        assert set(timings['reviewers']) == {'grant_reviewer', 'legal_reviewer', 'ethics_reviewer'}
+        assert {'reviews_wall', 'meta_reviewer', 'total'} <= set(timings)
@@ -0,0 +1,21 @@
+try:
+    import src.utils.cache_utils as cache_utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.cache_utils as cache_utils
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = cache_utils.LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+def test_embedding_cache_key_depends_on_model_and_text():
+    key = cache_utils.embedding_cache_key('text-embedding-3-small', 'hello')
+    assert key == cache_utils.embedding_cache_key('text-embedding-3-small', 'hello')
+    assert key != cache_utils.embedding_cache_key('text-embedding-3-large', 'hello')
+    assert key != cache_utils.embedding_cache_key('text-embedding-3-small', 'hello ')
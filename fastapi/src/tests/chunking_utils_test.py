@@ -0,0 +1,33 @@
+import pytest
+import hashlib
+
+try:
+    import src.utils.chunking_utils as chunking_utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.chunking_utils as chunking_utils
+
+def test_mean_embedding_is_unit_length_mean():
+    result = chunking_utils.mean_embedding([[1.0, 0.0], [0.0, 1.0]])
+    expected = [2 ** -0.5, 2 ** -0.5]
+    assert [round(x, 6) for x in result] == [round(x, 6) for x in expected]
+
+class FakeEmbeddings:
+    '''deterministic embeddings: a few numbers derived from the md5 of the text'''
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        digest = hashlib.md5(text.encode()).digest()
+        return [byte / 255 for byte in digest[:8]]
+
+TEXT = ' '.join(f'Sentence number {i} talks about topic {i % 4}.' for i in range(24))
+
+@pytest.mark.parametrize('number_of_chunks', [None, 4])
+def test_split_text_single_pass_matches_semantic_chunker(number_of_chunks):
+    pytest.importorskip('langchain_experimental')
+    embeddings = FakeEmbeddings()
+    expected = chunking_utils.semantic_chunker(embeddings, number_of_chunks).split_text(TEXT)
+    result = chunking_utils.split_text_single_pass(TEXT, embeddings, number_of_chunks)
+    assert [chunk for chunk, _ in result] == expected
+    assert all(embedding is not None for _, embedding in result)
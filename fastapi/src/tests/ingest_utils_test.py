@@ -0,0 +1,108 @@
+import io
+import contextlib
+import pytest
+
+try:
+    import src.utils.ingest_utils as ingest_utils
+    import src.utils.chunking_utils as chunking_utils
+    import src.utils.pgvector_utils as pgvector_utils
+    import src.utils.langchain_utils as langchain_utils
+    import src.utils.config as config
+    import src.utils.utils as utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.ingest_utils as ingest_utils
+    import utils.chunking_utils as chunking_utils
+    import utils.pgvector_utils as pgvector_utils
+    import utils.langchain_utils as langchain_utils
+    import utils.config as config
+    import utils.utils as utils
+
+TEXT = 'First chunk. Second chunk. Third chunk.'
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+def split_sentences(text, embeddings, number_of_chunks, chunker=None):
+    return [(sentence.strip() + '.', None) for sentence in text.split('.') if sentence.strip()]
+
+@pytest.fixture
+def store(monkeypatch):
+    '''the pgvector_utils functions of an ingest, backed by a dict'''
+    store = {'content_hash': None, 'chunk_hashes': set(), 'inserted': [], 'finished': []}
+
+    def insert(rows):
+        store['inserted'] += [chunk_text for _, chunk_text, _ in rows]
+        return {'rows': len(store['inserted'])}
+
+    def finish(file_name, content_hash, chunk_hashes):
+        store['finished'].append(content_hash)
+        return {'stale_chunks_deleted': 0}
+
+    monkeypatch.setattr(pgvector_utils, 'file_ingest_lock', lambda file_name: contextlib.nullcontext())
+    monkeypatch.setattr(pgvector_utils, 'get_file_content_hash', lambda file_name: store['content_hash'])
+    monkeypatch.setattr(pgvector_utils, 'get_chunk_hashes', lambda file_name: store['chunk_hashes'])
+    monkeypatch.setattr(pgvector_utils, 'insert_file_chunks_into_db_bulk', insert)
+    monkeypatch.setattr(pgvector_utils, 'finish_file_ingest', finish)
+    monkeypatch.setattr(chunking_utils, 'chunk_text', split_sentences)
+    return store
+
+def pipeline(text=TEXT):
+    return ingest_utils.IngestPipeline('notes.txt', io.BytesIO(text.encode()), FakeEmbeddings())
+
+def test_ingest_inserts_only_new_chunks(store):
+    store['chunk_hashes'] = {chunking_utils.chunk_hash('First chunk.')}
+    ingest = pipeline()
+    assert ingest.run()
+    assert store['inserted'] == ['Second chunk.', 'Third chunk.']
+    assert ingest.chunks_unchanged == 1
+    assert store['finished'] == [ingest.content_hash]
+
+def test_ingest_skips_unchanged_file(store):
+    store['content_hash'] = ingest_utils.file_content_hash(io.BytesIO(TEXT.encode()))
+    ingest = pipeline()
+    assert ingest.run()
+    assert ingest.unchanged
+    assert store['inserted'] == [] and store['finished'] == []
+
+def test_ingest_stops_when_stored_chunks_cannot_be_read(store):
+    store['chunk_hashes'] = False
+    ingest = pipeline()
+    assert ingest.run() is False
+    assert ingest.error is not None
+    assert store['inserted'] == [] and store['finished'] == []
+
+def test_concurrent_ingest_of_the_same_file_fails(store, monkeypatch):
+    def locked(file_name):
+        raise pgvector_utils.FileIngestInProgress(f'{file_name} is already being ingested')
+    monkeypatch.setattr(pgvector_utils, 'file_ingest_lock', locked)
+    with pytest.raises(pgvector_utils.FileIngestInProgress):
+        pipeline().run()
+    assert store['inserted'] == []
+
+# INGEST_MODE 'sequential': the same checks in utils.save_file_chunks
+
+@pytest.fixture
+def sequential(store, monkeypatch):
+    monkeypatch.setattr(config, 'INGEST_MODE', 'sequential')
+    monkeypatch.setattr(config, 'CHUNK_INSERT_MODE', 'copy')
+    monkeypatch.setattr(langchain_utils, 'cached_embeddings', lambda model, open_api_key: FakeEmbeddings())
+    return store
+
+def test_sequential_ingest_inserts_only_new_chunks(sequential):
+    sequential['chunk_hashes'] = {chunking_utils.chunk_hash('Second chunk.')}
+    assert utils.save_file_chunks('Notes.txt', io.BytesIO(TEXT.encode()), 'key') == 'notes.txt'
+    assert sequential['inserted'] == ['First chunk.', 'Third chunk.']
+
+def test_sequential_ingest_stops_when_stored_chunks_cannot_be_read(sequential):
+    sequential['chunk_hashes'] = False
+    assert utils.save_file_chunks('notes.txt', io.BytesIO(TEXT.encode()), 'key') is None
+    assert sequential['inserted'] == [] and sequential['finished'] == []
+
+def test_sequential_ingest_of_a_file_being_ingested_fails(sequential, monkeypatch):
+    def locked(file_name):
+        raise pgvector_utils.FileIngestInProgress(f'{file_name} is already being ingested')
+    monkeypatch.setattr(pgvector_utils, 'file_ingest_lock', locked)
+    with pytest.raises(pgvector_utils.FileIngestInProgress):
+        utils.save_file_chunks('notes.txt', io.BytesIO(TEXT.encode()), 'key')
@@ -0,0 +1,36 @@
+import time
+
+try:
+    import src.utils.job_utils as job_utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.job_utils as job_utils
+
+def wait(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.status in ('queued', 'running') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job
+
+def test_job_registry_runs_jobs_and_records_failures():
+    registry = job_utils.JobRegistry(2)
+    def body(job, value):
+        job.progress['value'] = value
+        if value < 0:
+            raise ValueError('negative')
+        return value * 2
+    done, failed = registry.submit('double', body, 21), registry.submit('double', body, -1)
+    assert wait(done).status == 'done' and done.result == 42
+    assert wait(failed).status == 'failed' and failed.errors == ['negative']
+    assert done.as_dict()['progress'] == {'value': 21}
+    assert registry.get(done.id) is done
+    assert registry.list('other') == []
+    registry.shutdown()
+
+def test_job_registry_evicts_the_oldest_finished_jobs():
+    registry = job_utils.JobRegistry(1, history_size=2)
+    finished = [wait(registry.submit('quick', lambda job: None)) for _ in range(3)]
+    latest = registry.submit('quick', lambda job: None)
+    assert registry.get(finished[0].id) is None
+    assert registry.get(latest.id) is latest
+    registry.shutdown()
@@ -0,0 +1,44 @@
+import pytest
+
+try:
+    import src.main as main
+except Exception as e:
+    print(f'ERROR: {e}')
+    import main
+
+def test_etag_matches():
+    assert main.etag_matches('"1-2-1"', '"1-2-1"')
+    assert main.etag_matches('"0-0-0", W/"1-2-1"', '"1-2-1"')
+    assert main.etag_matches('*', '"1-2-1"')
+    assert not main.etag_matches('"1-3-1"', '"1-2-1"')
+    assert not main.etag_matches('', '"1-2-1"')
+
+@pytest.fixture
+def client(monkeypatch):
+    TestClient = pytest.importorskip('fastapi.testclient').TestClient
+    versions = {'projects': 1, 'files': 2}
+    reads = []
+    async def get_table_versions(tables):
+        return dict(versions)
+    async def query_data(table_name):
+        reads.append(table_name)
+        return []
+    for name in ('get_table_versions', 'get_table_versions_async'):
+        monkeypatch.setattr(main.pgvector_utils, name, get_table_versions)
+    for name in ('query_data', 'query_data_async'):
+        monkeypatch.setattr(main.pgvector_utils, name, query_data)
+    monkeypatch.setattr(main.config, 'ASYNC_MODE', True)
+    # without the lifespan, no connection pool is opened
+    client = TestClient(main.app)
+    client.versions, client.reads = versions, reads
+    return client
+
+def test_bootstrap_answers_304_until_a_table_changes(client):
+    response = client.get('/bootstrap')
+    assert response.status_code == 200 and response.json()['projects'] == []
+    etag = response.headers['ETag']
+    assert client.get('/bootstrap', headers={'If-None-Match': etag}).status_code == 304
+    assert client.reads == ['projects', 'files']
+    client.versions['files'] = 3
+    changed = client.get('/bootstrap', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
@@ -0,0 +1,51 @@
+import pytest
+from prometheus_client import REGISTRY
+
+try:
+    import src.utils.metrics_utils as metrics_utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.metrics_utils as metrics_utils
+
+def db_count(function, result):
+    return REGISTRY.get_sample_value('silverhand_db_duration_seconds_count', {'function': function, 'result': result}) or 0
+
+def test_timed_db_records_outermost_call_and_failures():
+    @metrics_utils.timed_db
+    def inner_query():
+        return True
+
+    @metrics_utils.timed_db
+    def outer_query():
+        return inner_query()
+
+    @metrics_utils.timed_db
+    def failing_query():
+        return False
+
+    outer_query()
+    failing_query()
+    assert db_count('outer_query', 'ok') == 1
+    assert db_count('inner_query', 'ok') == 0
+    assert db_count('failing_query', 'failed') == 1
+
+def test_timed_db_records_none_and_exceptions_as_failed():
+    @metrics_utils.timed_db
+    def none_query():
+        return None
+
+    @metrics_utils.timed_db
+    def raising_query():
+        raise RuntimeError('connection lost')
+
+    @metrics_utils.timed_db(none_ok=True)
+    def lookup_query():
+        return None
+
+    none_query()
+    with pytest.raises(RuntimeError):
+        raising_query()
+    lookup_query()
+    assert db_count('none_query', 'failed') == 1
+    assert db_count('raising_query', 'failed') == 1
+    assert db_count('lookup_query', 'ok') == 1
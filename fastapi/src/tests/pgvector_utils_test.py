@@ -0,0 +1,179 @@
+import uuid
+import random
+import pytest
+from types import SimpleNamespace
+
+try:
+    import src.utils.pgvector_utils as pgvector_utils
+    import src.utils.config as config
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.pgvector_utils as pgvector_utils
+    import utils.config as config
+
+@pytest.fixture
+def db():
+    '''the database of config.DB_CONNINFO, the test is skipped when it cannot be reached'''
+    try:
+        conn = pgvector_utils.psycopg.connect(config.DB_CONNINFO, connect_timeout=2, autocommit=True)
+    except Exception as e:
+        pytest.skip(f'no database: {e}')
+    yield conn
+    conn.close()
+    pgvector_utils.close_db_pool()
+
+def test_answer_cache_hit_among_many_entries(db):
+    dimensions = db.execute("""
+    SELECT atttypmod FROM pg_attribute
+    WHERE attrelid = 'answer_cache'::regclass AND attname = 'question_embedding'
+    """).fetchone()[0]
+    rng = random.Random(0)
+    prefix = f'test-{uuid.uuid4().hex}'
+    target = [rng.random() for _ in range(dimensions)]
+    try:
+        # many closer answers of other contexts, the HNSW candidates would all be filtered out
+        with db.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO answer_cache (question, question_embedding, context_hash, review_mode, summary, chat_history) VALUES (%s, %s::vector, %s, 'parallel', 'other', '[]')",
+                [('q', str([x + rng.random() * 1e-3 for x in target]), f'{prefix}-{i}') for i in range(2000)],
+            )
+        db.execute(
+            "INSERT INTO answer_cache (question, question_embedding, context_hash, review_mode, summary, chat_history) VALUES ('q', %s::vector, %s, 'parallel', 'cached', '[]')",
+            (str([rng.random() for _ in range(dimensions)]), prefix),
+        )
+        db.execute("ANALYZE answer_cache")
+        result = pgvector_utils.lookup_answer_cache(target, prefix, 'parallel', 3600)
+        assert result and result[0] == 'cached'
+        assert pgvector_utils.lookup_answer_cache(target, prefix, 'sequential', 3600) is None
+    finally:
+        db.execute("DELETE FROM answer_cache WHERE context_hash LIKE %s", (f'{prefix}%',))
+
+class FakeCursor:
+    '''records the statements and returns the next batch of rows for every query'''
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.statements = []
+        self.params = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None, **kwargs):
+        self.statements.append(query)
+        self.params.append(params)
+        if query.lstrip().startswith(('WITH', 'SELECT id')):
+            self.rows = self.batches.pop(0)
+
+    def fetchall(self):
+        return self.rows
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(*batches):
+        cur = FakeCursor(batches)
+        monkeypatch.setattr(pgvector_utils, 'get_db_connection', lambda: FakeCursor(()))
+        monkeypatch.setattr(pgvector_utils, 'vector_cursor', lambda conn: cur)
+        return cur
+    return install
+
+def test_rag_context_hybrid_falls_back_when_vector_search_is_short(fake_db):
+    # only full text matches: the filtered index scan found no chunk of the files
+    cur = fake_db([(1, 'a.pdf', 'text match', 0)], [(2, 'a.pdf', 'nearest', 1)])
+    result = pgvector_utils.rag_context([0.1, 0.2], ['a.pdf'], retrieval_mode='hybrid', question_text='budget')
+    assert result == 'nearest'
+    assert pgvector_utils.EXACT_SCAN in cur.statements
+
+def test_rag_context_keeps_index_results(fake_db):
+    cur = fake_db([(1, 'a.pdf', 'nearest', 1)])
+    assert pgvector_utils.rag_context([0.1, 0.2], ['a.pdf'], retrieval_mode='vector') == 'nearest'
+    assert pgvector_utils.EXACT_SCAN not in cur.statements
+
+def test_rag_context_without_chunks_is_empty(fake_db):
+    fake_db([], [])
+    assert pgvector_utils.rag_context([0.1, 0.2], ['a.pdf'], retrieval_mode='vector') == ''
+
+def batch_row(position, chunk_id, available=2, question_id=None):
+    if chunk_id is None:
+        return (position, question_id, None, None, None, None, None, available)
+    return (position, question_id, chunk_id, 'a.pdf', f'chunk {chunk_id}', 0.1 * chunk_id, 0.9, available)
+
+def test_group_rag_context_batch_rows_keeps_request_order():
+    rows = [batch_row(1, 3), batch_row(1, 4), batch_row(2, None, question_id=7), batch_row(3, 5, question_id=8)]
+    results = pgvector_utils.group_rag_context_batch_rows(rows, ['e'], [7, 8, 9])
+    assert [result['question_id'] for result in results] == [None, 7, 8, 9]
+    assert [[chunk['id'] for chunk in result['chunks']] for result in results] == [[3, 4], [], [5], []]
+
+def test_short_rag_context_batch_entries_skips_entries_that_cannot_grow():
+    # question 9 has no embedding and no rows, the files hold a single chunk
+    rows = [batch_row(1, 3, available=1), batch_row(2, None, available=1, question_id=7)]
+    results = pgvector_utils.group_rag_context_batch_rows(rows, ['e'], [7, 9])
+    assert pgvector_utils.short_rag_context_batch_entries(rows, results, 3) == [1]
+    assert pgvector_utils.short_rag_context_batch_entries([], [], 3) == []
+
+def test_rag_context_batch_searches_only_short_entries_again(fake_db):
+    cur = fake_db(
+        [batch_row(1, 1), batch_row(1, 2), batch_row(2, None, question_id=7), batch_row(3, 1, question_id=8), batch_row(3, 2, question_id=8)],
+        [batch_row(1, 5, question_id=7), batch_row(1, 6, question_id=7)],
+    )
+    results = pgvector_utils.rag_context_batch(['a.pdf'], ['[0.1, 0.2]'], [7, 8, 9], k=2)
+    assert [[chunk['id'] for chunk in result['chunks']] for result in results] == [[1, 2], [5, 6], [1, 2], []]
+    assert cur.statements.count(pgvector_utils.EXACT_SCAN) == 1
+    assert cur.params[-1]['question_ids'] == [7] and 'embedding_1' not in cur.params[-1]
+
+def test_validate_fields_defaults_to_light_columns_and_rejects_unknown():
+    assert pgvector_utils.validate_fields('questions') == ['id', 'question', 'answer', 'project_id', 'created_at']
+    assert pgvector_utils.validate_fields('questions', ['id', 'embedding']) == ['id', 'embedding']
+    with pytest.raises(ValueError):
+        pgvector_utils.validate_fields('questions', ['id', 'password'])
+    with pytest.raises(ValueError):
+        pgvector_utils.validate_fields('pg_user')
+
+def test_keyset_query_params():
+    assert pgvector_utils.keyset_query('files')[1] == [0]
+    assert pgvector_utils.keyset_query('files', after_id=40, limit=20)[1] == [40, 20]
+    assert pgvector_utils.keyset_query('questions', after_id=5, limit=10, where='project_id = %s', params=(3,))[1] == [5, 3, 10]
+
+class FakeUpsertCursor(FakeCursor):
+    '''rowcount of the updates is the number of changed questions, inserts return ids from 100'''
+    def __init__(self, changed):
+        super().__init__(())
+        self.changed = changed
+        self.rowcount = 0
+        self.next_id = 100
+
+    def execute(self, query, params=None, **kwargs):
+        self.statements.append(query)
+        self.params.append(params)
+        self.rowcount = len(params[0]) if query.startswith('DELETE') else 1
+
+    def executemany(self, query, params_seq):
+        self.statements.append(query)
+        self.params.append(list(params_seq))
+        self.rowcount = self.changed
+
+    def fetchone(self):
+        self.next_id += 1
+        return (self.next_id,)
+
+class FakeConnection(FakeCursor):
+    def __init__(self):
+        super().__init__(())
+
+    def transaction(self):
+        return self
+
+def question(id=None, text='q'):
+    return SimpleNamespace(id=id, question=text, answer=None, project_id=3, embedding=None, chat_history=None)
+
+def test_upsert_questions_updates_inserts_and_deletes_in_one_call(monkeypatch):
+    cur = FakeUpsertCursor(changed=1)
+    monkeypatch.setattr(pgvector_utils, 'get_db_connection', FakeConnection)
+    monkeypatch.setattr(pgvector_utils, 'vector_cursor', lambda conn: cur)
+    result = pgvector_utils.upsert_questions('3', [question(1), question(2), question(text='new'), question(text='newer')], deleted_ids=[7, 8])
+    assert result == {'inserted_ids': [101, 102], 'updated': 1, 'unchanged': 1, 'deleted': 2}
+    assert [params['id'] for params in cur.params[1]] == [1, 2]
+    assert cur.statements[1] == pgvector_utils.QUESTION_UPDATE_IF_CHANGED
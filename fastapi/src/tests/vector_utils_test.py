@@ -0,0 +1,35 @@
+from array import array
+
+try:
+    import src.utils.vector_utils as vector_utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.vector_utils as vector_utils
+
+def test_base64_round_trip_is_float32():
+    values = [0.25, -1.5, 3.0e-8, 1.0]
+    encoded = vector_utils.encode_vector(values)
+    assert len(encoded) == 24 # 16 bytes of float32
+    assert vector_utils.decode_vector(encoded) == array('f', values)
+
+def test_parse_vector_accepts_every_wire_form():
+    values = array('f', [0.5, -0.25])
+    assert vector_utils.parse_vector('[0.5, -0.25]') == values
+    assert vector_utils.parse_vector(vector_utils.encode_vector(values)) == values
+    assert vector_utils.parse_vector([0.5, -0.25]) == values
+    assert vector_utils.parse_vector(values) is values
+    assert vector_utils.parse_vector(None) is None
+
+def test_pgvector_binary_round_trip():
+    values = array('f', [1.0, 2.0, -3.5])
+    data = vector_utils.to_pgvector_binary(values)
+    assert data[:4] == b'\x00\x03\x00\x00'
+    assert vector_utils.from_pgvector_binary(data) == values
+
+def test_invalid_vectors_raise_value_error():
+    for value in ('not base64!', 'AAA=', '[1, 2'):
+        try:
+            vector_utils.parse_vector(value)
+        except ValueError:
+            continue
+        raise AssertionError(f'{value} was accepted')
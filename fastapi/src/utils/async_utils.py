@@ -0,0 +1,80 @@
+import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import src.utils.config as config
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.config as config
+
+# dedicated executors so CPU bound ingestion and multi-minute agent chats never use up
+# the threadpool that serves the sync endpoints
+_executors = {}
+
+def get_executor(name, max_workers):
+    if name not in _executors:
+        _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return _executors[name]
+
+def shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+
+async def run_in_executor(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+async def run_cpu_bound(func, *args, **kwargs):
+    '''run PDF extraction, chunking and other CPU heavy work off the event loop'''
+    return await run_in_executor(get_executor('cpu', config.CPU_WORKERS), func, *args, **kwargs)
+
+async def run_generation(func, *args, **kwargs):
+    '''run an AutoGen chat on the generation executor'''
+    return await run_in_executor(get_executor('generation', config.GENERATION_WORKERS), func, *args, **kwargs)
+
+async def run_db(sync_func, async_func, *args, **kwargs):
+    '''use the async Postgres driver in async mode, otherwise the sync function in the threadpool'''
+    if config.ASYNC_MODE:
+        return await async_func(*args, **kwargs)
+    return await run_in_threadpool(sync_func, *args, **kwargs)
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def stream_generation(func, *args):
+    '''run func(emit, *args) on the generation executor and yield the events it emits as
+    Server-Sent Events, followed by a 'result' (or 'error') event and a final 'done' event'''
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def run():
+        try:
+            emit('result', await run_generation(func, emit, *args))
+        except Exception as e:
+            print(f'ERROR stream_generation: {e}')
+            emit('error', {'detail': config.ERROR_MESSAGE})
+        finally:
+            emit('done', {})
+
+    task = asyncio.create_task(run())
+    while True:
+        try:
+            event, data = await asyncio.wait_for(events.get(), timeout=config.SSE_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            # SSE comment so proxies do not close an idle connection while agents think
+            yield ': keep-alive\n\n'
+            continue
+        yield format_sse(event, data)
+        if event == 'done':
+            break
+    await task
+
+if __name__ == "__main__":
+    pass
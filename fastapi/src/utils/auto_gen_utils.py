@@ -1,12 +1,21 @@
 import json
 import os
-import chromadb
-import autogen
-from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
-from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
-from autogen.retrieve_utils import TEXT_FORMATS
-import json
 import re 
+import time
+import contextvars
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# autogen and chromadb are imported on first use (or by warm_up), they dominate import time
+
+try:
+    import src.utils.config as config
+    import src.utils.metrics_utils as metrics_utils
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.config as config
+    import utils.metrics_utils as metrics_utils
 
 env_var_dict = [
     {
@@ -23,40 +32,31 @@ env_var = json.dumps(env_var_dict)
 
 os.environ["AUTO_GEN_CONFIG"] = env_var
 
-config_list = autogen.config_list_from_json(
-    env_or_file='AUTO_GEN_CONFIG',
-    filter_dict={
-        "model": {
-            "gpt-4",
-            "gpt4",
-            "gpt-4-32k",
-            "gpt-4-32k-0314",
-            "gpt-4-32k-v0314",
-            "gpt-3.5-turbo",
-            "gpt-3.5-turbo-16k",
-            "gpt-3.5-turbo-0301",
-            "chatgpt-35-turbo-0301",
-            "gpt-35-turbo-v0301",
-            "gpt",
-        }
-    }
-)
+# same result as autogen.config_list_from_json(env_or_file="AUTO_GEN_CONFIG"), without importing autogen
+config_list = json.loads(os.environ["AUTO_GEN_CONFIG"])
 
-config_list = autogen.config_list_from_json(env_or_file="AUTO_GEN_CONFIG")
+rag_assistant_llm_config = {
+    "timeout": 600,
+    "cache_seed": 42,
+    "config_list": config_list,
+}
 
-assistant = RetrieveAssistantAgent(
-    name="assistant",
-    system_message="You are a helpful assistant.",
-    llm_config={
-        "timeout": 600,
-        "cache_seed": 42,
-        "config_list": config_list,
-    },
-)
+def construct_rag_assistant():
+    '''a fresh assistant per question, so concurrent questions never share chat state'''
+    from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
+    return metrics_utils.instrument_agent(RetrieveAssistantAgent(
+        name="assistant",
+        system_message="You are a helpful assistant.",
+        llm_config=rag_assistant_llm_config,
+    ))
 
 ragproxyagent = None 
+# the pgvector proxy agent is built once by /construct_agent and keeps its chat state, one question at a time
+ragproxyagent_lock = threading.Lock()
 
 def construct_rag_proxy_agent(file_paths):
+    import chromadb
+    from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
     file_path_full = [f'./doc_store/{file}' for file in file_paths]
     ragproxyagent = RetrieveUserProxyAgent(
         name="ragproxyagent",
@@ -79,7 +79,7 @@ def construct_rag_proxy_agent(file_paths):
     return ragproxyagent
 
 def ask_rag_question(qa_problem,file_paths):
-    assistant.reset()
+    assistant = construct_rag_assistant()
     ragproxyagent = construct_rag_proxy_agent(file_paths)
     if res := ragproxyagent.initiate_chat(assistant, message=ragproxyagent.message_generator, problem=qa_problem):
         try:
@@ -98,6 +98,7 @@ def format_project_name_helper(text):
 def construct_rag_proxy_agent_pgvector(file_paths,project_name):
     try:
         global ragproxyagent 
+        from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
         file_path_full = [f'./doc_store/{file}' for file in file_paths]
         project_name = format_project_name_helper(project_name)
         ragproxyagent = RetrieveUserProxyAgent(
@@ -132,104 +133,118 @@ def construct_rag_proxy_agent_pgvector(file_paths,project_name):
         print(f'ERROR construct_rag_proxy_agent_pgvector: {e}')
 
 def ask_rag_question_pgvector(qa_problem):
-    assistant.reset()
+    assistant = construct_rag_assistant()
     # ragproxyagent = construct_rag_proxy_agent_pgvector(file_paths,project_name)
-    if ragproxyagent:
-        if res := ragproxyagent.initiate_chat(assistant, message=ragproxyagent.message_generator, problem=qa_problem):
-            try:
-                if text := res.chat_history[0].get('content'):
-                    if context := re.sub(r"(.*)context is:", "", text ,flags= re.DOTALL | re.IGNORECASE | re.MULTILINE):
-                        return res.summary, context 
-            except Exception as e:
-                print(f'ERROR: {e}')
+    with ragproxyagent_lock:
+        if ragproxyagent:
+            if res := ragproxyagent.initiate_chat(assistant, message=ragproxyagent.message_generator, problem=qa_problem):
+                try:
+                    if text := res.chat_history[0].get('content'):
+                        if context := re.sub(r"(.*)context is:", "", text ,flags= re.DOTALL | re.IGNORECASE | re.MULTILINE):
+                            return res.summary, context 
+                except Exception as e:
+                    print(f'ERROR: {e}')
     return None, None 
 
 def reflection_message(recipient, messages, sender, config):
     return f'''Review the following content. 
             \n\n {recipient.chat_messages_for_summary(sender)[-1]['content']}'''
 
-#init agents 
-writer = autogen.AssistantAgent(
-    name="Writer",
-    system_message="You are a writer. You write professional grant applications. " 
-        "Answer the question based on the context if it exists. You must polish your "
-        "writing based on the feedback you receive and give a refined "
-        "version. Only return your final work without additional comments.",
-    llm_config=env_var_dict[0],
-)
-
-critic = autogen.AssistantAgent(
-    name="Critic",
-    is_termination_msg=lambda x: x.get("content", "").find("TERMINATE") >= 0,
-    llm_config=env_var_dict[0],
-    system_message="You are a critic. You review the work of "
-                "the writer and provide constructive "
-                "feedback to help improve the quality of the application.",
-)
-
-grant_reviewer = autogen.AssistantAgent(
-name="Grant application Reviewer",
-llm_config=env_var_dict[0],
-system_message="You are an grant application reviewer, known for "
+# receives ('message' | 'delta', data) events for the generation running in the current context
+message_listener = contextvars.ContextVar('message_listener', default=None)
+
+def forward_message(sender, message, recipient, silent):
+    '''process_message_before_send hook: hand every agent message to the current listener'''
+    if listener := message_listener.get():
+        content = message.get('content') if isinstance(message, dict) else message
+        listener('message', {'sender': sender.name, 'recipient': recipient.name, 'content': content})
+    return message
+
+def stream_agent_messages(*agents):
+    for agent in agents:
+        agent.register_hook('process_message_before_send', forward_message)
+
+class ListenerIOStream:
+    '''autogen output stream that forwards streamed completion tokens to the listener'''
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def print(self, *objects, sep=" ", end="\n", flush=False):
+        # streamed tokens are the only output printed with end="" and flush=True, skip colour codes
+        if end == "" and flush:
+            text = sep.join(str(x) for x in objects)
+            if text and not text.startswith("\033"):
+                self.listener('delta', {'content': text})
+
+    def input(self, prompt="", *, password=False):
+        return ""
+
+def get_io_stream():
+    try:
+        from autogen.io import IOStream
+    except ImportError:
+        # autogen without pluggable output streams, token deltas are not streamed
+        return None
+    return IOStream
+
+def run_with_listener(listener, func, *args):
+    '''run a generation function, sending its agent messages (and token deltas if STREAM_TOKENS) to listener'''
+    token = message_listener.set(listener)
+    try:
+        if config.STREAM_TOKENS and (IOStream := get_io_stream()) is not None:
+            with IOStream.set_default(ListenerIOStream(listener)):
+                return func(*args)
+        return func(*args)
+    finally:
+        message_listener.reset(token)
+
+group_chat_llm_config = {**env_var_dict[0], 'stream': True} if config.STREAM_TOKENS else env_var_dict[0]
+
+# agent definitions, shared by every AgentGraph; only the agents themselves carry per-chat state
+WRITER_SYSTEM_MESSAGE = ("You are a writer. You write professional grant applications. " 
+    "Answer the question based on the context if it exists. You must polish your "
+    "writing based on the feedback you receive and give a refined "
+    "version. Only return your final work without additional comments.")
+
+CRITIC_SYSTEM_MESSAGE = ("You are a critic. You review the work of "
+    "the writer and provide constructive "
+    "feedback to help improve the quality of the application.")
+
+GRANT_REVIEWER_SYSTEM_MESSAGE = ("You are an grant application reviewer, known for "
     "your ability to optimize content for grant applications, "
     "giving the application the maximum probability of being successful. " 
     "Make sure your suggestion is concise (within 3 bullet points), "
     "concrete and to the point. "
-    "Begin the review by stating your role.",
-)
-
-legal_reviewer = autogen.AssistantAgent(
-    name="Legal Reviewer",
-    llm_config=env_var_dict[0],
-    system_message="You are a legal reviewer, known for "
-        "your ability to ensure that content is legally compliant "
-        "and free from any potential legal issues. "
-        "Make sure your suggestion is concise (within 3 bullet points), "
-        "concrete and to the point. "
-        "Begin the review by stating your role.",
-)
-
-ethics_reviewer = autogen.AssistantAgent(
-name="Ethics Reviewer",
-llm_config=env_var_dict[0],
-system_message="You are an ethics reviewer, known for "
+    "Begin the review by stating your role.")
+
+LEGAL_REVIEWER_SYSTEM_MESSAGE = ("You are a legal reviewer, known for "
+    "your ability to ensure that content is legally compliant "
+    "and free from any potential legal issues. "
+    "Make sure your suggestion is concise (within 3 bullet points), "
+    "concrete and to the point. "
+    "Begin the review by stating your role.")
+
+ETHICS_REVIEWER_SYSTEM_MESSAGE = ("You are an ethics reviewer, known for "
     "your ability to ensure that content is ethically sound "
     "and free from any potential ethical issues. " 
     "Make sure your suggestion is concise (within 3 bullet points), "
     "concrete and to the point. "
-    "Begin the review by stating your role. ",
-)
+    "Begin the review by stating your role. ")
 
-meta_reviewer = autogen.AssistantAgent(
-    name="Meta Reviewer",
-    llm_config=env_var_dict[0],
-    system_message="You are a meta reviewer, you aggragate and review "
-    "the work of other reviewers and give a final suggestion on the content.",
-)
-
-def ask_rag_question_minimal_feedback(qa_problem, context):
-    if res := critic.initiate_chat(
-        recipient=writer,
-        message=qa_problem,
-        max_turns=2,
-        summary_method="last_msg"
-    ): 
-        return res.summary
+META_REVIEWER_SYSTEM_MESSAGE = ("You are a meta reviewer, you aggragate and review "
+    "the work of other reviewers and give a final suggestion on the content.")
 
+META_REVIEW_MESSAGE = "Aggregrate feedback from all reviewers and give final suggestions on the writing."
 
-def ask_rag_question_maximum_feedback(qa_problem, context):
+def is_termination_msg(message):
+    return message.get("content", "").find("TERMINATE") >= 0
 
-    # init results 
-    summary, chat_history =  '', ''
-    
-    qa_problem = f'<question>{qa_problem}<question>'
-
-    if context and context != 'None':
-        qa_problem = f'<context>{context}<context>{qa_problem}'
-    
-    review_chats = [
+def review_chat_queue(graph):
+    '''independent reviewers of a graph, each one reviews the writer's draft and summarises it as JSON'''
+    return [
         {
-         "recipient": grant_reviewer, 
+         "recipient": graph.grant_reviewer, 
          "message": reflection_message, 
          "summary_method": "reflection_with_llm",
          "summary_args": {"summary_prompt" : 
@@ -237,36 +252,221 @@ def ask_rag_question_maximum_feedback(qa_problem, context):
             "{'Reviewer': '', 'Review': ''}. Here Reviewer should be your role",},
          "max_turns": 1},
         {
-        "recipient": legal_reviewer, "message": reflection_message, 
+        "recipient": graph.legal_reviewer, "message": reflection_message, 
          "summary_method": "reflection_with_llm",
          "summary_args": {"summary_prompt" : 
             "Return review into as JSON object only:"
             "{'Reviewer': '', 'Review': ''}.",},
          "max_turns": 1},
-        {"recipient": ethics_reviewer, "message": reflection_message, 
+        {"recipient": graph.ethics_reviewer, "message": reflection_message, 
          "summary_method": "reflection_with_llm",
          "summary_args": {"summary_prompt" : 
             "Return review into as JSON object only:"
             "{'reviewer': '', 'review': ''}",},
          "max_turns": 1},
-         {"recipient": meta_reviewer, 
-          "message": "Aggregrate feedback from all reviewers and give final suggestions on the writing.", 
-         "max_turns": 1},
     ]
 
-    critic.register_nested_chats(
-    review_chats,
-    trigger=writer,
-    )
+def format_qa_problem(qa_problem, context):
+    qa_problem = f'<question>{qa_problem}<question>'
+    if context and context != 'None':
+        qa_problem = f'<context>{context}<context>{qa_problem}'
+    return qa_problem
+
+class AgentGraph:
+    """The writer, critics and reviewers of one group chat. A graph is used by one generation at a
+    time; nested chats and replies are registered once, when it is built"""
+
+    def __init__(self, llm_config=None):
+        import autogen
+        llm_config = llm_config or group_chat_llm_config
+        self.writer = autogen.AssistantAgent(name="Writer", system_message=WRITER_SYSTEM_MESSAGE, llm_config=llm_config)
+        self.grant_reviewer = autogen.AssistantAgent(name="Grant application Reviewer", system_message=GRANT_REVIEWER_SYSTEM_MESSAGE, llm_config=llm_config)
+        self.legal_reviewer = autogen.AssistantAgent(name="Legal Reviewer", system_message=LEGAL_REVIEWER_SYSTEM_MESSAGE, llm_config=llm_config)
+        self.ethics_reviewer = autogen.AssistantAgent(name="Ethics Reviewer", system_message=ETHICS_REVIEWER_SYSTEM_MESSAGE, llm_config=llm_config)
+        self.meta_reviewer = autogen.AssistantAgent(name="Meta Reviewer", system_message=META_REVIEWER_SYSTEM_MESSAGE, llm_config=llm_config)
+
+        # 'sequential': the critic runs the reviewers one after another as nested chats
+        self.critic = autogen.AssistantAgent(
+            name="Critic",
+            is_termination_msg=is_termination_msg,
+            llm_config=llm_config,
+            system_message=CRITIC_SYSTEM_MESSAGE,
+        )
+        self.critic.register_nested_chats(
+            review_chat_queue(self) + [{"recipient": self.meta_reviewer, "message": META_REVIEW_MESSAGE, "max_turns": 1}],
+            trigger=self.writer,
+        )
+
+        # 'parallel': the critic fans the draft out to all reviewers at once
+        self.parallel_critic = autogen.AssistantAgent(
+            name="Critic",
+            is_termination_msg=is_termination_msg,
+            llm_config=llm_config,
+            system_message=CRITIC_SYSTEM_MESSAGE,
+        )
+        self.review_senders = {
+            reviewer.name: autogen.ConversableAgent(name=f"Critic for {reviewer.name}", llm_config=False, human_input_mode="NEVER")
+            for reviewer in (self.grant_reviewer, self.legal_reviewer, self.ethics_reviewer)
+        }
+        self.meta_sender = autogen.ConversableAgent(name="Critic", llm_config=False, human_input_mode="NEVER")
+        # filled in place by every run and cleared by reset(), never rebound
+        self.timings = {'reviewers': {}}
+        self.register_parallel_review()
+
+        stream_agent_messages(*self.agents())
+        for agent in self.agents():
+            metrics_utils.instrument_agent(agent)
+
+    def agents(self):
+        return [self.writer, self.critic, self.parallel_critic, self.grant_reviewer, self.legal_reviewer,
+                self.ethics_reviewer, self.meta_reviewer, self.meta_sender, *self.review_senders.values()]
+
+    def register_parallel_review(self):
+        # autogen keeps a shallow copy of a reply's config, so the graph is reached through this
+        # closure instead: a copy would miss later attributes and keep a stale timings dict
+        def parallel_review_reply(recipient, messages=None, sender=None, config=None):
+            return self.parallel_review(messages)
+        self.parallel_critic.register_reply(self.writer, parallel_review_reply, position=0)
+
+    def reset(self):
+        for agent in self.agents():
+            agent.reset()
+        self.timings.clear()
+        self.timings['reviewers'] = {}
+
+    def run_review(self, review_chat, draft):
+        '''run one reviewer against the draft from its own sender agent so reviews can run in parallel'''
+        reviewer = review_chat["recipient"]
+        start = time.perf_counter()
+        res = self.review_senders[reviewer.name].initiate_chat(
+            recipient=reviewer,
+            message=f'''Review the following content. 
+            \n\n {draft}''',
+            max_turns=review_chat["max_turns"],
+            summary_method=review_chat["summary_method"],
+            summary_args=review_chat["summary_args"],
+            silent=True,
+        )
+        return res.summary, time.perf_counter() - start
+
+    def parallel_review(self, messages):
+        '''critic reply to the writer: fan the draft out to all independent reviewers at once,
+        then have the meta reviewer aggregate their reviews'''
+        graph, timings = self, self.timings
+        draft = messages[-1].get('content', '')
+        review_chats = review_chat_queue(graph)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(review_chats)) as executor:
+            # each reviewer thread inherits the message listener of this generation
+            futures = [executor.submit(contextvars.copy_context().run, graph.run_review, review_chat, draft) for review_chat in review_chats]
+            reviews = []
+            for review_chat, future in zip(review_chats, futures):
+                review, seconds = future.result()
+                reviews.append(review)
+                timings['reviewers'][review_chat["recipient"].name] = round(seconds, 3)
+        timings['reviews_wall'] = round(time.perf_counter() - start, 3)
+
+        start = time.perf_counter()
+        reviews_text = "\n".join(str(review) for review in reviews)
+        res = graph.meta_sender.initiate_chat(
+            recipient=graph.meta_reviewer,
+            message=f"{META_REVIEW_MESSAGE}\nContext: \n{reviews_text}",
+            max_turns=1,
+            summary_method="last_msg",
+            silent=True,
+        )
+        timings['meta_reviewer'] = round(time.perf_counter() - start, 3)
+        return True, res.summary
+
+class AgentPool:
+    """Hands out AgentGraphs, one per generation, and keeps up to max_idle of them for reuse"""
+
+    def __init__(self, max_idle=config.AGENT_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def warm(self, count):
+        '''build up to count idle graphs ahead of the first generations'''
+        for _ in range(min(count, self.max_idle) - len(self._idle)):
+            graph = AgentGraph()
+            with self._lock:
+                self._idle.append(graph)
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            graph = self._idle.pop() if self._idle else None
+        if graph is None:
+            graph = AgentGraph()
+        try:
+            yield graph
+        finally:
+            graph.reset()
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(graph)
+
+agent_pool = AgentPool()
+
+def warm_up(graphs=1):
+    '''import autogen and prebuild pooled agent graphs, so the first request does not pay for it'''
+    agent_pool.warm(graphs)
+
+def ask_rag_question_minimal_feedback(qa_problem, context):
+    import autogen
+    with agent_pool.acquire() as graph:
+        # plain critic without the registered reviews
+        critic = autogen.AssistantAgent(
+            name="Critic",
+            is_termination_msg=is_termination_msg,
+            llm_config=group_chat_llm_config,
+            system_message=CRITIC_SYSTEM_MESSAGE,
+        )
+        stream_agent_messages(critic)
+        metrics_utils.instrument_agent(critic)
+        if res := critic.initiate_chat(
+            recipient=graph.writer,
+            message=qa_problem,
+            max_turns=2,
+            summary_method="last_msg"
+        ): 
+            return res.summary
+
+def ask_rag_question_maximum_feedback(qa_problem, context):
+
+    # init results 
+    summary, chat_history =  '', ''
     
-    if res := critic.initiate_chat(
-        recipient=writer,
-        message=qa_problem,
-        max_turns=2,
-        summary_method="last_msg"
-    ):
-        summary, chat_history = res.summary, res.chat_history
+    qa_problem = format_qa_problem(qa_problem, context)
+
+    with agent_pool.acquire() as graph:
+        if res := graph.critic.initiate_chat(
+            recipient=graph.writer,
+            message=qa_problem,
+            max_turns=2,
+            summary_method="last_msg"
+        ):
+            summary, chat_history = res.summary, res.chat_history
     return summary, chat_history 
 
-if __name__ =="__main__":
-    pass 
\ No newline at end of file
+def ask_rag_question_parallel_review(qa_problem, context):
+    '''same writer/critic loop as ask_rag_question_maximum_feedback, but the independent reviews run
+    concurrently and only the meta review waits for all of them. Returns a timing breakdown as well'''
+    summary, chat_history = '', ''
+    start = time.perf_counter()
+
+    qa_problem = format_qa_problem(qa_problem, context)
+
+    with agent_pool.acquire() as graph:
+        if res := graph.parallel_critic.initiate_chat(
+            recipient=graph.writer,
+            message=qa_problem,
+            max_turns=2,
+            summary_method="last_msg"
+        ):
+            summary, chat_history = res.summary, res.chat_history
+        # copied before the graph is reset and returned to the pool
+        timings = {**graph.timings, 'reviewers': dict(graph.timings['reviewers'])}
+    timings['total'] = round(time.perf_counter() - start, 3)
+    return summary, chat_history, timings
@@ -0,0 +1,55 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """Thread safe in-process LRU cache"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class CacheStats:
+    """Thread safe hit/miss counters"""
+
+    def __init__(self, *counters):
+        self._counters = {counter: 0 for counter in counters}
+        self._lock = threading.Lock()
+
+    def incr(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counters)
+
+def embedding_cache_key(model, text):
+    """Content address of an embedding: sha256 over model and text"""
+    return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+if __name__ == "__main__":
+    pass
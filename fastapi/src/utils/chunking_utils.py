@@ -0,0 +1,65 @@
+import re
+import math
+import hashlib
+
+try:
+    import src.utils.config as config
+except Exception as e:
+    print(f'ERROR: {e}')
+    import utils.config as config
+
+def chunk_hash(chunk_text):
+    '''same value as the generated file_chunks.chunk_hash column, md5(chunk_text)'''
+    return hashlib.md5(chunk_text.encode()).hexdigest()
+
+def mean_embedding(vectors):
+    '''unit length mean of the vectors'''
+    mean = [sum(column) / len(vectors) for column in zip(*vectors)]
+    norm = math.sqrt(sum(x * x for x in mean))
+    return [x / norm for x in mean] if norm else mean
+
+def semantic_chunker(embeddings, number_of_chunks):
+    # imported on first use, langchain_experimental is slow to load
+    from langchain_experimental.text_splitter import SemanticChunker
+    return SemanticChunker(embeddings, number_of_chunks=number_of_chunks)
+
+def split_text(text, embeddings, number_of_chunks):
+    '''SemanticChunker chunks as (chunk, None), their embeddings still have to be computed'''
+    return [(chunk, None) for chunk in semantic_chunker(embeddings, number_of_chunks).split_text(text)]
+
+def split_text_single_pass(text, embeddings, number_of_chunks):
+    '''same breakpoints as SemanticChunker.split_text, but every chunk comes with the mean of the
+    sentence embeddings computed to find them, so chunks do not have to be embedded again'''
+    chunker = semantic_chunker(embeddings, number_of_chunks)
+    sentences_list = re.split(chunker.sentence_split_regex, text)
+    if len(sentences_list) == 1:
+        return [(text, None)]
+    # SemanticChunker internals as of langchain_experimental 0.0.61, see split_text there
+    distances, sentences = chunker._calculate_sentence_distances(sentences_list)
+    if chunker.number_of_chunks is not None:
+        threshold = chunker._threshold_from_clusters(distances)
+    else:
+        threshold = chunker._calculate_breakpoint_threshold(distances)
+
+    chunks = []
+    start_index = 0
+    breakpoints = [i for i, distance in enumerate(distances) if distance > threshold]
+    for end_index in breakpoints + [len(sentences) - 1]:
+        if group := sentences[start_index:end_index + 1]:
+            chunks.append((
+                " ".join(d["sentence"] for d in group),
+                mean_embedding([d["combined_sentence_embedding"] for d in group]),
+            ))
+        start_index = end_index + 1
+    return chunks
+
+def chunk_text(text, embeddings, number_of_chunks, chunker=config.CHUNKER):
+    '''split text into (chunk, embedding or None) pairs with the configured chunker'''
+    if chunker == 'single_pass':
+        return split_text_single_pass(text, embeddings, number_of_chunks)
+    if chunker == 'semantic':
+        return split_text(text, embeddings, number_of_chunks)
+    raise ValueError(f'unknown chunker: {chunker}')
+
+if __name__ == '__main__':
+    pass
@@ -1,16 +1,95 @@
-import os 
+import os
 
 DOCKER_RUNNING = os.environ.get('DOCKER_RUNNING', False)
 
 DB_HOSTNAME='localhost'
 if DOCKER_RUNNING:
-    DB_HOSTNAME='db'
+    DB_HOSTNAME='postgres'
 
+DB_PORT = int(os.environ.get('DB_PORT', 5432))
+DB_NAME = os.environ.get('DB_NAME', 'vectordb')
+DB_USER = os.environ.get('DB_USER', 'testuser')
+DB_PASSWORD = os.environ.get('DB_PASSWORD', 'testpwd')
+DB_CONNINFO = f'host={DB_HOSTNAME} port={DB_PORT} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}'
+
+# connection pool shared by every request in the process
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10)) # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300)) # seconds before an idle connection is closed
+
+# async request path: asyncio Postgres pool and async OpenAI client for retrieval and embeddings
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'true').lower() == 'true'
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', os.cpu_count() or 1)) # threads for PDF extraction and chunking
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 4)) # concurrent AutoGen chats
+# import autogen, PyPDF2 and the chunker and prebuild agents in the background at startup instead of on first use
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'false').lower() == 'true'
+AGENT_POOL_SIZE = int(os.environ.get('AGENT_POOL_SIZE', GENERATION_WORKERS)) # idle group chat agent graphs kept for reuse
+
+# 'openai' calls the OpenAI embeddings API, 'local' runs a sentence-transformers model on this machine
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'openai')
 OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
+LOCAL_EMBEDDING_MODEL = os.environ.get('LOCAL_EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+LOCAL_EMBEDDING_DEVICE = os.environ.get('LOCAL_EMBEDDING_DEVICE', 'cpu')
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get('LOCAL_EMBEDDING_BATCH_SIZE', 64)) # texts per forward pass
+LOCAL_EMBEDDING_THREADS = int(os.environ.get('LOCAL_EMBEDDING_THREADS', CPU_WORKERS)) # torch intra-op threads
+EMBEDDING_MODEL = LOCAL_EMBEDDING_MODEL if EMBEDDING_PROVIDER == 'local' else OPENAI_EMBEDDING_MODEL
+# must match the vector(n) columns in pgvector/init.sql, see pgvector/migrations/switch_embedding_dimensions.sql
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', 384 if EMBEDDING_PROVIDER == 'local' else 1536))
+
+# embedding cache: in-process LRU entries in front of the embedding_cache table
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 5000))
+EMBEDDING_CACHE_DB = os.environ.get('EMBEDDING_CACHE_DB', 'true').lower() == 'true'
+
+# ANN search accuracy/speed knobs, None keeps the server default (hnsw.ef_search=40, ivfflat.probes=1)
+HNSW_EF_SEARCH = os.environ.get('HNSW_EF_SEARCH')
+IVFFLAT_PROBES = os.environ.get('IVFFLAT_PROBES')
+# the ranges pgvector accepts for them, larger or smaller request values are rejected with a 422
+MAX_HNSW_EF_SEARCH = 1000
+MAX_IVFFLAT_PROBES = 32768
+
+# 'parallel' runs the grant, legal and ethics reviewers at the same time, 'sequential' one after another
+REVIEW_MODE = os.environ.get('REVIEW_MODE', 'parallel')
+STREAM_TOKENS = os.environ.get('STREAM_TOKENS', 'false').lower() == 'true' # stream completion tokens of the group chat agents
+SSE_KEEPALIVE_SECONDS = 15
+
+# batch answer generation for a whole project
+GENERATION_JOB_WORKERS = int(os.environ.get('GENERATION_JOB_WORKERS', 2)) # projects generated at the same time
+GENERATION_CONCURRENCY = int(os.environ.get('GENERATION_CONCURRENCY', 4)) # default questions answered at the same time per project
+GENERATION_MAX_CONCURRENCY = int(os.environ.get('GENERATION_MAX_CONCURRENCY', 8))
+
+# semantic answer cache: reuse an answer when a question this similar was asked with the same context
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_MIN_SIMILARITY = float(os.environ.get('ANSWER_CACHE_MIN_SIMILARITY', 0.97)) # cosine similarity of the questions
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', 7 * 24 * 3600))
 
 CHUNK_SIZE = 4000
+# 'semantic' embeds the chunks again after SemanticChunker found them, 'single_pass' reuses the
+# sentence embeddings computed for the breakpoints (mean per chunk), halving embedding calls
+CHUNKER = os.environ.get('CHUNKER', 'semantic')
+
+RAG_TOP_K = int(os.environ.get('RAG_TOP_K', 3)) # chunks returned per question by /get_rag_context_batch
+MAX_RAG_TOP_K = int(os.environ.get('MAX_RAG_TOP_K', 50)) # largest k accepted by /get_rag_context_batch
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000)) # largest limit accepted by /get_data and /get_questions
+
+# 'vector' ranks chunks by embedding distance only, 'hybrid' fuses it with full text search
+# (reciprocal rank fusion) when the question text is sent along
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'vector')
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 20)) # chunks taken from each ranking before fusing
+RRF_K = int(os.environ.get('RRF_K', 60)) # damps the weight of the top ranks, 60 as in the original RRF paper
+TEXT_SEARCH_CONFIG = 'english' # must match the chunk_tsv column in init.sql
+
+# 'copy' streams chunks with a binary COPY, 'insert' issues one INSERT per chunk
+CHUNK_INSERT_MODE = os.environ.get('CHUNK_INSERT_MODE', 'copy')
+
+# 'pipeline' runs extraction, chunking, embedding and insert concurrently, 'sequential' runs them one after another
+INGEST_MODE = os.environ.get('INGEST_MODE', 'pipeline')
+INGEST_WINDOW_CHARS = int(os.environ.get('INGEST_WINDOW_CHARS', CHUNK_SIZE * 4)) # text chunked at a time
+INGEST_EMBED_BATCH_SIZE = int(os.environ.get('INGEST_EMBED_BATCH_SIZE', 16)) # chunks per embedding request
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 64)) # items buffered between stages
+INGEST_JOB_WORKERS = int(os.environ.get('INGEST_JOB_WORKERS', 2)) # files ingested at the same time by /ingest_jobs
 
 ERROR_MESSAGE = "Internal server error. "
 
 if __name__ =="__main__":
-    pass 
\ No newline at end of file
+    pass
@@ -0,0 +1,159 @@
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import src.utils.auto_gen_utils as auto_gen_utils
+    import src.utils.langchain_utils as langchain_utils
+    import src.utils.pgvector_utils as pgvector_utils
+    import src.utils.job_utils as job_utils
+    import src.utils.cache_utils as cache_utils
+    import src.utils.metrics_utils as metrics_utils
+    import src.utils.config as config
+except Exception as e:
+    print(f'ERROR importing: {e}')
+    import utils.auto_gen_utils as auto_gen_utils
+    import utils.langchain_utils as langchain_utils
+    import utils.pgvector_utils as pgvector_utils
+    import utils.job_utils as job_utils
+    import utils.cache_utils as cache_utils
+    import utils.metrics_utils as metrics_utils
+    import utils.config as config
+
+generation_jobs = job_utils.JobRegistry(config.GENERATION_JOB_WORKERS)
+answer_cache_stats = cache_utils.CacheStats('hits', 'misses', 'errors')
+
+def format_chat_history(chat_history):
+    '''same transcript text the Streamlit page stores in questions.chat_history'''
+    text = ''
+    for response in chat_history:
+        text += f"role: {response.get('role','')} \n\n"
+        text += f"content:\n\n{response.get('content','')} \n\n"
+        text += f"*"*10 + '\n\n'
+    return text
+
+def run_group_chat(qa_problem, context, review_mode=config.REVIEW_MODE):
+    '''run the group chat, returns summary, chat_history and timings (None in sequential mode)'''
+    if review_mode == 'parallel':
+        return auto_gen_utils.ask_rag_question_parallel_review(qa_problem, context)
+    summary, chat_history = auto_gen_utils.ask_rag_question_maximum_feedback(qa_problem, context)
+    return summary, chat_history, None
+
+def context_hash(context):
+    return hashlib.sha256(str(context).encode('utf-8')).hexdigest()
+
+def lookup_cached_answer(qa_problem, context, review_mode=config.REVIEW_MODE):
+    '''return (cached result or None, question embedding) for the answer cache'''
+    try:
+        question_embedding = langchain_utils.get_open_ai_embeddings(qa_problem)
+        cached = pgvector_utils.lookup_answer_cache(question_embedding, context_hash(context), review_mode, config.ANSWER_CACHE_TTL_SECONDS)
+    except Exception as e:
+        print(f'ERROR lookup_cached_answer: {e}')
+        answer_cache_stats.incr('errors')
+        return None, None
+    if cached is False:
+        answer_cache_stats.incr('errors')
+        return None, question_embedding
+    if cached and cached[2] >= config.ANSWER_CACHE_MIN_SIMILARITY:
+        answer_cache_stats.incr('hits')
+        summary, chat_history, similarity = cached
+        return {'summary': summary, 'chat_history': json.loads(chat_history), 'cached': True, 'similarity': similarity}, question_embedding
+    answer_cache_stats.incr('misses')
+    return None, question_embedding
+
+def generate_answer(qa_problem, context, review_mode=config.REVIEW_MODE, run=run_group_chat):
+    '''answer from the semantic answer cache when possible, otherwise run the group chat and cache its answer'''
+    question_embedding = None
+    if config.ANSWER_CACHE_ENABLED:
+        start = time.perf_counter()
+        cached, question_embedding = lookup_cached_answer(qa_problem, context, review_mode)
+        metrics_utils.observe_stage('generation', 'answer_cache_lookup', time.perf_counter() - start)
+        if cached:
+            return cached
+    start = time.perf_counter()
+    summary, chat_history, timings = run(qa_problem, context, review_mode)
+    metrics_utils.observe_stage('generation', f'group_chat_{review_mode}', time.perf_counter() - start)
+    result = {'summary': summary, 'chat_history': chat_history, 'cached': False}
+    if timings:
+        result['timings'] = timings
+        metrics_utils.observe_stage('generation', 'reviews', timings.get('reviews_wall'))
+        metrics_utils.observe_stage('generation', 'meta_review', timings.get('meta_reviewer'))
+    if summary and chat_history and question_embedding:
+        pgvector_utils.insert_answer_cache(qa_problem, question_embedding, context_hash(context), review_mode, summary, json.dumps(chat_history, default=str))
+    return result
+
+def generate_answer_stream(listener, qa_problem, context, review_mode=config.REVIEW_MODE):
+    '''generate_answer for the streaming endpoint, agent messages go to listener'''
+    def run(qa_problem, context, review_mode):
+        return auto_gen_utils.run_with_listener(listener, run_group_chat, qa_problem, context, review_mode)
+    result = generate_answer(qa_problem, context, review_mode, run)
+    if not (result['summary'] and result['chat_history']):
+        raise RuntimeError('group chat returned no answer')
+    return result
+
+def get_answer_cache_stats():
+    stats = answer_cache_stats.as_dict()
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
+
+def retrieve_contexts(questions, files):
+    '''rag context of every question (id, question, answer, project_id, embedding, ...) with one retrieval query'''
+    if not files:
+        return {question[0]: 'None' for question in questions}
+    stored = [question[0] for question in questions if question[4] is not None]
+    missing = [question for question in questions if question[4] is None]
+    embeddings = langchain_utils.get_open_ai_embeddings_docs([question[1] for question in missing]) if missing else []
+    results = pgvector_utils.rag_context_batch(files, embeddings, stored, k=1)
+    if results is False:
+        raise RuntimeError('could not retrieve rag context')
+    question_ids = [question[0] for question in missing] + stored
+    return {question_id: result['chunks'][0]['chunk_text'] if result['chunks'] else 'None' for question_id, result in zip(question_ids, results)}
+
+def generate_project_answers_job(job, project_id, files, question_ids=None, concurrency=config.GENERATION_CONCURRENCY, review_mode=config.REVIEW_MODE):
+    '''job body: answer every (or the selected) question of a project, saving each answer as it completes'''
+    # the embedding tells retrieve_contexts which questions need one computed
+    questions = pgvector_utils.query_questions(project_id, ['id', 'question', 'answer', 'project_id', 'embedding'])
+    if questions is False:
+        raise RuntimeError(f'could not load questions of project {project_id}')
+    if question_ids:
+        questions = [question for question in questions if question[0] in set(question_ids)]
+    job.progress.update({'total': len(questions), 'done': 0, 'failed': 0, 'running': 0})
+    contexts = retrieve_contexts(questions, files)
+    lock = threading.Lock()
+
+    def answer(question):
+        with lock:
+            job.progress['running'] += 1
+        try:
+            result = generate_answer(question[1], contexts[question[0]], review_mode)
+            if not result['summary']:
+                raise RuntimeError('no answer generated')
+            if not pgvector_utils.update_question_answer(question[0], result['summary'], format_chat_history(result['chat_history'])):
+                raise RuntimeError('could not save answer')
+        finally:
+            with lock:
+                job.progress['running'] -= 1
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, config.GENERATION_MAX_CONCURRENCY))) as executor:
+        futures = {executor.submit(answer, question): question for question in questions}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                with lock:
+                    job.progress['done'] += 1
+            except Exception as e:
+                with lock:
+                    job.progress['failed'] += 1
+                job.errors.append(f'question {futures[future][0]}: {e}')
+    return {'answered': job.progress['done'], 'failed': job.progress['failed']}
+
+def submit_project_answers_job(project_id, files, question_ids=None, concurrency=config.GENERATION_CONCURRENCY, review_mode=config.REVIEW_MODE):
+    job = generation_jobs.submit('generate_answers', generate_project_answers_job, project_id, files, question_ids, concurrency, review_mode)
+    job.progress['project_id'] = project_id
+    return job
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,278 @@
+import time
+import queue
+import hashlib
+import threading
+from math import ceil
+
+try:
+    import src.utils.langchain_utils as langchain_utils
+    import src.utils.pgvector_utils as pgvector_utils
+    import src.utils.chunking_utils as chunking_utils
+    import src.utils.metrics_utils as metrics_utils
+    import src.utils.config as config
+except Exception as e:
+    print(f'ERROR importing: {e}')
+    import utils.langchain_utils as langchain_utils
+    import utils.pgvector_utils as pgvector_utils
+    import utils.chunking_utils as chunking_utils
+    import utils.metrics_utils as metrics_utils
+    import utils.config as config
+
+_DONE = object()
+
+def file_content_hash(file_bytes):
+    '''sha256 of an uploaded file object, which is left at position 0'''
+    file_bytes.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: file_bytes.read(1 << 20), b''):
+        digest.update(block)
+    file_bytes.seek(0)
+    return digest.hexdigest()
+
+class StageStats:
+    """Items and busy time of one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def record(self, items, seconds):
+        self.items += items
+        self.busy += seconds
+
+    def as_dict(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started if self.started else 0.0
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'busy_seconds': round(self.busy, 4),
+            'elapsed_seconds': round(elapsed, 4),
+            'items_per_second': round(self.items / self.busy, 1) if self.busy else None,
+        }
+
+class IngestPipeline:
+    """Page extraction -> chunking -> batched embedding -> bulk insert, each stage in its own
+    thread connected by bounded queues so a document is never held in memory all at once"""
+
+    def __init__(self, file_name, file_bytes, embeddings, chunk_size=config.CHUNK_SIZE, chunker=config.CHUNKER):
+        self.file_name = file_name
+        self.file_bytes = file_bytes
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+        self.chunker = chunker
+        self.window_chars = max(config.INGEST_WINDOW_CHARS, chunk_size)
+        self.batch_size = config.INGEST_EMBED_BATCH_SIZE
+        self.stats = {name: StageStats(name) for name in ('extract', 'chunk', 'embed', 'insert')}
+        self.pages = queue.Queue(maxsize=config.INGEST_QUEUE_SIZE)
+        self.chunks = queue.Queue(maxsize=config.INGEST_QUEUE_SIZE)
+        self.rows = queue.Queue(maxsize=config.INGEST_QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.error = None
+        self.pages_total = None
+        self.content_hash = None
+        self.unchanged = False # same bytes as the stored file, nothing to do
+        self.known_chunks = set() # chunk hashes already stored for this file name
+        self.chunk_hashes = set() # chunk hashes of this upload
+        self.chunks_unchanged = 0
+        self.stale_chunks_deleted = 0
+
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _run_stage(self, name, func, output):
+        stats = self.stats[name]
+        stats.started = time.perf_counter()
+        try:
+            func(stats)
+        except Exception as e:
+            print(f'ERROR ingest {name}: {e}')
+            self.error = e
+            self.stop.set()
+        finally:
+            stats.finished = time.perf_counter()
+            self._put(output, _DONE)
+
+    def extract(self, stats):
+        if self.file_name[-4:] == '.pdf':
+            import PyPDF2
+            reader = PyPDF2.PdfReader(self.file_bytes)
+            self.pages_total = len(reader.pages)
+            for page in reader.pages:
+                start = time.perf_counter()
+                text = page.extract_text()
+                stats.record(1, time.perf_counter() - start)
+                if not self._put(self.pages, text):
+                    return
+        elif self.file_name[-7:] == '.manual' or self.file_name[-4:] == '.txt':
+            start = time.perf_counter()
+            text = str(self.file_bytes.read().decode())
+            stats.record(0, time.perf_counter() - start)
+            self.pages_total = ceil(len(text) / self.window_chars)
+            for ix in range(0, len(text), self.window_chars):
+                stats.record(1, 0)
+                if not self._put(self.pages, text[ix:ix + self.window_chars]):
+                    return
+        else:
+            raise TypeError("Document is not one of the accepted types: pdf, txt")
+
+    def _split(self, text):
+        # (chunk, embedding) pairs, the embed stage fills in embeddings the chunker did not compute
+        return chunking_utils.chunk_text(text, self.embeddings, ceil(len(text) / self.chunk_size), self.chunker)
+
+    def chunk(self, stats):
+        # chunk a window of pages at a time; the last chunk of a window is carried into the next
+        # one so chunk boundaries are not forced at page breaks
+        window = ''
+        while (page := self._get(self.pages)) is not _DONE:
+            window += page
+            if len(window) < self.window_chars:
+                continue
+            start = time.perf_counter()
+            *chunks, (window, _) = self._split(window) or [('', None)]
+            stats.record(len(chunks), time.perf_counter() - start)
+            if not self._emit(chunks):
+                return
+        if window.strip() and not self.stop.is_set():
+            start = time.perf_counter()
+            chunks = self._split(window)
+            stats.record(len(chunks), time.perf_counter() - start)
+            self._emit(chunks)
+
+    def _emit(self, chunks):
+        # chunks already stored for this file are neither embedded nor inserted again
+        for chunk_text, embedding in chunks:
+            chunk_hash = chunking_utils.chunk_hash(chunk_text)
+            self.chunk_hashes.add(chunk_hash)
+            if chunk_hash in self.known_chunks:
+                self.chunks_unchanged += 1
+            elif not self._put(self.chunks, (chunk_text, embedding)):
+                return False
+        return True
+
+    def _embed_batch(self, stats, batch):
+        start = time.perf_counter()
+        embeddings_list = self.embeddings.embed_documents(batch)
+        stats.record(len(batch), time.perf_counter() - start)
+        for chunk_text, embedding in zip(batch, embeddings_list):
+            if not self._put(self.rows, (self.file_name, chunk_text, embedding)):
+                return False
+        return True
+
+    def embed(self, stats):
+        batch = []
+        while (chunk := self._get(self.chunks)) is not _DONE:
+            chunk_text, embedding = chunk
+            if embedding is not None:
+                # already embedded by the single pass chunker
+                if not self._put(self.rows, (self.file_name, chunk_text, embedding)):
+                    return
+                continue
+            batch.append(chunk_text)
+            if len(batch) >= self.batch_size:
+                if not self._embed_batch(stats, batch):
+                    return
+                batch = []
+        if batch and not self.stop.is_set():
+            self._embed_batch(stats, batch)
+
+    def _rows(self):
+        stats = self.stats['insert']
+        while True:
+            wait = time.perf_counter()
+            row = self._get(self.rows)
+            if row is _DONE:
+                break
+            stats.busy -= time.perf_counter() - wait # time spent waiting on upstream stages is not insert time
+            stats.items += 1
+            yield row
+        if self.error:
+            # abort the COPY so the transaction is rolled back
+            raise RuntimeError(f'ingestion failed: {self.error}')
+
+    def run(self):
+        # a concurrent ingest of the same file name raises FileIngestInProgress here
+        with pgvector_utils.file_ingest_lock(self.file_name):
+            return self._run()
+
+    def _run(self):
+        self.content_hash = file_content_hash(self.file_bytes)
+        stored_hash = pgvector_utils.get_file_content_hash(self.file_name)
+        if stored_hash == self.content_hash:
+            self.unchanged = True
+            print(f'INFO ingest {self.file_name}: unchanged, skipped')
+            return True
+        # without the stored hashes every chunk would be inserted again
+        if stored_hash is False or (known_chunks := pgvector_utils.get_chunk_hashes(self.file_name)) is False:
+            self.error = RuntimeError('could not read the stored chunks of the file')
+            return False
+        self.known_chunks = known_chunks
+        stages = [
+            threading.Thread(target=self._run_stage, args=('extract', self.extract, self.pages), daemon=True),
+            threading.Thread(target=self._run_stage, args=('chunk', self.chunk, self.chunks), daemon=True),
+            threading.Thread(target=self._run_stage, args=('embed', self.embed, self.rows), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        insert_stats = self.stats['insert']
+        insert_stats.started = time.perf_counter()
+        inserted = pgvector_utils.insert_file_chunks_into_db_bulk(self._rows())
+        insert_stats.finished = time.perf_counter()
+        insert_stats.busy += insert_stats.finished - insert_stats.started
+        if not inserted:
+            self.stop.set()
+        for stage in stages:
+            stage.join()
+        for stats in self.stats.values():
+            print(f'INFO ingest {self.file_name}: {stats.as_dict()}')
+            metrics_utils.observe_stage('ingest', stats.name, stats.busy)
+        if not inserted or self.error is not None:
+            return False
+        if not (finished := pgvector_utils.finish_file_ingest(self.file_name, self.content_hash, self.chunk_hashes)):
+            return False
+        self.stale_chunks_deleted = finished['stale_chunks_deleted']
+        print(f'INFO ingest {self.file_name}: {self.chunks_unchanged} chunks unchanged, {self.stale_chunks_deleted} stale chunks deleted')
+        return True
+
+    def get_stats(self):
+        return [stats.as_dict() for stats in self.stats.values()]
+
+    def progress(self):
+        chunked, inserted = self.stats['chunk'].items, self.stats['insert'].items
+        return {
+            'pages_total': self.pages_total,
+            'pages_done': self.stats['extract'].items,
+            'chunks_done': inserted,
+            'chunks_unchanged': self.chunks_unchanged,
+            'chunks_left': chunked - inserted - self.chunks_unchanged, # grows until chunking_done
+            'chunking_done': self.stats['chunk'].finished is not None,
+            'unchanged': self.unchanged,
+        }
+
+def build_pipeline(file_name, file_bytes, open_api_key, chunk_size=config.CHUNK_SIZE, model=config.EMBEDDING_MODEL):
+    embeddings = langchain_utils.cached_embeddings(model, open_api_key)
+    return IngestPipeline(file_name, file_bytes, embeddings, chunk_size, config.CHUNKER)
+
+def ingest_file(file_name, file_bytes, open_api_key, chunk_size=config.CHUNK_SIZE, model=config.EMBEDDING_MODEL):
+    pipeline = build_pipeline(file_name, file_bytes, open_api_key, chunk_size, model)
+    if pipeline.run():
+        return pipeline
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,97 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class Job:
+    """A unit of background work and its progress"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {}
+        self.progress_source = None # optional callable returning live progress
+        self.errors = []
+        self.result = None
+
+    def as_dict(self):
+        progress = dict(self.progress)
+        if self.progress_source:
+            try:
+                progress.update(self.progress_source())
+            except Exception as e:
+                print(f'ERROR job progress {self.id}: {e}')
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'progress': progress,
+            'errors': list(self.errors),
+            'result': self.result,
+        }
+
+class JobRegistry:
+    """Runs jobs on a bounded worker pool and keeps the most recent ones for status polling"""
+
+    def __init__(self, max_workers, history_size=100):
+        self.max_workers = max_workers
+        self.history_size = history_size
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        return self._executor
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            print(f'ERROR job {job.kind} {job.id}: {e}')
+            job.errors.append(str(e))
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    def submit(self, kind, func, *args, **kwargs):
+        """Queue func(job, *args, **kwargs) and return the job at once"""
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+            self._get_executor().submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _evict(self):
+        # drop the oldest finished jobs once the history is full
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._lock:
+            return [job for job in self._jobs.values() if kind is None or job.kind == kind]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+if __name__ == "__main__":
+    pass
@@ -1,23 +1,196 @@
-
-from langchain_openai import OpenAIEmbeddings
+import asyncio
+import threading
+from array import array
+from langchain_core.embeddings import Embeddings
 
 try:
     import src.utils.config as config
+    import src.utils.cache_utils as cache_utils
+    import src.utils.pgvector_utils as pgvector_utils
+    import src.utils.async_utils as async_utils
+    import src.utils.metrics_utils as metrics_utils
 except Exception as e:
     print(f'ERROR: {e}')
     import utils.config as config
+    import utils.cache_utils as cache_utils
+    import utils.pgvector_utils as pgvector_utils
+    import utils.async_utils as async_utils
+    import utils.metrics_utils as metrics_utils
+
+# shared by every embeddings client in the process
+embedding_cache = cache_utils.LRUCache(config.EMBEDDING_CACHE_SIZE)
+embedding_cache_stats = cache_utils.CacheStats('memory_hits', 'db_hits', 'misses')
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that checks the in-process LRU, then the embedding_cache table,
+    and only sends texts that missed both to the wrapped embeddings client. Entries are keyed
+    by model, so the providers never share cached vectors"""
+
+    def __init__(self, embeddings, model):
+        self.embeddings = embeddings
+        self.model = model
+
+    def _lookup(self, texts):
+        keys = [cache_utils.embedding_cache_key(self.model, text) for text in texts]
+        found = {}
+        for key in keys:
+            if key not in found and (embedding := embedding_cache.get(key)) is not None:
+                found[key] = embedding
+        embedding_cache_stats.incr('memory_hits', sum(1 for key in keys if key in found))
+        if missing := {key for key in keys if key not in found}:
+            if config.EMBEDDING_CACHE_DB:
+                from_db = pgvector_utils.get_cached_embeddings(missing)
+                for key, embedding in from_db.items():
+                    found[key] = array('f', embedding)
+                    embedding_cache.put(key, found[key])
+                embedding_cache_stats.incr('db_hits', sum(1 for key in keys if key in from_db))
+        return keys, found
+
+    def _store(self, rows):
+        for key, _, embedding in rows:
+            embedding_cache.put(key, array('f', embedding))
+        if config.EMBEDDING_CACHE_DB:
+            pgvector_utils.insert_cached_embeddings(rows)
+
+    def _misses(self, keys, texts, found):
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        embedding_cache_stats.incr('misses', sum(1 for key in keys if key not in found))
+        return missing
+
+    def embed_documents(self, texts):
+        keys, found = self._lookup(texts)
+        if missing := self._misses(keys, texts, found):
+            with metrics_utils.embedding_call(self.model, 'documents', len(missing)):
+                new_embeddings = self.embeddings.embed_documents(list(missing.values()))
+            rows = [(key, self.model, embedding) for key, embedding in zip(missing, new_embeddings)]
+            self._store(rows)
+            found.update({key: embedding for key, _, embedding in rows})
+        return [list(found[key]) for key in keys]
+
+    def embed_query(self, text):
+        keys, found = self._lookup([text])
+        if embedding := found.get(keys[0]):
+            return list(embedding)
+        embedding_cache_stats.incr('misses')
+        with metrics_utils.embedding_call(self.model, 'query', 1):
+            embedding = self.embeddings.embed_query(text)
+        self._store([(keys[0], self.model, embedding)])
+        return embedding
+
+    async def aembed_documents(self, texts):
+        # cache tiers are offloaded to a thread, only the OpenAI call runs on the event loop
+        keys, found = await asyncio.to_thread(self._lookup, texts)
+        if missing := self._misses(keys, texts, found):
+            with metrics_utils.embedding_call(self.model, 'documents', len(missing)):
+                new_embeddings = await self.embeddings.aembed_documents(list(missing.values()))
+            rows = [(key, self.model, embedding) for key, embedding in zip(missing, new_embeddings)]
+            await asyncio.to_thread(self._store, rows)
+            found.update({key: embedding for key, _, embedding in rows})
+        return [list(found[key]) for key in keys]
+
+    async def aembed_query(self, text):
+        keys, found = await asyncio.to_thread(self._lookup, [text])
+        if embedding := found.get(keys[0]):
+            return list(embedding)
+        embedding_cache_stats.incr('misses')
+        with metrics_utils.embedding_call(self.model, 'query', 1):
+            embedding = await self.embeddings.aembed_query(text)
+        await asyncio.to_thread(self._store, [(keys[0], self.model, embedding)])
+        return embedding
+
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+def load_local_model(model, device=config.LOCAL_EMBEDDING_DEVICE, threads=config.LOCAL_EMBEDDING_THREADS):
+    '''sentence-transformers model shared by every LocalEmbeddings in the process, loaded once'''
+    with _local_models_lock:
+        if (model, device) not in _local_models:
+            import torch
+            from sentence_transformers import SentenceTransformer
+            torch.set_num_threads(threads)
+            _local_models[(model, device)] = SentenceTransformer(model, device=device)
+            dimensions = _local_models[(model, device)].get_sentence_embedding_dimension()
+            if dimensions != config.EMBEDDING_DIMENSIONS:
+                print(f'WARNING {model} returns {dimensions} dimensions, the database expects {config.EMBEDDING_DIMENSIONS}')
+        return _local_models[(model, device)]
 
-embeddings = OpenAIEmbeddings(model=config.OPENAI_EMBEDDING_MODEL)
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers embeddings computed on this machine, batch_size texts per forward pass"""
+
+    def __init__(self, model=config.LOCAL_EMBEDDING_MODEL, batch_size=config.LOCAL_EMBEDDING_BATCH_SIZE,
+                 device=config.LOCAL_EMBEDDING_DEVICE, threads=config.LOCAL_EMBEDDING_THREADS):
+        self.model = model
+        self.batch_size = batch_size
+        self.device = device
+        self.threads = threads
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        encoder = load_local_model(self.model, self.device, self.threads)
+        vectors = encoder.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        # inference holds the CPU, keep it on the cpu executor rather than the event loop
+        return await async_utils.run_cpu_bound(self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await async_utils.run_cpu_bound(self.embed_query, text)
+
+def embedding_provider(provider=config.EMBEDDING_PROVIDER, model=None, openai_api_key=None):
+    '''uncached embeddings client of the given provider'''
+    if provider == 'local':
+        return LocalEmbeddings(model or config.LOCAL_EMBEDDING_MODEL)
+    if provider == 'openai':
+        # imported on first use, the OpenAI client and tokenizer are slow to load
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model or config.OPENAI_EMBEDDING_MODEL, openai_api_key=openai_api_key)
+    raise ValueError(f'unknown embedding provider: {provider}')
+
+def cached_embeddings(model=None, openai_api_key=None, provider=config.EMBEDDING_PROVIDER):
+    client = embedding_provider(provider, model, openai_api_key)
+    return CachedEmbeddings(client, client.model)
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings():
+    '''process wide embeddings client, built on first use'''
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                _embeddings = cached_embeddings()
+    return _embeddings
 
 def get_open_ai_embeddings(text):
-    if query_result := embeddings.embed_query(text):
+    if query_result := get_embeddings().embed_query(text):
         return query_result
 
 def get_open_ai_embeddings_docs(docs):
-    if query_result := embeddings.embed_documents(docs):
+    if query_result := get_embeddings().embed_documents(docs):
         return query_result
 
+async def aget_open_ai_embeddings(text):
+    if query_result := await get_embeddings().aembed_query(text):
+        return query_result
+
+def get_embedding_cache_stats():
+    stats = embedding_cache_stats.as_dict()
+    lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+    stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else None
+    stats['memory_entries'] = len(embedding_cache)
+    return stats
+
 
 
 if __name__ =="__main__":
-    pass 
\ No newline at end of file
+    pass 
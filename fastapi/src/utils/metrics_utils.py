@@ -0,0 +1,127 @@
+import time
+import asyncio
+import functools
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# served by /metrics from the process registry; run a single uvicorn worker per container or the
+# numbers only cover the worker that answered the scrape
+
+REQUEST_LATENCY = Histogram(
+    'silverhand_request_duration_seconds', 'HTTP request latency by route template (streaming responses until the headers are sent)',
+    ['method', 'route', 'status'],
+)
+DB_LATENCY = Histogram(
+    'silverhand_db_duration_seconds', 'Duration of pgvector_utils functions, including waiting for a pooled connection',
+    ['function', 'result'],
+)
+EMBEDDING_CALLS = Counter('silverhand_embedding_calls_total', 'Calls to the embeddings provider (cache misses only)', ['model', 'operation'])
+EMBEDDING_TEXTS = Counter('silverhand_embedding_texts_total', 'Texts sent to the embeddings provider', ['model'])
+EMBEDDING_BATCH_SIZE = Histogram(
+    'silverhand_embedding_batch_size', 'Texts per call to the embeddings provider', ['model'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048),
+)
+EMBEDDING_LATENCY = Histogram('silverhand_embedding_duration_seconds', 'Duration of calls to the embeddings provider', ['model', 'operation'])
+LLM_TURN_DURATION = Histogram(
+    'silverhand_llm_turn_duration_seconds', 'Duration of one LLM completion of an agent', ['agent'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+LLM_TOKENS = Counter('silverhand_llm_tokens_total', 'Tokens used by agent completions', ['agent', 'model', 'kind'])
+STAGE_LATENCY = Histogram(
+    'silverhand_stage_duration_seconds', 'Duration of the stages of ingestion and answer generation', ['pipeline', 'stage'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+def render():
+    return generate_latest()
+
+def observe_request(method, route, status, seconds):
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+def observe_stage(pipeline, stage, seconds):
+    if seconds is not None:
+        STAGE_LATENCY.labels(pipeline, stage).observe(seconds)
+
+# only the outermost timed DB function is recorded, e.g. save_questions but not the
+# delete and insert it runs inside its transaction
+_in_db_call = contextvars.ContextVar('in_db_call', default=False)
+
+def _observe_db(name, start, failed):
+    DB_LATENCY.labels(name, 'failed' if failed else 'ok').observe(time.perf_counter() - start)
+
+def timed_db(func=None, *, none_ok=False):
+    '''decorator for pgvector_utils functions: record their duration in DB_LATENCY.
+    Those functions return False when they fail, which is recorded as result="failed", and so is
+    None or an exception. Functions where None means nothing was found are decorated with
+    timed_db(none_ok=True)'''
+    if func is None:
+        return functools.partial(timed_db, none_ok=none_ok)
+
+    def failed(result):
+        return result is False or (result is None and not none_ok)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if _in_db_call.get():
+                return await func(*args, **kwargs)
+            token, start, result = _in_db_call.set(True), time.perf_counter(), False
+            try:
+                result = await func(*args, **kwargs)
+                return result
+            finally:
+                _in_db_call.reset(token)
+                _observe_db(func.__name__, start, failed(result))
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _in_db_call.get():
+            return func(*args, **kwargs)
+        token, start, result = _in_db_call.set(True), time.perf_counter(), False
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            _in_db_call.reset(token)
+            _observe_db(func.__name__, start, failed(result))
+    return wrapper
+
+@contextmanager
+def embedding_call(model, operation, texts):
+    '''time one call to the embeddings provider with a batch of texts'''
+    EMBEDDING_CALLS.labels(model, operation).inc()
+    EMBEDDING_TEXTS.labels(model).inc(texts)
+    EMBEDDING_BATCH_SIZE.labels(model).observe(texts)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        EMBEDDING_LATENCY.labels(model, operation).observe(time.perf_counter() - start)
+
+def instrument_agent(agent):
+    '''record the duration and token usage of every completion the agent's LLM client makes'''
+    client = getattr(agent, 'client', None)
+    if client is None or getattr(client, 'metrics_instrumented', False):
+        return agent
+    create = client.create
+
+    def timed_create(**params):
+        start = time.perf_counter()
+        try:
+            response = create(**params)
+        finally:
+            LLM_TURN_DURATION.labels(agent.name).observe(time.perf_counter() - start)
+        if usage := getattr(response, 'usage', None):
+            model = getattr(response, 'model', None) or ''
+            LLM_TOKENS.labels(agent.name, model, 'prompt').inc(getattr(usage, 'prompt_tokens', 0) or 0)
+            LLM_TOKENS.labels(agent.name, model, 'completion').inc(getattr(usage, 'completion_tokens', 0) or 0)
+        return response
+
+    client.create = timed_create
+    client.metrics_instrumented = True
+    return agent
+
+if __name__ == '__main__':
+    pass
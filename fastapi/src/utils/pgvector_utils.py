@@ -1,261 +1,933 @@
-import psycopg2
+import json
+import time
+import threading
+from contextlib import contextmanager
+from array import array
+import psycopg
+from psycopg import sql
+from psycopg.adapt import Dumper, Loader
+from psycopg.pq import Format
+from psycopg.types import TypeInfo
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 
-# local imports 
+# local imports
 try:
     import src.utils.config as config
+    import src.utils.metrics_utils as metrics_utils
+    import src.utils.vector_utils as vector_utils
 except Exception as e:
     import utils.config as config
+    import utils.metrics_utils as metrics_utils
+    import utils.vector_utils as vector_utils
 
-# conn = psycopg2.connect(
-#     host=config.DB_HOSTNAME, 
-#     port=5432,
-#     database="vectordb",
-#     user="testuser",
-#     password="testpwd"
-# )
-
-def get_db_connection():
-    """Get database connection lazily"""
-    try:
-        return psycopg2.connect(
-            host="postgres",  # Use service name from docker-compose
-            port=5432,
-            database="vectordb",
-            user="testuser",
-            password="testpwd"
+_pool = None
+_pool_lock = threading.Lock()
+_async_pool = None
+
+def get_db_pool():
+    """Get the process wide connection pool, opening it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    config.DB_CONNINFO,
+                    min_size=config.DB_POOL_MIN_SIZE,
+                    max_size=config.DB_POOL_MAX_SIZE,
+                    timeout=config.DB_POOL_TIMEOUT,
+                    max_idle=config.DB_POOL_MAX_IDLE,
+                    check=ConnectionPool.check_connection, # health check on checkout
+                    name='silverhand',
+                    open=True,
+                )
+    return _pool
+
+def close_db_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+async def open_async_db_pool():
+    """Open the asyncio connection pool used by the async request path, call once from the app lifespan"""
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            config.DB_CONNINFO,
+            min_size=config.DB_POOL_MIN_SIZE,
+            max_size=config.DB_POOL_MAX_SIZE,
+            timeout=config.DB_POOL_TIMEOUT,
+            max_idle=config.DB_POOL_MAX_IDLE,
+            check=AsyncConnectionPool.check_connection,
+            name='silverhand-async',
+            open=False,
         )
-    except Exception as e:
-        print(f"ERROR connecting to database: {e}")
-        return None
+        await _async_pool.open()
+    return _async_pool
+
+async def close_async_db_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+def get_async_db_connection(timeout=None):
+    """Borrow a connection from the async pool, use as an async context manager"""
+    if _async_pool is None:
+        raise RuntimeError('async connection pool is not open')
+    return _async_pool.connection(timeout=timeout)
+
+def get_db_connection(timeout=None):
+    """Borrow a connection from the pool.
+
+    Use as a context manager: the transaction is committed when the block exits
+    cleanly, rolled back on error, and the connection is returned to the pool."""
+    return get_db_pool().connection(timeout=timeout)
+
+class VectorBinaryDumper(Dumper):
+    """Dump a sequence of floats in pgvector's binary format (dim, unused, float4 big endian values)"""
+    format = Format.BINARY
+
+    def dump(self, obj):
+        return vector_utils.to_pgvector_binary(obj)
+
+class VectorBinaryLoader(Loader):
+    """Load binary vector results as array('f'), without parsing their text form"""
+    format = Format.BINARY
+
+    def load(self, data):
+        return vector_utils.from_pgvector_binary(data)
+
+_vector_dumper = None
+
+def vector_dumper_for(info):
+    """VectorBinaryDumper bound to the vector type oid, built once per process"""
+    global _vector_dumper
+    if _vector_dumper is None:
+        _vector_dumper = type('VectorBinaryDumper', (VectorBinaryDumper,), {'oid': info.oid})
+    return _vector_dumper
+
+def get_vector_dumper(conn):
+    if _vector_dumper is None:
+        return vector_dumper_for(TypeInfo.fetch(conn, 'vector'))
+    return _vector_dumper
+
+async def get_vector_dumper_async(conn):
+    if _vector_dumper is None:
+        return vector_dumper_for(await TypeInfo.fetch(conn, 'vector'))
+    return _vector_dumper
+
+def register_vector_adapters(cur, dumper):
+    cur.adapters.register_dumper(array, dumper)
+    cur.adapters.register_loader(dumper.oid, VectorBinaryLoader)
+    return cur
+
+def vector_cursor(conn):
+    """Cursor that sends array('f') parameters as binary vectors, and loads vectors as array('f')
+    when executed with binary=True.
+
+    The adapters are registered on the cursor only so pooled connections keep the default ones."""
+    return register_vector_adapters(conn.cursor(), get_vector_dumper(conn))
+
+async def async_vector_cursor(conn):
+    """vector_cursor for async connections: `async with await async_vector_cursor(conn) as cur`"""
+    return register_vector_adapters(conn.cursor(), await get_vector_dumper_async(conn))
 
+def report_insert_rate(name, rows, seconds):
+    stats = {'rows': rows, 'seconds': round(seconds, 4), 'rows_per_second': round(rows / seconds, 1) if seconds else None}
+    print(f"INFO {name}: {stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/s)")
+    return stats
+
+@metrics_utils.timed_db
 def get_embeddings():
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            cur.execute("""
-            SELECT * 
-            FROM embeddings
-            """)
-
-            results = cur.fetchall()
-            for row in results:
-                print(f"Name: {row[0]}, Similarity: {row[1]}")
-            cur.close()
-        except Exception as e:
-            print(f'ERROR get_embeddings: {e}')
-            conn.rollback()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT *
+                FROM embeddings
+                """)
+                results = cur.fetchall()
+                for row in results:
+                    print(f"Name: {row[0]}, Similarity: {row[1]}")
+                return True
     except Exception as e:
         print(f'ERROR get_embeddings: {e}')
-        conn.rollback()
-
-def query_data(table_name):
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            cur.execute(f"""
-            SELECT * 
-            FROM {table_name}
-            """)
-            results = cur.fetchall()
-            cur.close()
-            return results 
-        except Exception as e:
-            print(f'ERROR query_data: {e}')
-            conn.rollback()
-            return False 
+        return False
+
+# columns of the tables served by the list endpoints, in table order
+TABLE_COLUMNS = {
+    'projects': ('id', 'name', 'description', 'created_at'),
+    'files': ('id', 'file_name', 'content_hash', 'created_at'),
+    'questions': ('id', 'question', 'answer', 'project_id', 'embedding', 'chat_history', 'created_at'),
+}
+# only returned when asked for by name, they are most of the payload
+HEAVY_COLUMNS = ('embedding', 'chat_history')
+
+# list queries run with binary results, embeddings come back as array('f')
+
+def validate_fields(table_name, fields=None):
+    """Requested fields of a list query, all but the heavy columns by default. Raises ValueError for
+    tables and columns that are not served"""
+    if table_name not in TABLE_COLUMNS:
+        raise ValueError(f'unknown table: {table_name}')
+    if not fields:
+        return [column for column in TABLE_COLUMNS[table_name] if column not in HEAVY_COLUMNS]
+    if unknown := set(fields) - set(TABLE_COLUMNS[table_name]):
+        raise ValueError(f'unknown fields for {table_name}: {sorted(unknown)}')
+    return list(fields)
+
+def select_columns(table_name, fields=None):
+    """SELECT list that keeps every column position; columns not in fields come back as NULL"""
+    fields = validate_fields(table_name, fields)
+    return sql.SQL(', ').join(
+        sql.Identifier(column) if column in fields else sql.SQL('NULL AS {}').format(sql.Identifier(column))
+        for column in TABLE_COLUMNS[table_name]
+    )
+
+def keyset_query(table_name, fields=None, after_id=None, limit=None, where=None, params=()):
+    """rows ordered by id starting after after_id, at most limit of them"""
+    query = sql.SQL("SELECT {} FROM {} WHERE id > %s").format(select_columns(table_name, fields), sql.Identifier(table_name))
+    params = [after_id or 0, *params]
+    if where:
+        query += sql.SQL(" AND ") + sql.SQL(where)
+    query += sql.SQL(" ORDER BY id")
+    if limit:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit)
+    return query, params
+
+def query_data_query(table_name, fields=None, after_id=None, limit=None):
+    return keyset_query(table_name, fields, after_id, limit)
+
+@metrics_utils.timed_db
+def query_data(table_name, fields=None, after_id=None, limit=None):
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.execute(*query_data_query(table_name, fields, after_id, limit), binary=True)
+                return cur.fetchall()
     except Exception as e:
         print(f'ERROR query_data: {e}')
-        conn.rollback()
-        return False 
-
-def query_questions(project_id):
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            cur.execute(f"""
-            SELECT * 
-            FROM questions
-            WHERE project_id = {project_id}
-            """)
-            results = cur.fetchall()
-            cur.close()
-            return results 
-        except Exception as e:
-            print(f'ERROR query_questions: {e}')
-            conn.rollback()
-            return False 
+        return False
+
+@metrics_utils.timed_db
+async def query_data_async(table_name, fields=None, after_id=None, limit=None):
+    try:
+        async with get_async_db_connection() as conn:
+            async with await async_vector_cursor(conn) as cur:
+                await cur.execute(*query_data_query(table_name, fields, after_id, limit), binary=True)
+                return await cur.fetchall()
+    except Exception as e:
+        print(f'ERROR query_data_async: {e}')
+        return False
+
+@metrics_utils.timed_db
+def get_table_versions(tables):
+    """{table: version} from table_versions, maintained by triggers on every write of those tables"""
+    try:
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)", (list(tables),)).fetchall()
+            return dict(rows)
+    except Exception as e:
+        print(f'ERROR get_table_versions: {e}')
+        return False
+
+@metrics_utils.timed_db
+async def get_table_versions_async(tables):
+    try:
+        async with get_async_db_connection() as conn:
+            cur = await conn.execute("SELECT table_name, version FROM table_versions WHERE table_name = ANY(%s)", (list(tables),))
+            return dict(await cur.fetchall())
+    except Exception as e:
+        print(f'ERROR get_table_versions_async: {e}')
+        return False
+
+def query_questions_query(project_id, fields=None, after_id=None, limit=None):
+    return keyset_query('questions', fields, after_id, limit, "project_id = %s", (project_id,))
+
+@metrics_utils.timed_db
+def query_questions(project_id, fields=None, after_id=None, limit=None):
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.execute(*query_questions_query(project_id, fields, after_id, limit), binary=True)
+                return cur.fetchall()
     except Exception as e:
         print(f'ERROR query_questions: {e}')
-        conn.rollback()
-        return False 
-
-def insert_file(filename):
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            cur.execute("INSERT INTO files (file_name) VALUES (%s)", (filename,)) 
-            conn.commit()
-            cur.close()
-            return True 
-        except Exception as e:
-            print(f'ERROR insert_file: {e}')
-            conn.rollback()
-            return False 
+        return False
+
+@metrics_utils.timed_db
+async def query_questions_async(project_id, fields=None, after_id=None, limit=None):
+    try:
+        async with get_async_db_connection() as conn:
+            async with await async_vector_cursor(conn) as cur:
+                await cur.execute(*query_questions_query(project_id, fields, after_id, limit), binary=True)
+                return await cur.fetchall()
+    except Exception as e:
+        print(f'ERROR query_questions_async: {e}')
+        return False
+
+def query_question_fields_query(question_id, fields):
+    fields = validate_fields('questions', fields)
+    return sql.SQL("SELECT {} FROM questions WHERE id = %s").format(
+        sql.SQL(', ').join(sql.Identifier(field) for field in fields)), (question_id,)
+
+@metrics_utils.timed_db(none_ok=True)
+async def query_question_fields_async(question_id, fields):
+    """{field: value} of one question, None if it does not exist"""
+    try:
+        async with get_async_db_connection() as conn:
+            async with await async_vector_cursor(conn) as cur:
+                await cur.execute(*query_question_fields_query(question_id, fields), binary=True)
+                if row := await cur.fetchone():
+                    return dict(zip(validate_fields('questions', fields), row))
+                return None
+    except Exception as e:
+        print(f'ERROR query_question_fields_async: {e}')
+        return False
+
+@metrics_utils.timed_db(none_ok=True)
+def query_question_fields(question_id, fields):
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.execute(*query_question_fields_query(question_id, fields), binary=True)
+                if row := cur.fetchone():
+                    return dict(zip(validate_fields('questions', fields), row))
+                return None
+    except Exception as e:
+        print(f'ERROR query_question_fields: {e}')
+        return False
+
+@metrics_utils.timed_db
+def insert_file(filename, content_hash=None, conn=None):
+    """Register a file once, files.file_name is unique"""
+    try:
+        if conn is None:
+            with get_db_connection() as conn:
+                return insert_file(filename, content_hash, conn)
+        conn.execute(
+            """INSERT INTO files (file_name, content_hash) VALUES (%s, %s)
+            ON CONFLICT (file_name) DO UPDATE SET content_hash = COALESCE(EXCLUDED.content_hash, files.content_hash)""",
+            (filename, content_hash),
+        )
+        return True
     except Exception as e:
         print(f'ERROR insert_file: {e}')
-        conn.rollback()        
+        return False
+
+class FileIngestInProgress(Exception):
+    """Another job or worker is ingesting a file of the same name"""
+
+@contextmanager
+def file_ingest_lock(filename):
+    """One ingest per file name across jobs and workers. Without it two ingests of the same file could
+    both pass the content hash check and store its chunks twice.
+
+    The session advisory lock is held for the whole ingest on a connection of its own, so it does not
+    keep a pooled connection from the request handlers, and a second ingest raises FileIngestInProgress
+    at once instead of waiting"""
+    with psycopg.connect(config.DB_CONNINFO, autocommit=True) as conn:
+        if not conn.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (filename,)).fetchone()[0]:
+            raise FileIngestInProgress(f'{filename} is already being ingested')
+        # closing the connection releases the lock
+        yield
+
+@metrics_utils.timed_db(none_ok=True)
+def get_file_content_hash(filename):
+    """content_hash of the file, None if it was never ingested"""
+    try:
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT content_hash FROM files WHERE file_name = %s ORDER BY id LIMIT 1", (filename,)).fetchone()
+            return row[0] if row else None
+    except Exception as e:
+        print(f'ERROR get_file_content_hash: {e}')
+        return False
+
+@metrics_utils.timed_db
+def get_chunk_hashes(filename):
+    """chunk_hash of every stored chunk of the file, False on error: an empty set would make the
+    ingest store every chunk again"""
+    try:
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT DISTINCT chunk_hash FROM file_chunks WHERE file_name = %s", (filename,)).fetchall()
+            return {row[0] for row in rows}
+    except Exception as e:
+        print(f'ERROR get_chunk_hashes: {e}')
+        return False
 
+@metrics_utils.timed_db
+def finish_file_ingest(filename, content_hash, chunk_hashes):
+    """After a (re-)ingest: drop the chunks no longer in the file and record its new content hash,
+    in one transaction"""
+    try:
+        with get_db_connection() as conn:
+            with conn.transaction():
+                cur = conn.execute(
+                    "DELETE FROM file_chunks WHERE file_name = %s AND chunk_hash <> ALL(%s)",
+                    (filename, list(chunk_hashes)),
+                )
+                if not insert_file(filename, content_hash, conn):
+                    raise RuntimeError('could not register file')
+                return {'stale_chunks_deleted': cur.rowcount}
+    except Exception as e:
+        print(f'ERROR finish_file_ingest: {e}')
+        return False
+
+@metrics_utils.timed_db
 def insert_project(project_name, project_description):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            cur.execute("INSERT INTO projects (name, description) VALUES (%s,%s)", (project_name,project_description,)) 
-            conn.commit()
-            cur.close()
-            return True 
-        except Exception as e:
-            print(f'ERROR insert_project: {e}')
-            conn.rollback()
-            return False 
+        with get_db_connection() as conn:
+            conn.execute("INSERT INTO projects (name, description) VALUES (%s,%s)", (project_name,project_description,))
+        return True
     except Exception as e:
         print(f'ERROR insert_project: {e}')
-        conn.rollback()        
-
-def delete_questions_from_db(project_id):
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:        
-            cur = conn.cursor()
-            cur.execute(f"DELETE FROM questions WHERE project_id = {project_id}") 
-            conn.commit()
-            cur.close()
-            return True 
-        except Exception as e:
-            print(f'ERROR delete_questions_from_db: {e}')
-            conn.rollback()
-            return False 
+        return False
+
+@metrics_utils.timed_db
+def delete_questions_from_db(project_id, conn=None):
+    try:
+        if conn is None:
+            with get_db_connection() as conn:
+                return delete_questions_from_db(project_id, conn)
+        conn.execute("DELETE FROM questions WHERE project_id = %s", (project_id,))
+        return True
     except Exception as e:
         print(f'ERROR delete_questions_from_db: {e}')
-        conn.rollback()     
-        return False 
-
-def insert_questions_into_db(questions):
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            for question in questions.questions:
-                cur.execute(f"INSERT INTO questions (question, answer, project_id, embedding, chat_history) VALUES ('{escape_single_quote_helper(question.question)}', '{escape_single_quote_helper(question.answer)}', {question.project_id}, '{question.embedding}', '{escape_single_quote_helper(question.chat_history)}');") 
-            conn.commit()
-            cur.close()
-            return True 
-        except Exception as e:
-            print(f'ERROR insert_questions_into_db: {e}')
-            conn.rollback()
-            return False 
+        return False
+
+@metrics_utils.timed_db
+def insert_questions_into_db(questions, conn=None, stored=None):
+    """stored: {id: (embedding, chat_history)} of the project's questions before they were deleted.
+    Questions sent back with one of those ids keep it, and their stored embedding and chat history
+    when they come without them (the list endpoints do not return them by default)"""
+    try:
+        if conn is None:
+            with get_db_connection() as conn:
+                return insert_questions_into_db(questions, conn, stored)
+        stored = stored or {}
+        kept, new = [], []
+        for question in questions.questions:
+            question_id = getattr(question, 'id', None)
+            embedding, chat_history = stored.get(question_id, (None, None))
+            row = (
+                question.question, question.answer, question.project_id,
+                # '[...]' text or base64, decoded once and sent as a binary vector
+                vector_utils.parse_vector(question.embedding) if question.embedding is not None else embedding,
+                question.chat_history if question.chat_history is not None else chat_history,
+            )
+            if question_id in stored:
+                kept.append((question_id, *row))
+            else:
+                new.append(row)
+        with vector_cursor(conn) as cur:
+            if kept:
+                cur.executemany(
+                    "INSERT INTO questions (id, question, answer, project_id, embedding, chat_history) VALUES (%s, %s, %s, %s, %s, %s)",
+                    kept,
+                )
+            if new:
+                cur.executemany(
+                    "INSERT INTO questions (question, answer, project_id, embedding, chat_history) VALUES (%s, %s, %s, %s, %s)",
+                    new,
+                )
+        return True
     except Exception as e:
         print(f'ERROR insert_questions_into_db: {e}')
-        conn.rollback()    
-        return False  
+        return False
+
+def stored_question_values(project_id, conn):
+    """{id: (embedding, chat_history)} of the project's questions"""
+    with vector_cursor(conn) as cur:
+        rows = cur.execute("SELECT id, embedding, chat_history FROM questions WHERE project_id = %s", (project_id,), binary=True).fetchall()
+    return {question_id: (embedding, chat_history) for question_id, embedding, chat_history in rows}
 
-def escape_single_quote_helper(text):
-    return text.replace("'","''")
+@metrics_utils.timed_db
+def update_question_answer(question_id, answer, chat_history):
+    try:
+        with get_db_connection() as conn:
+            conn.execute("UPDATE questions SET answer = %s, chat_history = %s WHERE id = %s", (answer, chat_history, question_id))
+        return True
+    except Exception as e:
+        print(f'ERROR update_question_answer: {e}')
+        return False
 
+@metrics_utils.timed_db
 def insert_file_chunks_into_db(chunks):
+    """Insert chunks one parameterised INSERT at a time, returns insert rate stats"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
-            for file_name, chunk_text, embedding in chunks:
-                cur.execute(f"INSERT INTO file_chunks (file_name, chunk_text, embedding) VALUES ('{escape_single_quote_helper(file_name)}', '{escape_single_quote_helper(chunk_text)}', '{embedding}');") 
-            conn.commit()
-            cur.close()
-            return True 
-        except Exception as e:
-            print(f'ERROR insert_file_chunks_into_db: {e}')
-            conn.rollback()    
-            return False 
+        start, rows = time.perf_counter(), 0
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for file_name, chunk_text, embedding in chunks:
+                    cur.execute(
+                        "INSERT INTO file_chunks (file_name, chunk_text, embedding) VALUES (%s, %s, %s::vector)",
+                        (file_name, chunk_text, str(embedding)),
+                    )
+                    rows += 1
+        return report_insert_rate('insert_file_chunks_into_db', rows, time.perf_counter() - start)
     except Exception as e:
         print(f'ERROR insert_file_chunks_into_db: {e}')
-        conn.rollback()    
-    return False  
+    return False
 
+@metrics_utils.timed_db
+def insert_file_chunks_into_db_bulk(chunks):
+    """Stream chunks to Postgres with a single binary COPY in one transaction, returns insert rate stats
+
+    chunks can be any iterable of (file_name, chunk_text, embedding) so rows are sent as they are produced."""
+    try:
+        start, rows = time.perf_counter(), 0
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                with cur.copy("COPY file_chunks (file_name, chunk_text, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+                    copy.set_types(['text', 'text', get_vector_dumper(conn).oid])
+                    for file_name, chunk_text, embedding in chunks:
+                        copy.write_row((file_name, chunk_text, embedding))
+                        rows += 1
+        return report_insert_rate('insert_file_chunks_into_db_bulk', rows, time.perf_counter() - start)
+    except Exception as e:
+        print(f'ERROR insert_file_chunks_into_db_bulk: {e}')
+    return False
+
+@metrics_utils.timed_db
 def save_questions(project_id, questions):
-    if delete_questions_from_db(project_id):
-        return insert_questions_into_db(questions) 
-
-def rag_context(question, files):
-    try:
-        file_names = ','.join([f"'{x}'" for x in files])
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:        
-            cur = conn.cursor()
-            cur.execute(f"""
-            SELECT * 
+    # delete and reinsert in a single transaction so a failed insert keeps the old questions
+    try:
+        with get_db_connection() as conn:
+            with conn.transaction():
+                stored = stored_question_values(project_id, conn)
+                if not delete_questions_from_db(project_id, conn):
+                    raise RuntimeError('could not delete questions')
+                if not insert_questions_into_db(questions, conn, stored):
+                    raise RuntimeError('could not insert questions')
+        return True
+    except Exception as e:
+        print(f'ERROR save_questions: {e}')
+        return False
+
+QUESTION_UPDATE = """
+UPDATE questions
+SET question = %(question)s, answer = %(answer)s,
+    embedding = COALESCE(%(embedding)s, embedding), chat_history = COALESCE(%(chat_history)s, chat_history)
+WHERE id = %(id)s AND project_id = %(project_id)s
+"""
+# rows that would not change are skipped, so they are neither rewritten nor re-indexed
+QUESTION_UPDATE_IF_CHANGED = QUESTION_UPDATE + """
+AND (question, answer, embedding, chat_history) IS DISTINCT FROM
+    (%(question)s, %(answer)s, COALESCE(%(embedding)s, embedding), COALESCE(%(chat_history)s, chat_history))
+"""
+
+def question_params(question, question_id=None):
+    return {
+        'id': question_id if question_id is not None else getattr(question, 'id', None),
+        'question': question.question,
+        'answer': question.answer,
+        'project_id': question.project_id,
+        'embedding': vector_utils.parse_vector(question.embedding),
+        'chat_history': question.chat_history,
+    }
+
+def insert_question_returning_id(cur, params):
+    cur.execute(
+        "INSERT INTO questions (question, answer, project_id, embedding, chat_history) VALUES (%(question)s, %(answer)s, %(project_id)s, %(embedding)s, %(chat_history)s) RETURNING id",
+        params,
+    )
+    return cur.fetchone()[0]
+
+@metrics_utils.timed_db
+def insert_question(question):
+    """Insert one question, returns its id"""
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                return insert_question_returning_id(cur, question_params(question))
+    except Exception as e:
+        print(f'ERROR insert_question: {e}')
+        return False
+
+@metrics_utils.timed_db(none_ok=True)
+def update_question(question_id, question):
+    """Update one question of its project, a missing embedding or chat history keeps the stored one.
+    Returns None if there is no such question"""
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.execute(QUESTION_UPDATE, question_params(question, question_id))
+                return True if cur.rowcount else None
+    except Exception as e:
+        print(f'ERROR update_question: {e}')
+        return False
+
+@metrics_utils.timed_db(none_ok=True)
+def delete_question(question_id):
+    """Returns None if there is no such question"""
+    try:
+        with get_db_connection() as conn:
+            return True if conn.execute("DELETE FROM questions WHERE id = %s", (question_id,)).rowcount else None
+    except Exception as e:
+        print(f'ERROR delete_question: {e}')
+        return False
+
+@metrics_utils.timed_db
+def upsert_questions(project_id, questions, deleted_ids=()):
+    """Write a project's edited question list in one transaction: questions with an id are updated
+    only when something changed, the others inserted, deleted_ids removed. Unlike save_questions the
+    cost grows with the edit, not with the number of questions.
+    Returns the ids of the inserted questions (in order) and the number of rows written"""
+    try:
+        updates, inserts = [], []
+        for question in questions:
+            params = question_params(question)
+            params['project_id'] = int(project_id)
+            (updates if params['id'] is not None else inserts).append(params)
+        with get_db_connection() as conn:
+            with conn.transaction():
+                with vector_cursor(conn) as cur:
+                    deleted = 0
+                    if deleted_ids:
+                        cur.execute("DELETE FROM questions WHERE id = ANY(%s) AND project_id = %s", (list(deleted_ids), int(project_id)))
+                        deleted = cur.rowcount
+                    updated = 0
+                    if updates:
+                        cur.executemany(QUESTION_UPDATE_IF_CHANGED, updates)
+                        updated = cur.rowcount
+                    inserted_ids = [insert_question_returning_id(cur, params) for params in inserts]
+        return {
+            'inserted_ids': inserted_ids,
+            'updated': updated,
+            'unchanged': len(updates) - updated,
+            'deleted': deleted,
+        }
+    except Exception as e:
+        print(f'ERROR upsert_questions: {e}')
+        return False
+
+def search_params_queries(ef_search=None, probes=None):
+    """Statements that set ANN index search parameters for the current transaction only"""
+    ef_search = ef_search or config.HNSW_EF_SEARCH
+    probes = probes or config.IVFFLAT_PROBES
+    queries = []
+    if ef_search:
+        queries.append(("SELECT set_config('hnsw.ef_search', %s, true)", (str(int(ef_search)),)))
+    if probes:
+        queries.append(("SELECT set_config('ivfflat.probes', %s, true)", (str(int(probes)),)))
+    return queries
+
+def set_search_params(cur, ef_search=None, probes=None):
+    for query, params in search_params_queries(ef_search, probes):
+        cur.execute(query, params)
+
+async def set_search_params_async(cur, ef_search=None, probes=None):
+    for query, params in search_params_queries(ef_search, probes):
+        await cur.execute(query, params)
+
+def rag_context_query(question, files, retrieval_mode='vector', question_text=None, k=1):
+    """question: query embedding as a float list, '[...]' text or base64.
+
+    In 'hybrid' mode the nearest chunks and the best full text matches of question_text are
+    ranked separately and fused with reciprocal rank fusion, sum(1 / (RRF_K + rank)), in the same
+    statement. Rows are (id, file_name, chunk_text, vector_hits), vector_hits is the number of chunks
+    the vector search found"""
+    embedding = vector_utils.parse_vector(question)
+    if retrieval_mode != 'hybrid' or not question_text:
+        return """
+        SELECT id, file_name, chunk_text, count(*) OVER () AS vector_hits
+        FROM (
+            SELECT id, file_name, chunk_text
+            FROM file_chunks
+            WHERE file_name = ANY(%s)
+            ORDER BY embedding <-> %s
+            LIMIT %s
+        ) v;
+        """, (list(files), embedding, k)
+    return """
+    WITH vector_hits AS (
+        SELECT id, row_number() OVER (ORDER BY distance) AS rank
+        FROM (
+            SELECT id, embedding <-> %(embedding)s AS distance
             FROM file_chunks
-            WHERE file_name in ({file_names})
-            ORDER BY embedding <-> '{question}'
-            LIMIT 1;
-            """)
-            rag_context = None 
-            if results := cur.fetchall():
-                rag_context = results[0][2]
-            cur.close()
-            if rag_context:
-                return rag_context
-        except Exception as e:
-            print(f'ERROR rag_context: {e}')
-            conn.rollback()
-            return False 
+            WHERE file_name = ANY(%(files)s)
+            ORDER BY embedding <-> %(embedding)s
+            LIMIT %(candidates)s
+        ) v
+    ),
+    text_hits AS (
+        SELECT id, row_number() OVER (ORDER BY text_rank DESC) AS rank
+        FROM (
+            SELECT id, ts_rank_cd(chunk_tsv, query) AS text_rank
+            FROM file_chunks, websearch_to_tsquery(%(text_search_config)s::regconfig, %(question_text)s) AS query
+            WHERE file_name = ANY(%(files)s) AND chunk_tsv @@ query
+            ORDER BY text_rank DESC
+            LIMIT %(candidates)s
+        ) t
+    ),
+    fused AS (
+        SELECT id, sum(1.0 / (%(rrf_k)s + rank)) AS score
+        FROM (SELECT * FROM vector_hits UNION ALL SELECT * FROM text_hits) hits
+        GROUP BY id
+    )
+    SELECT c.id, c.file_name, c.chunk_text, (SELECT count(*) FROM vector_hits) AS vector_hits
+    FROM fused
+    JOIN file_chunks c USING (id)
+    ORDER BY fused.score DESC, c.id
+    LIMIT %(k)s;
+    """, {
+        'embedding': embedding,
+        'files': list(files),
+        'question_text': question_text,
+        'text_search_config': config.TEXT_SEARCH_CONFIG,
+        'candidates': max(config.HYBRID_CANDIDATES, k),
+        'rrf_k': config.RRF_K,
+        'k': k,
+    }
+
+# the HNSW scan is filtered by file name after it picked its ef_search candidates, so it can miss
+# every chunk of the selected files when they are a small part of the table. Queries whose vector
+# search comes back short are repeated without the index in the same transaction, as an exact scan
+EXACT_SCAN = "SET LOCAL enable_indexscan = off"
+
+def vector_search_short(rows, k=1):
+    """True if the vector side of rag_context_query rows found fewer than k chunks, in hybrid mode
+    text matches can fill the result while the filtered index scan found nothing"""
+    return not rows or rows[0][3] < k
+
+@metrics_utils.timed_db
+def rag_context(question, files, ef_search=None, probes=None, retrieval_mode=config.RETRIEVAL_MODE, question_text=None):
+    """chunk_text of the best chunk, '' if the files have no chunks"""
+    try:
+        query, params = rag_context_query(question, files, retrieval_mode, question_text)
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                set_search_params(cur, ef_search, probes)
+                cur.execute(query, params)
+                if vector_search_short(results := cur.fetchall()):
+                    cur.execute(EXACT_SCAN)
+                    cur.execute(query, params)
+                    results = cur.fetchall()
+                return results[0][2] if results else ''
     except Exception as e:
         print(f'ERROR rag_context: {e}')
-        conn.rollback()
+        return False
+
+@metrics_utils.timed_db
+async def rag_context_async(question, files, ef_search=None, probes=None, retrieval_mode=config.RETRIEVAL_MODE, question_text=None):
+    try:
+        query, params = rag_context_query(question, files, retrieval_mode, question_text)
+        async with get_async_db_connection() as conn:
+            async with await async_vector_cursor(conn) as cur:
+                await set_search_params_async(cur, ef_search, probes)
+                await cur.execute(query, params)
+                if vector_search_short(results := await cur.fetchall()):
+                    await cur.execute(EXACT_SCAN)
+                    await cur.execute(query, params)
+                    results = await cur.fetchall()
+                return results[0][2] if results else ''
+    except Exception as e:
+        print(f'ERROR rag_context_async: {e}')
+        return False
+
+def rag_context_batch_query(embeddings, question_ids, files, k):
+    """Top-k chunks for many query vectors in one statement.
+
+    Query vectors come from the embeddings given (float lists, '[...]' text or base64, sent as
+    binary vectors) followed by the stored embeddings of question_ids; each one drives an index
+    scan through a LATERAL join. Every query vector has at least one row, with NULL chunk columns
+    if none was found, and the last column counts the chunks of the files up to k."""
+    if embeddings:
+        given = "SELECT t.ord, NULL::int AS question_id, t.embedding FROM (VALUES {}) AS t(ord, embedding)".format(
+            ', '.join(f'({position}::bigint, %(embedding_{position})s)' for position in range(1, len(embeddings) + 1)))
+    else:
+        given = "SELECT NULL::bigint, NULL::int, NULL::vector WHERE false"
+    query = """
+    WITH q AS (
+        """ + given + """
+        UNION ALL
+        SELECT %(offset)s + t.ord, questions.id, questions.embedding
+        FROM unnest(%(question_ids)s::int[]) WITH ORDINALITY AS t(id, ord)
+        JOIN questions ON questions.id = t.id
+        WHERE questions.embedding IS NOT NULL
+    ),
+    available AS (
+        SELECT count(*) AS chunks
+        FROM (SELECT 1 FROM file_chunks WHERE file_name = ANY(%(files)s) LIMIT %(k)s) a
+    )
+    SELECT q.ord, q.question_id, c.id, c.file_name, c.chunk_text, c.distance, c.similarity, available.chunks
+    FROM q
+    CROSS JOIN available
+    LEFT JOIN LATERAL (
+        SELECT id, file_name, chunk_text,
+            embedding <-> q.embedding AS distance,
+            1 - (embedding <=> q.embedding) AS similarity
+        FROM file_chunks
+        WHERE file_name = ANY(%(files)s)
+        ORDER BY embedding <-> q.embedding
+        LIMIT %(k)s
+    ) c ON true
+    ORDER BY q.ord, c.distance;
+    """
+    params = {
+        **{f'embedding_{position}': vector_utils.parse_vector(embedding) for position, embedding in enumerate(embeddings, start=1)},
+        'question_ids': list(question_ids),
+        'offset': len(embeddings),
+        'files': list(files),
+        'k': k,
+    }
+    return query, params
+
+def group_rag_context_batch_rows(rows, embeddings, question_ids):
+    """One result per requested embedding/question id, in request order"""
+    results = [{'question_id': None, 'chunks': []} for _ in embeddings]
+    results += [{'question_id': question_id, 'chunks': []} for question_id in question_ids]
+    for position, question_id, chunk_id, file_name, chunk_text, distance, similarity, _ in rows:
+        result = results[position - 1]
+        result['question_id'] = question_id
+        if chunk_id is None:
+            continue
+        result['chunks'].append({
+            'id': chunk_id,
+            'file_name': file_name,
+            'chunk_text': chunk_text,
+            'distance': distance,
+            'similarity': similarity,
+        })
+    return results
+
+def short_rag_context_batch_entries(rows, results, k):
+    """Positions of the results with fewer chunks than the files hold, up to k, which an exact scan
+    may fill. Entries without a query vector (unknown question id, no stored embedding) have no rows
+    and are left out"""
+    if not rows:
+        return []
+    available = min(rows[0][7], k)
+    return [position for position in sorted({row[0] - 1 for row in rows}) if len(results[position]['chunks']) < available]
+
+def select_rag_context_batch_entries(positions, embeddings, question_ids):
+    """(embeddings, question_ids) of the batch entries at positions, in the same order"""
+    return (
+        [embeddings[position] for position in positions if position < len(embeddings)],
+        [question_ids[position - len(embeddings)] for position in positions if position >= len(embeddings)],
+    )
+
+@metrics_utils.timed_db
+def rag_context_batch(files, embeddings=(), question_ids=(), k=config.RAG_TOP_K, ef_search=None, probes=None):
+    try:
+        query, params = rag_context_batch_query(embeddings, question_ids, files, k)
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                set_search_params(cur, ef_search, probes)
+                cur.execute(query, params)
+                rows = cur.fetchall()
+                results = group_rag_context_batch_rows(rows, embeddings, question_ids)
+                # only the entries the index scan left short are searched again
+                if short := short_rag_context_batch_entries(rows, results, k):
+                    short_embeddings, short_question_ids = select_rag_context_batch_entries(short, embeddings, question_ids)
+                    cur.execute(EXACT_SCAN)
+                    cur.execute(*rag_context_batch_query(short_embeddings, short_question_ids, files, k))
+                    for position, result in zip(short, group_rag_context_batch_rows(cur.fetchall(), short_embeddings, short_question_ids)):
+                        results[position] = result
+                return results
+    except Exception as e:
+        print(f'ERROR rag_context_batch: {e}')
+        return False
+
+@metrics_utils.timed_db
+async def rag_context_batch_async(files, embeddings=(), question_ids=(), k=config.RAG_TOP_K, ef_search=None, probes=None):
+    try:
+        query, params = rag_context_batch_query(embeddings, question_ids, files, k)
+        async with get_async_db_connection() as conn:
+            async with await async_vector_cursor(conn) as cur:
+                await set_search_params_async(cur, ef_search, probes)
+                await cur.execute(query, params)
+                rows = await cur.fetchall()
+                results = group_rag_context_batch_rows(rows, embeddings, question_ids)
+                # only the entries the index scan left short are searched again
+                if short := short_rag_context_batch_entries(rows, results, k):
+                    short_embeddings, short_question_ids = select_rag_context_batch_entries(short, embeddings, question_ids)
+                    await cur.execute(EXACT_SCAN)
+                    await cur.execute(*rag_context_batch_query(short_embeddings, short_question_ids, files, k))
+                    for position, result in zip(short, group_rag_context_batch_rows(await cur.fetchall(), short_embeddings, short_question_ids)):
+                        results[position] = result
+                return results
+    except Exception as e:
+        print(f'ERROR rag_context_batch_async: {e}')
+        return False
+
+@metrics_utils.timed_db
+def get_cached_embeddings(keys):
+    """Return {key: embedding} for the keys found in embedding_cache"""
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT key, embedding::text FROM embedding_cache WHERE key = ANY(%s)", (list(keys),))
+                return {key: json.loads(embedding) for key, embedding in cur.fetchall()}
+    except Exception as e:
+        print(f'ERROR get_cached_embeddings: {e}')
+        return {}
+
+@metrics_utils.timed_db
+def insert_cached_embeddings(rows):
+    """Insert (key, model, embedding) rows into embedding_cache, existing keys are left as they are"""
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.executemany(
+                    "INSERT INTO embedding_cache (key, model, embedding) VALUES (%s, %s, %s) ON CONFLICT (key) DO NOTHING",
+                    [(key, model, array('f', embedding)) for key, model, embedding in rows],
+                )
+        return True
+    except Exception as e:
+        print(f'ERROR insert_cached_embeddings: {e}')
+        return False
+
+@metrics_utils.timed_db(none_ok=True)
+def lookup_answer_cache(question_embedding, context_hash, review_mode, ttl_seconds):
+    """Closest cached answer for the same context and review mode within the TTL, as (summary, chat_history, similarity),
+    None if there is none"""
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.execute("""
+                SELECT summary, chat_history, 1 - (question_embedding <=> %(embedding)s) AS similarity
+                FROM answer_cache
+                WHERE context_hash = %(context_hash)s
+                AND review_mode = %(review_mode)s
+                AND created_at > now() - make_interval(secs => %(ttl)s)
+                ORDER BY question_embedding <=> %(embedding)s
+                LIMIT 1;
+                """, {'embedding': array('f', question_embedding), 'context_hash': context_hash, 'review_mode': review_mode, 'ttl': ttl_seconds})
+                return cur.fetchone()
+    except Exception as e:
+        print(f'ERROR lookup_answer_cache: {e}')
+        return False
+
+@metrics_utils.timed_db
+def insert_answer_cache(question, question_embedding, context_hash, review_mode, summary, chat_history):
+    try:
+        with get_db_connection() as conn:
+            with vector_cursor(conn) as cur:
+                cur.execute(
+                    "INSERT INTO answer_cache (question, question_embedding, context_hash, review_mode, summary, chat_history) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (question, array('f', question_embedding), context_hash, review_mode, summary, chat_history),
+                )
+        return True
+    except Exception as e:
+        print(f'ERROR insert_answer_cache: {e}')
+        return False
 
+@metrics_utils.timed_db
 def delete_project(project_id):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-        try:
-            cur = conn.cursor()
+        with get_db_connection() as conn:
             # First delete associated questions
-            cur.execute(f"DELETE FROM questions WHERE project_id = {project_id}")
+            conn.execute("DELETE FROM questions WHERE project_id = %s", (project_id,))
             # Then delete the project
-            cur.execute(f"DELETE FROM projects WHERE id = {project_id}")
-            conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            print(f'ERROR delete_project: {e}')
-            conn.rollback()
-            return False
+            conn.execute("DELETE FROM projects WHERE id = %s", (project_id,))
+        return True
     except Exception as e:
         print(f'ERROR delete_project: {e}')
-        conn.rollback()
         return False
 
 if __name__ == "__main__":
-    pass 
\ No newline at end of file
+    pass
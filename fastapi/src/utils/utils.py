@@ -1,20 +1,23 @@
 import os 
-import PyPDF2
 from math import ceil
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_openai import OpenAIEmbeddings
 
 
 
 try:
     import src.utils.langchain_utils as langchain_utils
     import src.utils.pgvector_utils as pgvector_utils
+    import src.utils.ingest_utils as ingest_utils
+    import src.utils.chunking_utils as chunking_utils
+    import src.utils.job_utils as job_utils
     import src.utils.config as config
 except Exception as e:
     print(f'ERROR importing: {e}')
     # for running in a virtual env  
     import utils.langchain_utils as langchain_utils
     import utils.pgvector_utils as pgvector_utils
+    import utils.ingest_utils as ingest_utils
+    import utils.chunking_utils as chunking_utils
+    import utils.job_utils as job_utils
     import utils.config as config
 
 
@@ -25,32 +28,79 @@ def save_file_locally(file_name, file_bytes):
     if os.path.isfile(file_path):
         return file_path
     
-def save_file_chunks(file_name, file_bytes, open_api_key, chunk_size=config.CHUNK_SIZE, model=config.OPENAI_EMBEDDING_MODEL):
+def save_file_chunks(file_name, file_bytes, open_api_key, chunk_size=config.CHUNK_SIZE, model=config.EMBEDDING_MODEL):
     #ref the raft codebase 
     try:
         file_name = file_name.lower()
-        if file_name[-4:] == '.pdf':
-            text = ""
-            reader = PyPDF2.PdfReader(file_bytes)
-            num_pages = len(reader.pages)
-            for page_num in range(num_pages):
-                page = reader.pages[page_num]
-                text += page.extract_text()
-        elif file_name[-7:] == '.manual' or file_name[-4:] == '.txt':
-            text = str(file_bytes.read().decode())
-        else: 
-            raise TypeError("Document is not one of the accepted types: pdf, txt")
-
-        num_chunks = ceil(len(text) / chunk_size)
-        embeddings =  OpenAIEmbeddings(openai_api_key=open_api_key, model=model)
-        text_splitter = SemanticChunker(embeddings, number_of_chunks=num_chunks)
-        chunks = text_splitter.create_documents([text])
-        chunks = [chunk.page_content for chunk in chunks]
-        embeddings_list = langchain_utils.get_open_ai_embeddings_docs(chunks)
-        if pgvector_utils.insert_file_chunks_into_db([(file_name, chunk_text, embedding) for (embedding, chunk_text) in zip(embeddings_list, chunks)]):
-            return file_name 
+        if config.INGEST_MODE == 'pipeline':
+            if ingest_utils.ingest_file(file_name, file_bytes, open_api_key, chunk_size, model):
+                return file_name
+            return
+        # see pgvector_utils.file_ingest_lock
+        with pgvector_utils.file_ingest_lock(file_name):
+            content_hash = ingest_utils.file_content_hash(file_bytes)
+            stored_hash = pgvector_utils.get_file_content_hash(file_name)
+            if stored_hash == content_hash:
+                return file_name # unchanged
+            if stored_hash is False or (known_chunks := pgvector_utils.get_chunk_hashes(file_name)) is False:
+                raise RuntimeError('could not read the stored chunks of the file')
+            if file_name[-4:] == '.pdf':
+                import PyPDF2
+                text = ""
+                reader = PyPDF2.PdfReader(file_bytes)
+                num_pages = len(reader.pages)
+                for page_num in range(num_pages):
+                    page = reader.pages[page_num]
+                    text += page.extract_text()
+            elif file_name[-7:] == '.manual' or file_name[-4:] == '.txt':
+                text = str(file_bytes.read().decode())
+            else: 
+                raise TypeError("Document is not one of the accepted types: pdf, txt")
+
+            num_chunks = ceil(len(text) / chunk_size)
+            embeddings = langchain_utils.cached_embeddings(model, open_api_key)
+            chunks = chunking_utils.chunk_text(text, embeddings, num_chunks)
+            chunk_hashes = [chunking_utils.chunk_hash(chunk_text) for chunk_text, _ in chunks]
+            # chunks already stored for this file are neither embedded nor inserted again
+            chunks = [chunk for chunk, chunk_hash in zip(chunks, chunk_hashes) if chunk_hash not in known_chunks]
+            # the single pass chunker already returns chunk embeddings, only embed the ones it did not
+            missing = [chunk_text for chunk_text, embedding in chunks if embedding is None]
+            new_embeddings = iter(embeddings.embed_documents(missing) if missing else [])
+            embeddings_list = [embedding if embedding is not None else next(new_embeddings) for _, embedding in chunks]
+            chunks = [chunk_text for chunk_text, _ in chunks]
+            insert_chunks = pgvector_utils.insert_file_chunks_into_db_bulk if config.CHUNK_INSERT_MODE == 'copy' else pgvector_utils.insert_file_chunks_into_db
+            if insert_chunks([(file_name, chunk_text, embedding) for (embedding, chunk_text) in zip(embeddings_list, chunks)]):
+                if pgvector_utils.finish_file_ingest(file_name, content_hash, chunk_hashes):
+                    return file_name 
+    except pgvector_utils.FileIngestInProgress:
+        raise
     except Exception as e:
         print(f'ERROR saving file to DB: {e}')
 
+ingest_jobs = job_utils.JobRegistry(config.INGEST_JOB_WORKERS)
+
+def ingest_file_job(job, file_name, file_bytes, open_api_key):
+    '''job body: ingest the file and register it in the files table'''
+    file_name = file_name.lower()
+    if config.INGEST_MODE == 'pipeline':
+        pipeline = ingest_utils.build_pipeline(file_name, file_bytes, open_api_key)
+        job.progress_source = pipeline.progress
+        if not pipeline.run():
+            raise RuntimeError(f'could not ingest {file_name}: {pipeline.error}')
+        stats = pipeline.get_stats()
+        job.progress['stale_chunks_deleted'] = pipeline.stale_chunks_deleted
+    else:
+        if not save_file_chunks(file_name, file_bytes, open_api_key):
+            raise RuntimeError(f'could not ingest {file_name}')
+        stats = None
+    if not pgvector_utils.insert_file(file_name):
+        raise RuntimeError(f'could not save {file_name} to the files table')
+    return {'filename': file_name, 'stats': stats}
+
+def submit_ingest_job(file_name, file_bytes, open_api_key):
+    job = ingest_jobs.submit('ingest', ingest_file_job, file_name, file_bytes, open_api_key)
+    job.progress['file_name'] = file_name
+    return job
+
 if __name__ == '__main__':
     pass 
\ No newline at end of file
@@ -0,0 +1,68 @@
+import sys
+import json
+import base64
+import struct
+import binascii
+from array import array
+
+# 'json' is a list of floats, 'base64' the little endian float32 values base64 encoded:
+# 8 KB instead of about 30 KB of decimal text for a 1536 dimensions embedding
+EMBEDDING_FORMATS = ('json', 'base64')
+
+def encode_vector(values):
+    '''base64 of the values as little endian float32'''
+    values = array('f', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+def decode_vector(data):
+    '''array('f') from encode_vector output'''
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f'invalid base64 vector: {e}')
+    if len(raw) % 4:
+        raise ValueError('base64 vector length is not a multiple of 4 bytes')
+    values = array('f')
+    values.frombytes(raw)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def parse_vector(value):
+    '''array('f') from any vector form the API accepts: a float list, '[...]' text or base64'''
+    if value is None or isinstance(value, array):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        return array('f', json.loads(value)) if value.startswith('[') else decode_vector(value)
+    return array('f', value)
+
+def format_vector(values, embedding_format='json'):
+    '''vector as returned by the API in the requested format'''
+    if values is None:
+        return None
+    if embedding_format == 'base64':
+        return encode_vector(values)
+    if embedding_format == 'json':
+        return list(values)
+    raise ValueError(f'unknown embedding format: {embedding_format}')
+
+def to_pgvector_binary(values):
+    '''pgvector binary format: dimensions and an unused uint16, then big endian float4 values'''
+    values = array('f', values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return struct.pack('>HH', len(values), 0) + values.tobytes()
+
+def from_pgvector_binary(data):
+    dimensions, _ = struct.unpack_from('>HH', data)
+    values = array('f')
+    values.frombytes(bytes(data[4:4 + 4 * dimensions]))
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+if __name__ == '__main__':
+    pass
@@ -15,21 +15,78 @@ CREATE TABLE IF NOT EXISTS questions (
   question text,
   answer text,
   project_id int,
-  embedding vector,
+  embedding vector(1536),
   chat_history text,
   created_at timestamptz DEFAULT now()
 );
 
+-- content_hash is the sha256 of the last ingested upload, re-uploading the same bytes is a no-op
 CREATE TABLE IF NOT EXISTS files (
   id SERIAL PRIMARY KEY,
   file_name text,
+  content_hash text,
   created_at timestamptz DEFAULT now()
 );
 
+-- chunk_hash lets a changed file only embed the chunks that are not stored yet
 CREATE TABLE IF NOT EXISTS file_chunks (
   id SERIAL PRIMARY KEY,
   file_name text,
   chunk_text text,
+  embedding vector(1536),
+  chunk_hash text GENERATED ALWAYS AS (md5(chunk_text)) STORED,
+  -- lexical side of hybrid retrieval, exact terms like program names and budget lines
+  chunk_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', coalesce(chunk_text, ''))) STORED,
+  created_at timestamptz DEFAULT now()
+);
+
+-- approximate nearest neighbour indexes, queried with the L2 operator <->
+CREATE INDEX IF NOT EXISTS file_chunks_embedding_hnsw_idx ON file_chunks USING hnsw (embedding vector_l2_ops);
+CREATE INDEX IF NOT EXISTS file_chunks_file_name_idx ON file_chunks (file_name, chunk_hash);
+-- unique so concurrent uploads of the same file cannot register it twice
+CREATE UNIQUE INDEX IF NOT EXISTS files_file_name_idx ON files (file_name);
+CREATE INDEX IF NOT EXISTS file_chunks_chunk_tsv_idx ON file_chunks USING gin (chunk_tsv);
+CREATE INDEX IF NOT EXISTS questions_embedding_hnsw_idx ON questions USING hnsw (embedding vector_l2_ops);
+
+-- embeddings keyed by sha256(model, text), shared by every FastAPI worker
+CREATE TABLE IF NOT EXISTS embedding_cache (
+  key text PRIMARY KEY,
+  model text,
   embedding vector,
   created_at timestamptz DEFAULT now()
 );
+
+-- generated answers reused for near-identical questions asked with the same retrieved context
+CREATE TABLE IF NOT EXISTS answer_cache (
+  id SERIAL PRIMARY KEY,
+  question text,
+  question_embedding vector(1536),
+  context_hash text,
+  review_mode text,
+  summary text,
+  chat_history text,
+  created_at timestamptz DEFAULT now()
+);
+-- no vector index: lookups filter by context first and rank its few answers exactly, an HNSW scan
+-- would filter its nearest candidates afterwards and could miss them
+CREATE INDEX IF NOT EXISTS answer_cache_context_hash_idx ON answer_cache (context_hash, review_mode, created_at);
+
+-- bumped by every statement that writes projects or files, the /bootstrap ETag is built from them
+CREATE TABLE IF NOT EXISTS table_versions (
+  table_name text PRIMARY KEY,
+  -- starts at a random value so a recreated database does not repeat earlier ETags
+  version bigint NOT NULL DEFAULT floor(random() * 1000000000)::bigint
+);
+INSERT INTO table_versions (table_name) VALUES ('projects'), ('files') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER projects_version_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON projects
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+CREATE TRIGGER files_version_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON files
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,16 @@
+-- Migrates a database created from an older init.sql (untyped `vector` columns, no indexes).
+-- Run once with: psql -h localhost -U testuser -d vectordb -f pgvector/migrations/001_typed_vector_columns.sql
+BEGIN;
+
+-- rows whose embedding does not have 1536 dimensions cannot be indexed, drop them so they can be re-uploaded
+DELETE FROM file_chunks WHERE embedding IS NOT NULL AND vector_dims(embedding) <> 1536;
+UPDATE questions SET embedding = NULL WHERE embedding IS NOT NULL AND vector_dims(embedding) <> 1536;
+
+ALTER TABLE file_chunks ALTER COLUMN embedding TYPE vector(1536) USING embedding::vector(1536);
+ALTER TABLE questions ALTER COLUMN embedding TYPE vector(1536) USING embedding::vector(1536);
+
+CREATE INDEX IF NOT EXISTS file_chunks_embedding_hnsw_idx ON file_chunks USING hnsw (embedding vector_l2_ops);
+CREATE INDEX IF NOT EXISTS file_chunks_file_name_idx ON file_chunks (file_name);
+CREATE INDEX IF NOT EXISTS questions_embedding_hnsw_idx ON questions USING hnsw (embedding vector_l2_ops);
+
+COMMIT;
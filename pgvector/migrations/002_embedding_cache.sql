@@ -0,0 +1,11 @@
+-- Adds the persistent embedding cache table.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS embedding_cache (
+  key text PRIMARY KEY,
+  model text,
+  embedding vector,
+  created_at timestamptz DEFAULT now()
+);
+
+COMMIT;
@@ -0,0 +1,16 @@
+-- Adds the semantic answer cache table.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS answer_cache (
+  id SERIAL PRIMARY KEY,
+  question text,
+  question_embedding vector(1536),
+  context_hash text,
+  summary text,
+  chat_history text,
+  created_at timestamptz DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS answer_cache_context_hash_idx ON answer_cache (context_hash, created_at);
+CREATE INDEX IF NOT EXISTS answer_cache_embedding_hnsw_idx ON answer_cache USING hnsw (question_embedding vector_cosine_ops);
+
+COMMIT;
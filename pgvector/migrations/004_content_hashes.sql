@@ -0,0 +1,20 @@
+-- Adds the file and chunk content hashes used for incremental re-ingestion.
+BEGIN;
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash text;
+-- computed for existing rows as well
+ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS chunk_hash text GENERATED ALWAYS AS (md5(chunk_text)) STORED;
+
+-- earlier uploads of the same file name added one files row each, keep the first
+DELETE FROM files f USING files older WHERE f.file_name = older.file_name AND f.id > older.id;
+-- and left duplicate chunks behind, keep one of each
+DELETE FROM file_chunks c USING file_chunks older
+WHERE c.file_name = older.file_name AND c.chunk_hash = older.chunk_hash AND c.id > older.id;
+
+DROP INDEX IF EXISTS file_chunks_file_name_idx;
+CREATE INDEX IF NOT EXISTS file_chunks_file_name_idx ON file_chunks (file_name, chunk_hash);
+-- unique, insert_file upserts on it
+DROP INDEX IF EXISTS files_file_name_idx;
+CREATE UNIQUE INDEX files_file_name_idx ON files (file_name);
+
+COMMIT;
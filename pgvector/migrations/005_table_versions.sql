@@ -0,0 +1,25 @@
+-- Adds the table version counters behind the /bootstrap ETag.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS table_versions (
+  table_name text PRIMARY KEY,
+  -- starts at a random value so a recreated database does not repeat earlier ETags
+  version bigint NOT NULL DEFAULT floor(random() * 1000000000)::bigint
+);
+INSERT INTO table_versions (table_name) VALUES ('projects'), ('files') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS projects_version_trigger ON projects;
+CREATE TRIGGER projects_version_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON projects
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+DROP TRIGGER IF EXISTS files_version_trigger ON files;
+CREATE TRIGGER files_version_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON files
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+COMMIT;
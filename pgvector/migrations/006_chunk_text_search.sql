@@ -0,0 +1,9 @@
+-- Adds the full text search column and index used by hybrid retrieval.
+BEGIN;
+
+-- computed for existing rows as well, this rewrites file_chunks
+ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS chunk_tsv tsvector
+  GENERATED ALWAYS AS (to_tsvector('english', coalesce(chunk_text, ''))) STORED;
+CREATE INDEX IF NOT EXISTS file_chunks_chunk_tsv_idx ON file_chunks USING gin (chunk_tsv);
+
+COMMIT;
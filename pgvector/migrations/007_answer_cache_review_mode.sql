@@ -0,0 +1,9 @@
+-- Keys the answer cache by review mode, answers from the sequential and parallel reviews are kept apart.
+BEGIN;
+
+-- the review mode of existing answers is unknown, they are no longer returned and age out with the TTL
+ALTER TABLE answer_cache ADD COLUMN IF NOT EXISTS review_mode text;
+DROP INDEX IF EXISTS answer_cache_context_hash_idx;
+CREATE INDEX answer_cache_context_hash_idx ON answer_cache (context_hash, review_mode, created_at);
+
+COMMIT;
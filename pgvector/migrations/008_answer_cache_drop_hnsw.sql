@@ -0,0 +1,8 @@
+-- Drops the HNSW index of the answer cache. With it the planner could take the nearest cached questions
+-- first and filter them by context_hash afterwards, missing a cached answer for the same context.
+-- Lookups use answer_cache_context_hash_idx and rank the few answers of one context exactly.
+BEGIN;
+
+DROP INDEX IF EXISTS answer_cache_embedding_hnsw_idx;
+
+COMMIT;
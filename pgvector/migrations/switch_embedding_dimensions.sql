@@ -0,0 +1,18 @@
+-- Template for switching the embedding provider (EMBEDDING_PROVIDER / EMBEDDING_DIMENSIONS), not part of the numbered sequence.
+-- Vectors of different models are not comparable, so stored chunk, question and answer cache embeddings are dropped
+-- and files have to be uploaded again. The embedding_cache table is keyed by model and is kept.
+-- all-MiniLM-L6-v2 (local): psql -h localhost -U testuser -d vectordb -v dims=384 -f pgvector/migrations/switch_embedding_dimensions.sql
+-- text-embedding-3-small:   psql -h localhost -U testuser -d vectordb -v dims=1536 -f pgvector/migrations/switch_embedding_dimensions.sql
+BEGIN;
+
+DELETE FROM file_chunks;
+DELETE FROM files;
+UPDATE questions SET embedding = NULL;
+DELETE FROM answer_cache;
+
+ALTER TABLE file_chunks ALTER COLUMN embedding TYPE vector(:dims) USING NULL;
+ALTER TABLE questions ALTER COLUMN embedding TYPE vector(:dims) USING NULL;
+ALTER TABLE answer_cache ALTER COLUMN question_embedding TYPE vector(:dims) USING NULL;
+-- the HNSW indexes on file_chunks and questions are rebuilt by ALTER COLUMN TYPE
+
+COMMIT;
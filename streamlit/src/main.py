@@ -71,12 +71,17 @@ def show_project_workspace():
     if st.button('Add New'):
         with st.expander("Add More Files", expanded=True):
             show_file_upload_popup()
+    fe_utils.render_ingest_jobs()
 
     # Initialize questions for the selected project
     if not st.session_state.get('questions'):
         st.session_state['questions'] = fast_api_utils.get_questions(project_dict[st.session_state.selected_project]) 
 
     st.header('Current Prompts')
+    if st.session_state.get('questions') and not st.session_state.get('generation_job'):
+        if st.button('Generate all responses'):
+            utils.generate_all_answers(st.session_state.get('questions'), st.session_state.get('selected_files',[]), project_dict[st.session_state.selected_project])
+    fe_utils.render_generation_job()
     if st.session_state.get('questions'):
         if st.session_state.get('selected_files'):
             fe_utils.render_questions(st.session_state.get('questions'), st.session_state.get('selected_files',[]), project_dict[st.session_state.selected_project])
@@ -96,8 +101,7 @@ def show_project_workspace():
         st.header('Save to Database')
         if st.button('Save prompts to DB'):
             with st.spinner(text="In progress..."):
-                parsed_questions = utils.format_questions(st.session_state.questions)
-                if (response := fast_api_utils.save_questions(parsed_questions,project_dict[st.session_state.selected_project])) and response.get('result'):
+                if utils.save_questions(st.session_state.questions,project_dict[st.session_state.selected_project]) is not None:
                     st.toast('Prompts saved!')
 
 def show_archived_project_page():
@@ -176,7 +180,7 @@ def show_archived_project_page():
                             st.session_state.delete_confirmed = False
                             
                             # Refresh the projects data
-                            utils.get_data_from_db(st.session_state.get('projects'),st.session_state.get('files'),st.session_state.get('credentials'))
+                            utils.refresh_data_from_db(['projects'])
                             st.rerun()
                 else:
                     st.button('Delete Selected Projects', key='delete_projects_button', disabled=True)
@@ -6,6 +6,12 @@ FASTAPI_URL='http://localhost:80/'
 if DOCKER_RUNNING:
     FASTAPI_URL='http://fastapi:80/'
 
+QUESTIONS_PAGE_SIZE = 200
+HTTP_POOL_SIZE = 10 # keep-alive connections to the API
+CACHE_TTL_SECONDS = 10 # the /bootstrap payload is used without asking the API for this long
+EMBEDDING_FORMAT = 'base64' # how embeddings travel between the app and the API: 'base64' or 'json'
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid') # 'vector' or 'hybrid' (vector and full text search)
+
 
 if __name__ =="__main__":
     pass 
\ No newline at end of file
@@ -1,9 +1,21 @@
 import requests 
+from requests.adapters import HTTPAdapter
 import streamlit as st 
 import re 
+import json 
+import time 
 
 import utils.config as config 
 
+@st.cache_resource
+def get_session()->requests.Session:
+    '''one keep-alive session for every user session and rerun, reusing pooled connections to the API'''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.HTTP_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 def parse_result_helper(response:object, default:dict={})->dict:
     if response.status_code == 200:
         return response.json()
@@ -14,24 +26,68 @@ def parse_result_helper(response:object, default:dict={})->dict:
 def get_all_records(table_name:str)->object:
     try:
         data = {"text":table_name}
-        if response := requests.post(f'{config.FASTAPI_URL}get_data',json=data):
+        if response := get_session().post(f'{config.FASTAPI_URL}get_data',json=data):
             return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR get_all_records: {e}')
 
+@st.cache_resource
+def bootstrap_cache()->dict:
+    '''last /bootstrap response as (etag, payload, fetched_at), shared by every user session'''
+    return {}
+
+def get_bootstrap()->object:
+    '''projects, files and credentials. For CACHE_TTL_SECONDS the cached payload is used without a request,
+    after that a conditional request revalidates it and a 304 keeps it for another CACHE_TTL_SECONDS'''
+    try:
+        cache = bootstrap_cache()
+        etag, payload, fetched_at = cache.get('last', (None, None, 0))
+        if payload is not None and time.monotonic() - fetched_at < config.CACHE_TTL_SECONDS:
+            return payload
+        headers = {'If-None-Match': etag} if etag else {}
+        response = get_session().get(f'{config.FASTAPI_URL}bootstrap', headers=headers)
+        if response.status_code == 304 and payload is not None:
+            cache['last'] = (etag, payload, time.monotonic())
+            return payload
+        if payload := parse_result_helper(response, None):
+            if etag := response.headers.get('ETag'):
+                cache['last'] = (etag, payload, time.monotonic())
+            return payload
+    except Exception as e:
+        print(f'ERROR get_bootstrap: {e}')
+
+def invalidate_cache():
+    '''drop the cached bootstrap payload after this app changed projects or files, the next
+    get_bootstrap asks the API again'''
+    bootstrap_cache().pop('last', None)
+
 def get_questions(selected_project:dict)->object:
+    # one page at a time, embeddings and chat histories are fetched per question when needed
     try:
-        data = {"project_id":str(selected_project.get('id'))}
-        if response := requests.get(f'{config.FASTAPI_URL}get_questions',params=data):
-            return parse_result_helper(response)
+        questions = []
+        data = {"project_id":str(selected_project.get('id')), "limit":config.QUESTIONS_PAGE_SIZE, "after_id":0,
+                "embedding_format":config.EMBEDDING_FORMAT}
+        while response := get_session().get(f'{config.FASTAPI_URL}get_questions',params=data):
+            questions += parse_result_helper(response, [])
+            if not (after_id := response.headers.get('X-Next-After-Id')):
+                return questions
+            data['after_id'] = after_id
     except Exception as e:
         print(f'ERROR get_questions: {e}')
 
+def get_question_fields(question_id:int, fields:list)->object:
+    try:
+        params = {"question_id":question_id, "fields":fields, "embedding_format":config.EMBEDDING_FORMAT}
+        if response := get_session().get(f'{config.FASTAPI_URL}get_question_fields',params=params):
+            return parse_result_helper(response)
+    except Exception as e:
+        print(f'ERROR get_question_fields: {e}')
+
 def insert_file(filename:str,file:object)->int:
     try:
         files = {'file': file.getvalue()}
         data = {'file_name':filename}
-        response = requests.post(f'{config.FASTAPI_URL}file_upload',files=files,data=data)
+        response = get_session().post(f'{config.FASTAPI_URL}file_upload',files=files,data=data)
         return response.status_code
     except Exception as e:
         print(f'ERROR insert_file: {e}')
@@ -40,11 +96,27 @@ def insert_file_v2(filename:str,file:object)->int:
     try:
         files = {'file': file.getvalue()}
         data = {'file_name':filename}
-        response = requests.post(f'{config.FASTAPI_URL}file_upload_chunks',files=files,data=data)
+        response = get_session().post(f'{config.FASTAPI_URL}file_upload_chunks',files=files,data=data)
         return response.status_code
     except Exception as e:
         print(f'ERROR insert_file_v2: {e}')
 
+def submit_ingest_job(filename:str,file_bytes:bytes)->object:
+    try:
+        files = {'file': file_bytes}
+        data = {'file_name':filename}
+        if response := get_session().post(f'{config.FASTAPI_URL}ingest_jobs',files=files,data=data):
+            return parse_result_helper(response)
+    except Exception as e:
+        print(f'ERROR submit_ingest_job: {e}')
+
+def get_ingest_job(job_id:str)->object:
+    try:
+        if response := get_session().get(f'{config.FASTAPI_URL}ingest_jobs/{job_id}'):
+            return parse_result_helper(response)
+    except Exception as e:
+        print(f'ERROR get_ingest_job: {e}')
+
 def format_file_name(file_name):
     file_name = file_name.lower()
     # file_name = re.sub(r"^\s+", "", file_name, flags = re.MULTILINE)
@@ -56,7 +128,7 @@ def insert_text_snippet(text:str)->int:
     try:
         files = {'file': bytes(text, 'utf-8')}
         data = {'file_name':f"{format_file_name(text)}.manual"}
-        response = requests.post(f'{config.FASTAPI_URL}file_upload_chunks',files=files,data=data)
+        response = get_session().post(f'{config.FASTAPI_URL}file_upload_chunks',files=files,data=data)
         return response.status_code
     except Exception as e:
         print(f'ERROR insert_text_snippet: {e}')
@@ -64,7 +136,7 @@ def insert_text_snippet(text:str)->int:
 def insert_project(project_name:str, project_description:str)->object:
     try:
         data = {'project_name':project_name, 'project_description':project_description}
-        if response := requests.post(f'{config.FASTAPI_URL}create_project',params=data):
+        if response := get_session().post(f'{config.FASTAPI_URL}create_project',params=data):
             return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR: {e}')
@@ -72,7 +144,7 @@ def insert_project(project_name:str, project_description:str)->object:
 def delete_project(project_id:str)->bool:
     try:
         params = {'project_id':project_id}
-        if response := requests.delete(f'{config.FASTAPI_URL}delete_project',params=params):
+        if response := get_session().delete(f'{config.FASTAPI_URL}delete_project',params=params):
             result = parse_result_helper(response, {'result': False})
             return result.get('result', False)
     except Exception as e:
@@ -84,14 +156,31 @@ def save_questions(questions:list[dict],selected_project:dict)->object:
         project_id = selected_project.get('id')
         data = {'questions': questions}
         params = {'project_id':project_id}
-        if response := requests.post(f'{config.FASTAPI_URL}save_questions', json=data, params=params):
+        if response := get_session().post(f'{config.FASTAPI_URL}save_questions', json=data, params=params):
             return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR save_questions: {e}')
 
+def upsert_questions(questions:list[dict],selected_project:dict,deleted_ids:list=[])->object:
+    try:
+        data = {'questions': questions, 'deleted_ids': deleted_ids}
+        params = {'project_id':selected_project.get('id')}
+        if response := get_session().post(f'{config.FASTAPI_URL}upsert_questions', json=data, params=params):
+            return parse_result_helper(response)
+    except Exception as e:
+        print(f'ERROR upsert_questions: {e}')
+
+def delete_question(question_id:int)->bool:
+    try:
+        if response := get_session().delete(f'{config.FASTAPI_URL}questions/{question_id}'):
+            return parse_result_helper(response, {'result': False}).get('result', False)
+    except Exception as e:
+        print(f'ERROR delete_question: {e}')
+        return False
+
 def check_open_ai_credentials()->object:
     try:
-        if response := requests.get(f'{config.FASTAPI_URL}check_credentials'):
+        if response := get_session().get(f'{config.FASTAPI_URL}check_credentials'):
             return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR check_open_ai_credentials: {e}')
@@ -99,7 +188,9 @@ def check_open_ai_credentials()->object:
 def get_openai_embeddings(text:str)->object:
     try:
         data = {"text":text}
-        if response := requests.post(f'{config.FASTAPI_URL}get_embeddings',json=data):
+        # base64 float32 is a quarter of the size of the float list, it is sent back as it is
+        params = {"embedding_format":config.EMBEDDING_FORMAT}
+        if response := get_session().post(f'{config.FASTAPI_URL}get_embeddings',json=data,params=params):
             return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR get_openai_embeddings: {e}')
@@ -107,7 +198,7 @@ def get_openai_embeddings(text:str)->object:
 def ask_rag_question(question:list)->object:
     try:
         data = {"question":question[1]}
-        if response := requests.post(f'{config.FASTAPI_URL}ask_auto_gen_question',data=data):
+        if response := get_session().post(f'{config.FASTAPI_URL}ask_auto_gen_question',data=data):
             return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR ask_rag_question: {e}')        
@@ -115,24 +206,57 @@ def ask_rag_question(question:list)->object:
 def ask_group_chat(qa_problem:str, context:str)->object:
     try:
         data = {"qa_problem":qa_problem, "context":context}
-        if response := requests.post(f'{config.FASTAPI_URL}construct_agent_group_chat',data=data):
+        if response := get_session().post(f'{config.FASTAPI_URL}construct_agent_group_chat',data=data):
            return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR ask_group_chat: {e}')        
 
+def ask_group_chat_stream(qa_problem:str, context:str):
+    '''yield (event, data) pairs from the Server-Sent Events of the streaming group chat endpoint'''
+    try:
+        data = {"qa_problem":qa_problem, "context":context}
+        with get_session().post(f'{config.FASTAPI_URL}construct_agent_group_chat_stream',data=data,stream=True) as response:
+            if response.status_code != 200:
+                st.error(f'Status code {response.status_code} ', icon="🚨")
+                return
+            event = 'message'
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    yield event, json.loads(line[len('data:'):])
+    except Exception as e:
+        print(f'ERROR ask_group_chat_stream: {e}')
+
+def generate_project_answers(selected_project:dict, files:list, question_ids:list)->object:
+    try:
+        data = {'project_id':selected_project.get('id'), 'files':files, 'question_ids':question_ids}
+        if response := get_session().post(f'{config.FASTAPI_URL}generate_project_answers',json=data):
+            return parse_result_helper(response)
+    except Exception as e:
+        print(f'ERROR generate_project_answers: {e}')
+
+def get_generation_job(job_id:str)->object:
+    try:
+        if response := get_session().get(f'{config.FASTAPI_URL}generation_jobs/{job_id}'):
+            return parse_result_helper(response)
+    except Exception as e:
+        print(f'ERROR get_generation_job: {e}')
+
 def construct_agent()->object: 
     try:
         if (file_paths := st.session_state.get('selected_files')) and (project_name := st.session_state.get('selected_project')):
             data = { "file_paths":file_paths, "project_name":project_name}
-            if response := requests.post(f'{config.FASTAPI_URL}construct_agent',data=data):
+            if response := get_session().post(f'{config.FASTAPI_URL}construct_agent',data=data):
                 return parse_result_helper(response)
     except Exception as e:
         print(f'ERROR construct_agent: {e}')    
 
 def get_rag_context(question:list, files:list)->object:
     try:
-        data = {"question":str(question[4]), "files":files}
-        if response := requests.post(f'{config.FASTAPI_URL}get_rag_context',data=data):
+        # the question text lets hybrid retrieval match exact terms the embedding misses
+        data = {"question":str(question[4]), "files":files, "question_text":question[1], "retrieval_mode":config.RETRIEVAL_MODE}
+        if response := get_session().post(f'{config.FASTAPI_URL}get_rag_context',data=data):
             return parse_result_helper(response, '')
     except Exception as e:
         print(f'ERROR get_rag_context: {e}')   
@@ -7,6 +7,25 @@ import utils.fast_api_utils as fast_api_utils
 def display_message_dialog(text):
     st.write(text)
 
+def live_chat_renderer():
+    '''callback that renders streamed group chat events as they arrive'''
+    answer, history = st.empty(), st.empty()
+    state = {'answer': '', 'history': ''}
+    def on_event(event, data):
+        if event == 'delta':
+            state['answer'] += data.get('content', '')
+            answer.markdown(state['answer'])
+        elif event == 'message':
+            role = f"{data.get('sender', '')} → {data.get('recipient', '')}"
+            state['history'] += utils.parse_chat_history([{'role': role, 'content': data.get('content', '')}])
+            history.markdown(state['history'])
+            if data.get('sender') == 'Writer':
+                state['answer'] = data.get('content') or ''
+                answer.markdown(state['answer'])
+        elif event == 'error':
+            st.error(data.get('detail', ''), icon="🚨")
+    return on_event
+
 def render_questions(questions,files,selected_project):
     if questions:
         for ix, question in enumerate(questions):
@@ -16,14 +35,49 @@ def render_questions(questions,files,selected_project):
                 with col1:
                     if st.button('Generate response', key=f'gen_button_{ix}'):
                         with st.spinner('Running...'):
-                            utils.ask_rag_question_update_questions_v2(questions, ix, files)
+                            utils.ask_rag_question_update_questions_v2(questions, ix, files, live_chat_renderer())
                 with col2:
                     if st.button('Display chat history', key=f'chat_history_button_{ix}'):
-                        display_message_dialog(question[5])   
+                        display_message_dialog(utils.load_chat_history(question))   
                 with col3:
                     if st.button('Delete question', key=f'delete_button_{ix}'):
                         utils.remove_question_from_list(ix,questions,selected_project) 
 
+def render_ingest_jobs():
+    if not st.session_state.get('ingest_jobs'):
+        return
+    st.markdown("### File uploads")
+    for job in utils.poll_ingest_jobs():
+        progress = job.get('progress', {})
+        label = f"{progress.get('file_name', job.get('job_id'))}: {job.get('status')}"
+        if job.get('status') == 'failed':
+            st.error(f"{label} {', '.join(job.get('errors', []))}")
+        elif progress.get('unchanged'):
+            st.write(f"{label}, unchanged since the last upload")
+        elif pages_total := progress.get('pages_total'):
+            st.progress(min(progress.get('pages_done', 0) / pages_total, 1.0), text=f"{label}, {progress.get('chunks_done', 0)} chunks saved, {progress.get('chunks_left', 0)} left")
+        else:
+            st.write(label)
+    if st.session_state.get('ingest_jobs'):
+        st.button('Refresh upload status')
+
+def render_generation_job():
+    if job := utils.poll_generation_job():
+        progress = job.get('progress', {})
+        total, done, failed = progress.get('total') or 0, progress.get('done', 0), progress.get('failed', 0)
+        label = f"{done} of {total} responses generated" + (f", {failed} failed" if failed else '')
+        if job.get('status') in ('queued', 'running'):
+            st.progress((done + failed) / total if total else 0.0, text=label)
+            st.button('Refresh generation status')
+        elif job.get('status') == 'failed' or failed:
+            st.error(f"{label}: {', '.join(job.get('errors', []))}")
+            if st.button('Reload responses'):
+                st.rerun()
+        else:
+            st.success(label)
+            if st.button('Reload responses'):
+                st.rerun()
+
 def check_credentials(): 
     if st.session_state.get('credentials') != 'OK':
             st.write('Please provide your OPEN API KEY in the config ( ./config/.env ) and restart ')
@@ -2,8 +2,6 @@ import requests
 import streamlit as st 
 from streamlit_js_eval import streamlit_js_eval
 import ast  
-from multiprocessing.pool import ThreadPool
-from multiprocessing import Pool
 
 
 import utils.config as config 
@@ -11,20 +9,37 @@ import utils.fast_api_utils as fast_api_utils
 
 def submit_manual_text():
     if manual_text := st.session_state.get('manual_text'):
-        if fast_api_utils.insert_text_snippet(manual_text) == 200:
-            delete_list_from_state_helper(['files','questions','projects'])
-            streamlit_js_eval(js_expressions="parent.window.location.reload()")           
+        file_name = f"{fast_api_utils.format_file_name(manual_text)}.manual"
+        track_ingest_job(fast_api_utils.submit_ingest_job(file_name, bytes(manual_text, 'utf-8')))
 
 def delete_list_from_state_helper(var_list):
     for item in var_list:
         if item in st.session_state:
             del st.session_state[item]
 
+def refresh_data_from_db(var_list):
+    '''drop cached projects/files after this app changed them, the next run gets them from /bootstrap'''
+    fast_api_utils.invalidate_cache()
+    delete_list_from_state_helper(var_list)
+
 def submit_files():
     if file := st.session_state.get('submit_files' ):
-        if fast_api_utils.insert_file_v2(file.name,file) == 200:
-            delete_list_from_state_helper(['files','questions','projects'])
-            streamlit_js_eval(js_expressions="parent.window.location.reload()")
+        track_ingest_job(fast_api_utils.submit_ingest_job(file.name, file.getvalue()))
+
+def track_ingest_job(job):
+    '''keep the job id so the workspace can poll its progress'''
+    if job and job.get('job_id'):
+        st.session_state.setdefault('ingest_jobs', []).append(job['job_id'])
+        st.toast(f"Upload queued: {job.get('progress', {}).get('file_name', '')}")
+
+def poll_ingest_jobs():
+    '''return the current status of tracked upload jobs, forgetting the finished ones'''
+    jobs = [job for job_id in st.session_state.get('ingest_jobs', []) if (job := fast_api_utils.get_ingest_job(job_id))]
+    st.session_state['ingest_jobs'] = [job['job_id'] for job in jobs if job.get('status') in ('queued', 'running')]
+    if any(job.get('status') == 'done' for job in jobs):
+        # new files are available, reload them on the next run
+        refresh_data_from_db(['files'])
+    return jobs
 
 def add_question_helper(project_dict, new_question):
     if selected_project := st.session_state.get('selected_project'):
@@ -36,15 +51,16 @@ def add_question_helper(project_dict, new_question):
                     st.session_state.questions.append([None, new_question, '', project_id, embedding, '', None])
 
 def construct_dict_helper(question):
-    result = {}
+    result = {'id': question[0]}
     fields = ['question','answer','project_id','embedding','chat_history']
     for ix, field in enumerate(fields):
         if field == 'embedding':    
             if embedding := question[ix + 1]:
                 result[field] = str(embedding) #ast.literal_eval(embedding) 
-            else:
+            elif question[0] is None:
                 if embedding := fast_api_utils.get_openai_embeddings(question[1]):
                     result[field] = str(embedding)
+            # saved questions are listed without their embedding, the API keeps the stored one
         else:
             result[field] = question[ix + 1]
     return result
@@ -52,18 +68,29 @@ def construct_dict_helper(question):
 def format_questions(questions):
     return [construct_dict_helper(question) for question in questions]
 
+def save_questions(questions, selected_project):
+    '''write the changed questions, new ones get the ids the API assigned'''
+    if (response := fast_api_utils.upsert_questions(format_questions(questions), selected_project)) is not None:
+        new_questions = [question for question in questions if question[0] is None]
+        for question, question_id in zip(new_questions, response.get('inserted_ids', [])):
+            question[0] = question_id
+        st.session_state['questions'] = questions
+        return response
+
 def remove_question_from_list(ix,questions,selected_project):
+    # a saved question is deleted on its own, the rest of the list is not written again
+    if questions[ix][0] is not None and not fast_api_utils.delete_question(questions[ix][0]):
+        return
     del questions[ix]
     st.session_state['questions'] = questions 
-    if selected_project:
-        if response := fast_api_utils.save_questions(questions,selected_project) and response.get('result'):
-            st.toast('Questions saved!')
+    st.toast('Question deleted!')
     st.rerun()
 
 def handle_project():
     if st.session_state.get('project_name') and st.session_state.get('project_description'):
         if response := fast_api_utils.insert_project(st.session_state.project_name, st.session_state.project_description):
             # Refresh the projects data
+            refresh_data_from_db(['projects'])
             get_data_from_db(None, None, None)
             return True
     return False
@@ -82,28 +109,59 @@ def parse_chat_history(chat_history):
         text += f"*"*10 + '\n\n'
     return text 
 
-def ask_rag_question_update_questions_v2(questions, ix, files):
-    if not (embedding := questions[ix][4]):
+def load_question_field(question, ix, field):
+    '''fill a column the questions list left out (embedding, chat_history) from the API'''
+    if question[ix] is None and question[0] is not None:
+        if result := fast_api_utils.get_question_fields(question[0], [field]):
+            question[ix] = result.get(field)
+    return question[ix]
+
+def load_chat_history(question):
+    return load_question_field(question, 5, 'chat_history') or ''
+
+def ask_rag_question_update_questions_v2(questions, ix, files, on_event=None):
+    if not (embedding := load_question_field(questions[ix], 4, 'embedding')):
         if embedding := fast_api_utils.get_openai_embeddings(questions[ix][1]):
             questions[ix][4] = embedding
     rag_context = 'None'
     if files:
         rag_context = fast_api_utils.get_rag_context(questions[ix],files)
-    if response := fast_api_utils.ask_group_chat(questions[ix][1], rag_context):
+    response = None
+    for event, data in fast_api_utils.ask_group_chat_stream(questions[ix][1], rag_context):
+        if on_event:
+            on_event(event, data)
+        if event == 'result':
+            response = data
+    if response:
         questions[ix][2] = response.get('summary','')
         questions[ix][5] = parse_chat_history(response.get('chat_history',[]))
         st.session_state['questions'] = questions 
         st.rerun()
 
+def generate_all_answers(questions, files, selected_project):
+    '''answer every saved question of the project in one background job'''
+    if question_ids := [question[0] for question in questions if question[0] is not None]:
+        if (job := fast_api_utils.generate_project_answers(selected_project, files, question_ids)) and job.get('job_id'):
+            st.session_state['generation_job'] = job['job_id']
+    else:
+        st.toast('Save prompts to DB before generating all responses')
+
+def poll_generation_job():
+    '''return the tracked generation job, reloading the questions once it has finished'''
+    if job_id := st.session_state.get('generation_job'):
+        if job := fast_api_utils.get_generation_job(job_id):
+            if job.get('status') not in ('queued', 'running'):
+                del st.session_state['generation_job']
+                delete_list_from_state_helper(['questions'])
+            return job
+
 def get_data_from_db(projects,files,credentials):
     if (not projects) or (not files) or (not credentials):
-        pool = Pool()
-        processes = [pool.apply_async(fast_api_utils.get_all_records,args=('projects',)), pool.apply_async(fast_api_utils.get_all_records,args=('files',)), pool.apply_async(fast_api_utils.check_open_ai_credentials)]
-        [process.wait() for process in processes]
-        results = [process.get() for process in processes]
-        st.session_state['projects'] = results[0]
-        st.session_state['files'] = results[1]
-        st.session_state['credentials'] = results[2]
+        # one request for all three, answered with 304 when nothing changed since the last load
+        bootstrap = fast_api_utils.get_bootstrap() or {}
+        st.session_state['projects'] = bootstrap.get('projects')
+        st.session_state['files'] = bootstrap.get('files')
+        st.session_state['credentials'] = bootstrap.get('credentials')
 
 def handle_project_select_callback():
     if st.session_state.get('questions'):